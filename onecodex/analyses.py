@@ -22,10 +22,15 @@ from onecodex.viz import (
     VizFunctionalHeatmapMixin,
 )
 from onecodex.stats import StatsMixin
+from onecodex.distance import _is_sparse
+from onecodex.taxonomy import NO_LEVEL, NO_PARENT
 
 if TYPE_CHECKING:
     import pandas as pd
 
+# approximate number of rows `write_long_table` reshapes and writes at a time
+DEFAULT_LONG_CHUNK_SIZE = 1000000
+
 
 def _get_classification_ids_without_abundances(df):
     classification_ids_without_abundances = []
@@ -35,6 +40,70 @@ def _get_classification_ids_without_abundances(df):
     return classification_ids_without_abundances
 
 
+def _sparse_nonempty_cells(df):
+    """Return the positions and values of the cells of a sparse df that aren't zero or NaN.
+
+    Returns `(rows, columns, values)` arrays ordered by column, then by row. Only the values stored
+    in each column are looked at, unless its fill value is itself non-empty.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rows, columns, values = [], [], []
+
+    for col, (_, column) in enumerate(df.items()):
+        array = column.array
+
+        if pd.isnull(array.fill_value) or array.fill_value == 0:
+            positions = array.sp_index.to_int_index().indices
+            column_values = array.sp_values
+        else:
+            column_values = np.asarray(array)
+            positions = np.arange(len(column_values))
+
+        keep = pd.notnull(column_values) & (column_values != 0)
+        rows.append(positions[keep])
+        columns.append(np.full(keep.sum(), col, dtype=np.intp))
+        values.append(column_values[keep])
+
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+
+
+def _wide_to_long(df, value_name, drop_empty=False):
+    """Reshape a wide (classifications x taxa) table into `classification_id`, `tax_id`, value rows.
+
+    Rows are ordered by taxon, then by classification. If `drop_empty`, cells that are zero or NaN
+    are left out, and a sparse table's rows are built from its non-empty cells, without making it
+    dense.
+    """
+    import numpy as np
+    import pandas as pd
+
+    n_rows, n_cols = df.shape
+
+    if drop_empty and _is_sparse(df):
+        rows, cols, values = _sparse_nonempty_cells(df)
+        classification_ids = df.index.to_numpy()[rows]
+        tax_ids = df.columns.to_numpy()[cols]
+    else:
+        if _is_sparse(df):
+            df = df.sparse.to_dense()
+
+        # column-major, so all the classifications of a taxon are next to each other
+        values = df.to_numpy().ravel(order="F")
+        classification_ids = np.tile(df.index.to_numpy(), n_cols)
+        tax_ids = np.repeat(df.columns.to_numpy(), n_rows)
+
+        if drop_empty:
+            keep = pd.notnull(values) & (values != 0)
+            values = values[keep]
+            classification_ids, tax_ids = classification_ids[keep], tax_ids[keep]
+
+    return pd.DataFrame(
+        {"classification_id": classification_ids, "tax_id": tax_ids, value_name: values}, copy=False
+    )
+
+
 @dataclass
 class MetadataFetchResults:
     # Transformed metadata
@@ -80,6 +149,18 @@ class AnalysisMixin(
         else:
             return rank
 
+    @property
+    def _taxonomy_table(self):
+        """Return the `TaxonomyTable` of `self.taxonomy`, rebuilding it if `self.taxonomy` is replaced."""
+        from onecodex.taxonomy import TaxonomyTable
+
+        cached = getattr(self, "_cached_taxonomy_table", None)
+        if cached is None or cached[0] is not self.taxonomy:
+            cached = (self.taxonomy, TaxonomyTable.from_frame(self.taxonomy))
+            self._cached_taxonomy_table = cached
+
+        return cached[1]
+
     def _guess_normalized(self):
         """Return True if the collated counts in `self._results` appear to be normalized.
 
@@ -91,7 +172,7 @@ class AnalysisMixin(
         return (
             getattr(self, "_normalized", False)
             or AbundanceMetric.has_value(self._metric)
-            or bool((self._results.sum(axis=1).round(4) == 1.0).all())
+            or bool((self._results.sum(axis=1).astype(float).round(4) == 1.0).all())
         )  # noqa
 
     def _metadata_fetch(
@@ -245,22 +326,17 @@ class AnalysisMixin(
                     magic_fields[f] = renamed_field
                     taxonomy_fields.add(f)
                 elif match_taxonomy:
-                    # try to match it up with a taxon name
+                    # try to match it up with a taxon name: an exact match, or otherwise the
+                    # partial match with the lowest tax_id
                     hits = []
 
                     # don't both searching if the query is really short
                     if len(str_f) > 4:
-                        for tax_id, tax_name in zip(self.taxonomy.index, self.taxonomy["name"]):
-                            # if it's an exact match, use that and skip the rest
-                            if str_f.lower() == tax_name.lower():
-                                hits = [(tax_id, tax_name)]
-                                break
-                            # otherwise, keep trying to match
-                            elif str_f.lower() in tax_name.lower():
-                                hits.append((tax_id, tax_name))
-
-                        # take the hit with the lowest tax_id
-                        hits = sorted(hits, key=lambda x: int(x[0]))
+                        taxonomy = self._taxonomy_table
+                        pos = taxonomy.search_name(str_f)
+
+                        if pos != NO_PARENT:
+                            hits = [(taxonomy.index[pos], taxonomy.names[pos])]
 
                     if hits:
                         # report within-rank abundance
@@ -362,7 +438,7 @@ class AnalysisMixin(
         )
         return FunctionalDataFrame(
             df,
-            ocx_metadata=self.metadata.copy(),
+            ocx_metadata=self.metadata.copy(deep=False),
             ocx_functional_group=annotation,
             ocx_metric=metric,
             ocx_feature_name_map=feature_name_map,
@@ -379,6 +455,7 @@ class AnalysisMixin(
         include_taxa_missing_rank=False,
         fill_missing=True,
         filler=0,
+        drop_empty=False,
     ):
         """Generate a ClassificationsDataFrame, performing any specified transformations.
 
@@ -410,11 +487,16 @@ class AnalysisMixin(
             Fill np.nan values
         filler : float, optional
             Value with which to fill np.nans
+        drop_empty : bool, optional
+            If `table_format` is long, leave out observations that are zero or NaN.
 
         Returns
         -------
         `ClassificationsDataFrame`
         """
+        import numpy as np
+        import pandas as pd
+
         from onecodex.dataframes import ClassificationsDataFrame
 
         if include_taxa_missing_rank:
@@ -431,9 +513,8 @@ class AnalysisMixin(
 
         rank = self._get_auto_rank(rank)
 
-        df = self._results.copy()
-        if fill_missing:
-            df = df.fillna(filler)
+        df = self._results
+        no_level_name = None
 
         # subset by taxa
         if rank:
@@ -449,34 +530,50 @@ class AnalysisMixin(
                 )
 
             level = rank.level
-            tax_ids_to_keep = []
-            unclassified_tax_ids = set()
+            taxonomy = self._taxonomy_table
+            levels = taxonomy.levels_of(df.columns)
 
-            for tax_id in df.keys():
-                try:
-                    tax_id_level = Rank(self.taxonomy["rank"][tax_id]).level
-                except ValueError:
-                    tax_id_level = None
+            tax_ids_to_keep = df.columns[levels == level].tolist()
+            unclassified_tax_ids = []
 
-                if tax_id_level == level:
-                    tax_ids_to_keep.append(tax_id)
-                elif (
-                    include_taxa_missing_rank and tax_id_level is not None and tax_id_level < level
-                ):
-                    unclassified_tax_id = self._get_highest_unclassified_tax_id(tax_id, level)
-
-                    if unclassified_tax_id is not None:
-                        unclassified_tax_ids.add(unclassified_tax_id)
+            if include_taxa_missing_rank:
+                # roll taxa ranked below `rank` that have no parent at `rank` up to the highest such
+                # taxon in their lineage, e.g. the "No genus" reads of a family
+                positions = taxonomy.positions(df.columns)
+                below_level = positions[(levels != NO_LEVEL) & (levels < level)]
+                highest = taxonomy.highest_unclassified_at_level(level)[below_level]
+                highest = np.unique(highest[highest != NO_PARENT])
+                unclassified_tax_ids = taxonomy.index[highest].tolist()
 
             if unclassified_tax_ids:
                 no_level_name = f"No {rank.value}"
-                df[no_level_name] = df[list(unclassified_tax_ids)].sum(axis=1)
-                tax_ids_to_keep.append(no_level_name)
 
-            if len(tax_ids_to_keep) == 0:
+            if len(tax_ids_to_keep) == 0 and not unclassified_tax_ids:
                 raise OneCodexException(f"No taxa kept--is rank ({rank.value}) correct?")
 
+            # only copy the columns we need, rather than the whole table
+            df = df.loc[:, tax_ids_to_keep + unclassified_tax_ids]
+
+            if fill_missing:
+                # `df` is already a copy, so there's no need for fillna() to make another
+                df.fillna(filler, inplace=True)
+        elif fill_missing:
+            df = df.fillna(filler)
+        else:
+            # a new frame sharing `_results`' data, so e.g. adding columns doesn't change `_results`
+            df = df.copy(deep=False)
+
+        if no_level_name is not None:
+            no_level = df[unclassified_tax_ids].sum(axis=1)
+            if _is_sparse(df):
+                no_level = pd.Series(
+                    pd.arrays.SparseArray(
+                        no_level.to_numpy(), fill_value=df[unclassified_tax_ids[0]].dtype.fill_value
+                    ),
+                    index=df.index,
+                )
             df = df.loc[:, tax_ids_to_keep]
+            df[no_level_name] = no_level
 
         # normalize
         if normalize is False and self._guess_normalized():
@@ -506,10 +603,10 @@ class AnalysisMixin(
 
         # additional data to copy into the ClassificationsDataFrame
         ocx_data = {
-            "ocx_metadata": self.metadata.copy(),
+            "ocx_metadata": self.metadata.copy(deep=False),
             "ocx_rank": rank,
             "ocx_metric": self._metric,
-            "ocx_taxonomy": self.taxonomy.copy(),
+            "ocx_taxonomy": self.taxonomy.copy(deep=False),
             "ocx_normalized": normalize,
             "ocx_classification_ids_without_abundances": self._classification_ids_without_abundances,
         }
@@ -517,15 +614,7 @@ class AnalysisMixin(
         # generate long-format table
         if table_format == "long":
             pretty_metric_name = self._make_pretty_metric_name(self._metric, normalize)
-
-            long_df = {"classification_id": [], "tax_id": [], pretty_metric_name: []}
-
-            for t_id in df:
-                for c_id, count in df[t_id].items():
-                    long_df["classification_id"].append(c_id)
-                    long_df["tax_id"].append(t_id)
-                    long_df[pretty_metric_name].append(count)
-
+            long_df = _wide_to_long(df, pretty_metric_name, drop_empty=drop_empty)
             results_df = ClassificationsDataFrame(long_df, **ocx_data)
         elif table_format == "wide":
             results_df = ClassificationsDataFrame(df, **ocx_data)
@@ -534,34 +623,101 @@ class AnalysisMixin(
 
         return results_df
 
-    def _get_highest_unclassified_tax_id(self, tax_id, level):
-        # try to determine if child nodes have parent nodes at the specified level. we use this to
-        # make counts of branches that "disappear" at different levels so we can insert an extra
-        # abundance for them (e.g. "No genus")
-        curr_tax_id = tax_id
-        highest_tax_id = tax_id
+    def write_long_table(
+        self,
+        path,
+        file_format="auto",
+        chunk_size=DEFAULT_LONG_CHUNK_SIZE,
+        drop_empty=False,
+        **kwargs,
+    ):
+        """Write the long-format classification results to a CSV, TSV or Parquet file.
 
-        while curr_tax_id is not None:
-            try:
-                curr_level = Rank(self.taxonomy["rank"][curr_tax_id]).level
-            except ValueError:
-                curr_level = None
+        Produces the same table as `to_df(table_format="long", ...)`, but it's reshaped and written
+        a block of taxa at a time, so the whole long-format table never has to fit in memory.
 
-            if curr_level is not None:
-                if curr_level > level:
-                    break
+        Parameters
+        ----------
+        path : `str`
+            Path of the file to write.
+        file_format : {'auto', 'csv', 'tsv', 'parquet'}, optional
+            Format of the file. By default, guessed from the extension of `path` (e.g. `.csv.gz` or
+            `.parquet`). Writing Parquet files requires `pyarrow`.
+        chunk_size : `int`, optional
+            Approximate number of rows to write at a time.
+        drop_empty : `bool`, optional
+            Leave out observations that are zero or NaN.
+        kwargs : dict, optional
+            Keyword arguments passed to `to_df`, e.g. `rank` or `normalize`, except `table_format`.
+        """
+        if "table_format" in kwargs:
+            raise OneCodexException(
+                "write_long_table() always writes the long format, so it doesn't take a "
+                "`table_format`. To write a wide table, use `to_df()` instead."
+            )
 
-                if curr_level == level:
-                    # there's something at the level we're interested in, so this is actually
-                    # classified and we don't have to keep track of it
-                    return None
+        if file_format == "auto":
+            name = path.lower()
+            for ext in (".gz", ".bz2", ".xz", ".zip", ".zst"):
+                if name.endswith(ext):
+                    name = name[: -len(ext)]
+            file_format = name.rsplit(".", 1)[-1] if "." in name else None
+            file_format = "parquet" if file_format == "pq" else file_format
+
+        if file_format not in ("csv", "tsv", "parquet"):
+            raise OneCodexException(
+                "file_format must be one of: csv, tsv, parquet (could not guess it from {})".format(
+                    path
+                )
+            )
 
-                # the highest tax id with a level definitely under the level we're classifying to
-                highest_tax_id = curr_tax_id
+        df = self.to_df(table_format="wide", **kwargs)
+        value_name = self._make_pretty_metric_name(self._metric, kwargs.get("normalize", "auto"))
+        columns_per_chunk = max(1, chunk_size // max(len(df), 1))
 
-            curr_tax_id = self.taxonomy["parent_tax_id"][curr_tax_id]
+        chunks = (
+            _wide_to_long(df.iloc[:, start : start + columns_per_chunk], value_name, drop_empty)
+            for start in range(0, max(len(df.columns), 1), columns_per_chunk)
+        )
 
-        return highest_tax_id
+        if file_format == "parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise OneCodexException(
+                    "Writing Parquet files requires pyarrow. Please install it with "
+                    "`pip install pyarrow`."
+                )
+
+            writer = None
+            try:
+                for chunk in chunks:
+                    # the schema is taken from the first chunk, and can't be inferred from an empty one
+                    if len(chunk) == 0:
+                        continue
+
+                    table = pa.Table.from_pandas(
+                        chunk,
+                        schema=writer.schema if writer is not None else None,
+                        preserve_index=False,
+                    )
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:
+                empty = _wide_to_long(df.iloc[:, :0], value_name)
+                pq.write_table(pa.Table.from_pandas(empty, preserve_index=False), path)
+        else:
+            sep = "\t" if file_format == "tsv" else ","
+            for idx, chunk in enumerate(chunks):
+                chunk.to_csv(
+                    path, sep=sep, index=False, header=idx == 0, mode="w" if idx == 0 else "a"
+                )
 
     @staticmethod
     def _make_labels_by_item_id(metadata, label):
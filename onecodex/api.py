@@ -41,6 +41,7 @@ class Api(object):
         telemetry=None,
         schema_path="/api/v1/schema",
         load_extensions=True,
+        results_cache=None,
         **kwargs
     ):
         if base_url is None:
@@ -113,6 +114,8 @@ class Api(object):
         self._session.mount("http://", adapter)
         self._session.mount("https://", adapter)
 
+        self._results_cache = self._init_results_cache(results_cache)
+
         self._copy_resources()
 
         # Optionally configure custom One Codex altair theme and renderer
@@ -130,6 +133,32 @@ class Api(object):
         else:
             self._telemetry = False
 
+    @staticmethod
+    def _init_results_cache(results_cache):
+        """Set up the opt-in on-disk cache of analysis results.
+
+        `results_cache` may be True (use the default location), a directory path, or a
+        `ResultsCache`. If it's None, the cache is enabled by setting `ONE_CODEX_RESULTS_CACHE` to
+        `1`/`true`, or to a directory path.
+        """
+        from onecodex.lib.cache import ResultsCache
+
+        if results_cache is None:
+            env_value = os.environ.get("ONE_CODEX_RESULTS_CACHE", "")
+            if env_value.lower() in ("1", "true", "yes"):
+                results_cache = True
+            elif env_value.lower() not in ("", "0", "false", "no"):
+                results_cache = env_value
+
+        if not results_cache:
+            return None
+        elif isinstance(results_cache, ResultsCache):
+            return results_cache
+        elif results_cache is True:
+            return ResultsCache()
+        else:
+            return ResultsCache(os.path.expanduser(results_cache))
+
     def _fetch_account_email(self):
         creds_file = os.path.expanduser("~/.onecodex")
 
@@ -16,6 +16,9 @@ from onecodex.auth import (
     login_required,
     login_required_experimental_api,
 )
+from onecodex.lib.download import DEFAULT_DOWNLOAD_THREADS
+from onecodex.lib.files import get_file_size
+from onecodex.lib.scheduler import DEFAULT_PART_CONCURRENCY, UploadScheduler
 from onecodex.lib.upload import DEFAULT_THREADS
 from onecodex.metadata_upload import validate_appendables
 from onecodex.scripts import subset_reads
@@ -25,13 +28,13 @@ from onecodex.utils import (
     CliLogFormatter,
     download_file_helper,
     valid_api_key,
+    valid_bandwidth,
     OPTION_HELP,
     progressbar,
     pprint,
     pretty_errors,
     run_via_threadpool,
     telemetry,
-    use_tempdir,
 )
 from onecodex.input_helpers import (
     auto_detect_pairs,
@@ -397,11 +400,17 @@ def download_group():
     help="Prompt for confirmation before downloading a large number of samples. Setting --no-prompt "
     "will allow running without any user intervention, e.g. in a script.",
 )
+@click.option(
+    "--max-threads",
+    default=DEFAULT_DOWNLOAD_THREADS,
+    help=OPTION_HELP["download_max_threads"],
+    metavar="<int:threads>",
+)
 @click.pass_context
 @pretty_errors
 @telemetry
 @login_required
-def download_samples_command(ctx, outdir, project, tags, prompt):
+def download_samples_command(ctx, outdir, project, tags, prompt, max_threads):
     """Download FASTA/Q files from One Codex.
 
     Samples may optionally be filtered by project and/or tags. By default, all samples in your
@@ -419,6 +428,7 @@ def download_samples_command(ctx, outdir, project, tags, prompt):
         tag_names=tags,
         prompt=prompt,
         progressbar=True,
+        max_threads=max_threads,
     )
 
 
@@ -430,7 +440,15 @@ def download_samples_command(ctx, outdir, project, tags, prompt):
     type=click.Path(exists=True),
     shell_complete=partial(click_path_autocomplete_helper, directory=False),
 )
-@click.option("--max-threads", default=4, help=OPTION_HELP["max_threads"], metavar="<int:threads>")
+@click.option(
+    "--max-threads", default=4, help=OPTION_HELP["upload_max_threads"], metavar="<int:threads>"
+)
+@click.option(
+    "--max-bandwidth",
+    callback=valid_bandwidth,
+    help=OPTION_HELP["max_bandwidth"],
+    metavar="<rate>",
+)
 @click.option(
     "--coerce-ascii",
     is_flag=True,
@@ -455,6 +473,8 @@ def download_samples_command(ctx, outdir, project, tags, prompt):
 @click.option("--project", "-p", "project_id", help=OPTION_HELP["project"])
 @click.option("--sample-id", help=OPTION_HELP["sample_id"])
 @click.option("--external-sample-id", help=OPTION_HELP["external_sample_id"])
+@click.option("--resume", is_flag=True, default=False, help=OPTION_HELP["resume"])
+@click.option("--compress", is_flag=True, default=False, help=OPTION_HELP["compress"])
 @click.pass_context
 @pretty_errors
 @telemetry
@@ -463,6 +483,7 @@ def upload(
     ctx,
     files,
     max_threads,
+    max_bandwidth,
     coerce_ascii,
     forward,
     reverse,
@@ -472,6 +493,8 @@ def upload(
     project_id,
     sample_id,
     external_sample_id,
+    resume,
+    compress,
 ):
     """Upload a FASTA or FASTQ (optionally gzip'd) to One Codex."""
     appendables = {}
@@ -494,68 +517,81 @@ def upload(
         click.echo("You must specify both forward and reverse files", err=True)
         ctx.exit(1)
 
-    with use_tempdir() as tempdir:
-        if forward and reverse:
-            if len(files) > 0:
-                click.echo(
-                    "You may not pass a FILES argument when using the "
-                    " --forward and --reverse options.",
-                    err=True,
-                )
-                ctx.exit(1)
-            files = [(forward, reverse)]
-        elif len(files) == 0:
-            click.echo(ctx.get_help())
-            return
-        else:
-            files_set = set(files)
-            if files_set.symmetric_difference(files):
-                click.echo(
-                    "Duplicate filenames detected in command line--please specific each file only once",
-                    err=True,
-                )
-                ctx.exit(1)
-
-            # Detecting ONT groups comes first as otherwise part of ONT group could
-            # be mistaken for a paired file
-            files = concatenate_ont_groups(files, prompt, tempdir)
-            files = auto_detect_pairs(files, prompt)
-
-        files = concatenate_multilane_files(files, prompt, tempdir)
-
-        total_size = sum(
-            [
-                (os.path.getsize(x[0]) + os.path.getsize(x[1]))
-                if isinstance(x, tuple)
-                else os.path.getsize(x)
-                for x in files
-            ]
-        )
-
-        upload_kwargs = {
-            "metadata": appendables["valid_metadata"],
-            "tags": appendables["valid_tags"],
-            "project": project_id,
-            "coerce_ascii": coerce_ascii,
-            "progressbar": progressbar(length=total_size, label="Uploading..."),
-            "sample_id": sample_id,
-            "external_sample_id": external_sample_id,
-        }
-
-        if (sample_id or external_sample_id) and len(files) > 1:
+    if forward and reverse:
+        if len(files) > 0:
+            click.echo(
+                "You may not pass a FILES argument when using the "
+                " --forward and --reverse options.",
+                err=True,
+            )
+            ctx.exit(1)
+        files = [(forward, reverse)]
+    elif len(files) == 0:
+        click.echo(ctx.get_help())
+        return
+    else:
+        files_set = set(files)
+        if files_set.symmetric_difference(files):
             click.echo(
-                "Please only specify a single file or pair of files to upload if using `sample_id` or `external_sample_id`",
+                "Duplicate filenames detected in command line--please specific each file only once",
                 err=True,
             )
             ctx.exit(1)
 
+        # Detecting ONT groups comes first as otherwise part of ONT group could
+        # be mistaken for a paired file
+        files = concatenate_ont_groups(files, prompt)
+        files = auto_detect_pairs(files, prompt)
+
+    files = concatenate_multilane_files(files, prompt)
+
+    sizes = {
+        x: (get_file_size(x[0]) + get_file_size(x[1])) if isinstance(x, tuple) else get_file_size(x)
+        for x in files
+    }
+    total_size = sum(sizes.values())
+
+    # start the largest samples first, so they aren't left running on their own at the end
+    files = sorted(files, key=sizes.get, reverse=True)
+
+    max_threads = 8 if max_threads > 8 else max_threads
+
+    # every file shares one pool of part upload slots, so a single large sample can use the
+    # whole pool once the others have finished
+    scheduler = UploadScheduler(
+        max_parts=max_threads * DEFAULT_PART_CONCURRENCY, max_bandwidth=max_bandwidth
+    )
+
+    upload_kwargs = {
+        "metadata": appendables["valid_metadata"],
+        "tags": appendables["valid_tags"],
+        "project": project_id,
+        "coerce_ascii": coerce_ascii,
+        "progressbar": progressbar(length=total_size, label="Uploading..."),
+        "sample_id": sample_id,
+        "external_sample_id": external_sample_id,
+        "resume": resume,
+        "compress": compress,
+        "scheduler": scheduler,
+    }
+
+    if (sample_id or external_sample_id) and len(files) > 1:
+        click.echo(
+            "Please only specify a single file or pair of files to upload if using `sample_id` or `external_sample_id`",
+            err=True,
+        )
+        ctx.exit(1)
+
+    try:
         run_via_threadpool(
             ctx.obj["API"].Samples.upload,
             files,
             upload_kwargs,
-            max_threads=8 if max_threads > 8 else max_threads,
+            max_threads=max_threads,
             graceful_exit=False,
         )
+    finally:
+        scheduler.shutdown(wait=False)
 
 
 @onecodex.command("login")
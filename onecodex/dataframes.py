@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from onecodex.analyses import AnalysisMixin
@@ -260,20 +261,20 @@ class OneCodexAccessor(AnalysisMixin):
 
             # prune back _taxonomy df to contain only taxa and parents
             # in the ClassificationsDataFrame
-            tree = self.tree_build()
-
             if "classification_id" in self._results.columns and "tax_id" in self._results.columns:
-                tree = self.tree_prune_tax_ids(tree, self._results["tax_id"].drop_duplicates())
+                tax_ids = self._results["tax_id"].drop_duplicates()
 
                 # similarly restrict _metadata df to contain only data relevant to samples in the df
                 self.metadata = self.metadata.loc[
                     self._results["classification_id"].drop_duplicates()
                 ]
             else:
-                tree = self.tree_prune_tax_ids(tree, self._results.columns)
+                tax_ids = self._results.columns
                 self.metadata = self.metadata.loc[self._results.index]
 
-            tax_ids_to_keep = [x.name for x in tree.traverse()]
-            self.taxonomy = self.taxonomy.loc[tax_ids_to_keep]
+            taxonomy = self._taxonomy_table
+            keep = np.flatnonzero(taxonomy.ancestors_mask(taxonomy.positions(tax_ids)))
+            self.taxonomy = self.taxonomy.iloc[keep]
+            self._cached_taxonomy_table = (self.taxonomy, taxonomy.take(keep))
         elif isinstance(pandas_obj, FunctionalDataFrame):
             self.feature_name_map = pandas_obj.ocx_feature_name_map
@@ -1,9 +1,13 @@
+import os
 import warnings
 
 from onecodex.exceptions import OneCodexException
 from onecodex.taxonomy import TaxonomyMixin
 from onecodex.lib.enums import AlphaDiversityMetric, BetaDiversityMetric, Rank
 
+# number of samples whose distances to every later sample are calculated at a time
+DEFAULT_BLOCK_SIZE = 256
+
 
 class DistanceMixin(TaxonomyMixin):
     def alpha_diversity(self, metric=AlphaDiversityMetric.Shannon, rank=Rank.Auto):
@@ -22,29 +26,79 @@ class DistanceMixin(TaxonomyMixin):
         pandas.DataFrame, a distance matrix.
         """
         import pandas as pd
-        import skbio.diversity
-
-        if not AlphaDiversityMetric.has_value(metric):
-            raise OneCodexException(
-                "For alpha diversity, metric must be one of: {}".format(
-                    ", ".join(AlphaDiversityMetric.values())
-                )
-            )
 
-        if metric == "chao1":
-            warnings.warn(
-                "`Chao1` is deprecated and will be removed in a future release. Please use `observed_taxa` instead.",
-                DeprecationWarning,
-            )
+        _check_alpha_diversity_metrics([metric])
 
         df = self.to_df(rank=rank, normalize=self._guess_normalized())
+        values = _sparse_to_csr(df).astype(float) if _is_sparse(df) else df.to_numpy(dtype=float)
+
+        return pd.DataFrame({metric: _alpha_diversity(values, metric)}, index=df.index)
+
+    def alpha_diversity_table(self, metrics=None, ranks=None):
+        """Calculate several alpha diversity metrics, at several ranks, at once.
+
+        The abundances at each rank are only fetched once, and every metric is calculated for all
+        of the samples at a time.
+
+        Parameters
+        ----------
+        metrics : `list` of {'simpson', 'observed_taxa', 'shannon'}, optional
+            The diversity metrics to calculate. Defaults to all of them. Note that Shannon diversity
+            is calculated using log base 2 instead of base ``e`` (natural log).
+        ranks : `list` of {'auto', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'}, optional
+            The ranks to calculate each metric at. Defaults to 'auto'.
+
+        Returns
+        -------
+        pandas.DataFrame, with a column for each rank and metric (as a `pandas.MultiIndex` of
+        `(rank, metric)`) and a row for each sample. `df.stack(["rank", "metric"])` returns it in
+        long format.
+
+        Examples
+        --------
+        >>> samples.alpha_diversity_table(["shannon", "simpson"], ["genus", "species"])
+        """
+        import pandas as pd
+
+        if metrics is None:
+            metrics = [
+                AlphaDiversityMetric.Simpson,
+                AlphaDiversityMetric.ObservedTaxa,
+                AlphaDiversityMetric.Shannon,
+            ]
+        if ranks is None:
+            ranks = [Rank.Auto]
+
+        _check_alpha_diversity_metrics(metrics)
+
+        columns = {}
+        index = None
+        for rank in ranks:
+            df = self.to_df(rank=rank, normalize=self._guess_normalized())
+            values = (
+                _sparse_to_csr(df).astype(float) if _is_sparse(df) else df.to_numpy(dtype=float)
+            )
+            index = df.index
 
-        skbio_metric = "sobs" if metric == "observed_taxa" else metric
-        output = skbio.diversity.alpha_diversity(skbio_metric, df.values, df.index, validate=False)
+            for metric in metrics:
+                columns[
+                    (getattr(rank, "value", rank), getattr(metric, "value", metric))
+                ] = _alpha_diversity(values, metric)
 
-        return pd.DataFrame(output, columns=[metric])
+        return pd.DataFrame(
+            columns,
+            index=index,
+            columns=pd.MultiIndex.from_tuples(columns.keys(), names=["rank", "metric"]),
+        )
 
-    def beta_diversity(self, metric=BetaDiversityMetric.BrayCurtis, rank=Rank.Auto):
+    def beta_diversity(
+        self,
+        metric=BetaDiversityMetric.BrayCurtis,
+        rank=Rank.Auto,
+        n_jobs=1,
+        block_size=DEFAULT_BLOCK_SIZE,
+        out=None,
+    ):
         """Calculate the diversity between two communities.
 
         Parameters
@@ -54,13 +108,20 @@ class DistanceMixin(TaxonomyMixin):
             Note that 'cityblock' and 'manhattan' are equivalent metrics.
         rank : {'auto', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'}, optional
             Analysis will be restricted to abundances of taxa at the specified level.
+        n_jobs : `int`, optional
+            Number of processes to calculate the distances with. -1 uses every CPU.
+        block_size : `int`, optional
+            Number of samples whose distances are calculated at a time, by each process.
+        out : `string`, optional
+            Path of a `.npy` file to write the condensed distances to, as they're calculated. Load
+            it with `numpy.load(out, mmap_mode="r")`. The distance matrix returned is still a full
+            n x n array in memory, so this doesn't lower the memory needed. Calls with `out` aren't
+            memoized, so the file is written every time.
 
         Returns
         -------
         skbio.stats.distance.DistanceMatrix, a distance matrix.
         """
-        import skbio.diversity
-
         if not BetaDiversityMetric.has_value(metric):
             raise OneCodexException(
                 "For beta diversity, metric must be one of: {}".format(
@@ -68,62 +129,99 @@ class DistanceMixin(TaxonomyMixin):
                 )
             )
 
-        if metric == BetaDiversityMetric.WeightedUnifrac:
-            return self.unifrac(weighted=True, rank=rank)
-        elif metric == BetaDiversityMetric.UnweightedUnifrac:
-            return self.unifrac(weighted=False, rank=rank)
+        if metric in (BetaDiversityMetric.WeightedUnifrac, BetaDiversityMetric.UnweightedUnifrac):
+            return self.unifrac(
+                weighted=metric == BetaDiversityMetric.WeightedUnifrac,
+                rank=rank,
+                n_jobs=n_jobs,
+                block_size=block_size,
+                out=out,
+            )
         elif metric == BetaDiversityMetric.Aitchison:
-            return self.aitchison_distance(rank=rank)
+            return self.aitchison_distance(rank=rank, n_jobs=n_jobs, block_size=block_size, out=out)
 
         df = self.to_df(rank=rank, normalize=self._guess_normalized())
 
+        if _is_sparse(df):
+            return self._sparse_beta_diversity(df, metric, out=out)
+
+        return self._pairwise_beta_diversity(
+            df, metric, n_jobs=n_jobs, block_size=block_size, out=out
+        )
+
+    def _sparse_beta_diversity(self, df, metric, out=None):
+        """Calculate Jaccard, Bray-Curtis or cityblock distances between the rows of a sparse df.
+
+        The distances are computed from a `scipy.sparse` matrix of the observed values, without
+        creating a dense samples x taxa array.
+        """
+        import numpy as np
+        from sklearn.metrics.pairwise import manhattan_distances
+        from skbio.stats.distance import DistanceMatrix
+
+        matrix = _sparse_to_csr(df).astype(float)
+
         if metric == BetaDiversityMetric.Jaccard:
-            df = df > 0  # Jaccard requires a boolean matrix, otherwise it throws a warning
+            present = (matrix > 0).astype(float)
+            shared = (present @ present.T).toarray()
+            n_present = np.asarray(present.sum(axis=1)).ravel()
+            union = n_present[:, None] + n_present[None, :] - shared
+
+            # like scipy, the distance between two empty samples is 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                distance_matrix = np.where(union > 0, 1.0 - shared / union, 0.0)
+        else:
+            distance_matrix = manhattan_distances(matrix)
+
+            if metric == BetaDiversityMetric.BrayCurtis:
+                if matrix.nnz and matrix.data.min() < 0:
+                    # the shortcut below only holds for non-negative abundances
+                    return self._pairwise_beta_diversity(df.sparse.to_dense(), metric, out=out)
+
+                totals = np.asarray(matrix.sum(axis=1)).ravel()
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    distance_matrix = distance_matrix / (totals[:, None] + totals[None, :])
+
+                # as in `blocked_pdist`, two samples with all zero abundances are 0 apart
+                distance_matrix[np.isnan(distance_matrix)] = 0.0
+
+        # keep only the upper triangle, which is exactly symmetric and hollow once expanded. copy it
+        # a row at a time, rather than indexing it with n x n / 2 arrays of positions
+        n = distance_matrix.shape[0]
+        condensed = _condensed_array(n, out=out)
+        for i in range(n - 1):
+            start = _condensed_offset(n, i)
+            condensed[start : start + n - i - 1] = distance_matrix[i, i + 1 :]
+
+        return DistanceMatrix(condensed, df.index, validate=False)
+
+    def _pairwise_beta_diversity(
+        self, df, metric, n_jobs=1, block_size=DEFAULT_BLOCK_SIZE, out=None
+    ):
+        from skbio.stats.distance import DistanceMatrix
 
         # NOTE: see #291 for a discussion on using these metrics with normalized read counts. we are
-        # explicitly disabling skbio's check for a counts matrix to allow normalized data to make
-        # its way into this function.
+        # explicitly not checking for a counts matrix to allow normalized data to make its way into
+        # this function.
+        values = df.values
+        if metric == BetaDiversityMetric.Jaccard:
+            values = values > 0  # Jaccard requires a boolean matrix, otherwise it throws a warning
+
         skbio_metric = "cityblock" if metric == "manhattan" else metric
-        return skbio.diversity.beta_diversity(
-            skbio_metric,
-            df.values,
-            df.index,
-            validate=False,
-            pairwise_func=self._pairwise_distances,
+        condensed = blocked_pdist(
+            values, skbio_metric, block_size=block_size, n_jobs=n_jobs, out=out
         )
 
-    def _pairwise_distances(self, abundances, metric):
-        import numpy as np
-        from scipy.spatial.distance import pdist, squareform
-
-        # We're using scipy's `pdist` to compute pairwise distances because it only computes one
-        # triangle of distances. `pdist` used to be scikit-bio's default, but
-        # `sklearn.metrics.pairwise_distances` is the default in more recent versions of scikit-bio.
-        # sklearn's `pairwise_distances` function computes both lower and upper triangles and can
-        # result in an asymmetric matrix due to floating-point/roundoff error, which causes
-        # `skbio.DistanceMatrix` to raise an error about symmetry. We've seen this happen to users
-        # when computing cityblock distances from normalized abundances.
-        distance_matrix = squareform(
-            pdist(abundances, metric=metric), force="tomatrix", checks=False
-        )
+        return DistanceMatrix(condensed, df.index, validate=False)
 
-        # Bray-Curtis can return nan distances when comparing samples with all zero abundances (e.g.
-        # [0, 0, 0] vs [0, 0, 0]). We replace nan distances with zero because:
-        #
-        # 1) this is a reasonable substitute value (R packages do this by default)
-        # 2) it matches how the other distance metrics behave in this case
-        # 3) it prevents `skbio.DistanceMatrix` from erroring out on nan values
-        nan_distances = np.isnan(distance_matrix)
-        if (
-            metric == BetaDiversityMetric.BrayCurtis
-            and nan_distances.any()
-            and (abundances >= 0.0).all()
-        ):
-            distance_matrix[nan_distances] = 0.0
-
-        return distance_matrix
-
-    def unifrac(self, weighted=True, rank=Rank.Auto):
+    def unifrac(
+        self,
+        weighted=True,
+        rank=Rank.Auto,
+        n_jobs=1,
+        block_size=DEFAULT_BLOCK_SIZE,
+        out=None,
+    ):
         """Calculate the UniFrac beta diversity metric.
 
         UniFrac takes into account the relatedness of community members. Weighted UniFrac considers
@@ -135,58 +233,260 @@ class DistanceMixin(TaxonomyMixin):
             Calculate the weighted (True) or unweighted (False) distance metric.
         rank : {'auto', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'}, optional
             Analysis will be restricted to abundances of taxa at the specified level.
+        n_jobs : `int`, optional
+            Number of processes to calculate the distances with. -1 uses every CPU.
+        block_size : `int`, optional
+            Number of samples whose distances are calculated at a time, by each process.
+        out : `string`, optional
+            Path of a `.npy` file to write the condensed distances to, as they're calculated. The
+            distance matrix returned is still a full n x n array in memory.
 
         Returns
         -------
         skbio.stats.distance.DistanceMatrix, a distance matrix.
+
+        Notes
+        -----
+        The tree is the taxonomy, pruned to the taxa at `rank` and their ancestors, with every
+        branch one unit long (including one above the root). Every taxon's abundance is summed into
+        each of its ancestors with a sparse lineage matrix, after which unweighted UniFrac is the
+        Jaccard distance between the taxa present in each sample, and weighted UniFrac is the
+        Manhattan distance between their proportions, normalized as by scikit-bio. The lineage
+        matrix is cached with the collection's taxonomy.
         """
-        import skbio.diversity
+        import numpy as np
+        from skbio.stats.distance import DistanceMatrix
 
         df = self.to_df(rank=rank, normalize=self._guess_normalized(), fill_missing=True)
 
-        ocx_rank = df.ocx_rank
-        # The scikit-bio implementations of phylogenetic metrics require integer counts
-        if self._guess_normalized():
-            df = df * 10e9
+        values, metric, mean_depths = self._unifrac_features(df, weighted)
+        distances = blocked_pdist(values, metric, block_size=block_size, n_jobs=n_jobs, out=out)
 
-        tax_ids = df.keys().tolist()
+        if weighted:
+            n = len(df.index)
+            for i in range(n - 1):
+                row = distances[_condensed_offset(n, i) : _condensed_offset(n, i + 1)]
+                norm = mean_depths[i] + mean_depths[i + 1 :]
+                np.divide(row, norm, out=row, where=norm > 0)
 
-        tree = self.tree_build()
-        tree = self.tree_prune_rank(tree, rank=ocx_rank)
+            if isinstance(distances, np.memmap):
+                distances.flush()
 
-        # `scikit-bio` requires that the tree root has no more than 2
-        # children, otherwise it considers it "unrooted".
-        #
-        # https://github.com/biocore/scikit-bio/blob/f3ae1dcfe8ea88e52e19f6693d79e529d05bda04/skbio/diversity/_util.py#L89
-        #
-        # Our taxonomy root regularly has more than 2 children, so we
-        # add a fake parent of `root` to the tree here.
-        from skbio.tree import TreeNode
+        return DistanceMatrix(distances, df.index, validate=False)
 
-        new_tree = TreeNode(name="fake root")
-        new_tree.rank = "no rank"
-        new_tree.append(tree)
+    def _unifrac_features(self, df, weighted):
+        """Return the values UniFrac is calculated from, for each sample in `df`.
 
-        # then finally run the calculation and return
-        if weighted:
-            return skbio.diversity.beta_diversity(
-                BetaDiversityMetric.WeightedUnifrac,
-                df,
-                df.index,
-                tree=new_tree,
-                taxa=tax_ids,
-                normalized=True,
-            )
+        Returns the abundance (weighted) or presence (unweighted) of every node of the pruned tree in
+        each sample, the `scipy` metric to compare them with and, for weighted UniFrac, the mean
+        depth of each sample's taxa, which the distances are normalized by.
+        """
+        import numpy as np
+
+        taxonomy = self._taxonomy_table
+        lineages, _ = taxonomy.lineage_matrix(taxonomy.positions(df.columns))
+
+        if _is_sparse(df):
+            counts = _sparse_to_csr(df).astype(float)
+            node_counts = (counts @ lineages).toarray()
         else:
-            return skbio.diversity.beta_diversity(
-                BetaDiversityMetric.UnweightedUnifrac,
-                df,
-                df.index,
-                tree=new_tree,
-                taxa=tax_ids,
+            counts = df.to_numpy(dtype=float)
+            node_counts = np.ascontiguousarray(counts @ lineages)
+
+        if not weighted:
+            return node_counts > 0, "jaccard", None
+
+        totals = np.asarray(counts.sum(axis=1)).ravel()
+        scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+        node_counts *= scale[:, None]
+
+        # the abundance-weighted mean distance of each sample's taxa from the root, counting the
+        # branch above the root
+        depths = np.asarray(lineages.sum(axis=1)).ravel()
+        mean_depths = np.asarray(counts @ depths).ravel() * scale
+
+        return node_counts, "cityblock", mean_depths
+
+    def update_beta_diversity(
+        self,
+        previous=None,
+        metric=BetaDiversityMetric.BrayCurtis,
+        rank=Rank.Auto,
+        block_size=DEFAULT_BLOCK_SIZE,
+        save_to=None,
+    ):
+        """Calculate beta diversity, reusing the distances between samples from a previous result.
+
+        Only the distances between samples that aren't in `previous` and every other sample are
+        calculated, e.g. when new samples have been added to a project. Distances between the
+        samples in `previous` are copied from it.
+
+        Parameters
+        ----------
+        previous : `string` or `skbio.stats.distance.DistanceMatrix`, optional
+            Path of a file saved by `update_beta_diversity(save_to=...)`, or a distance matrix
+            returned by `beta_diversity()` with the same `metric` and `rank`, and the same abundance
+            metric and normalization as this collection. Samples that aren't in this collection are
+            dropped. If None, every distance is calculated.
+        metric : {'jaccard', 'braycurtis', 'cityblock', 'manhattan', 'weighted_unifrac', 'unweighted_unifrac'}
+            The distance metric to calculate.
+        rank : {'auto', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'}, optional
+            Analysis will be restricted to abundances of taxa at the specified level.
+        block_size : `int`, optional
+            Number of new samples whose distances are calculated at a time.
+        save_to : `string`, optional
+            Path of a `.npz` file to save the distance matrix to, along with its sample IDs and the
+            metric, rank, abundance metric and normalization it was calculated with. Pass it as
+            `previous` to update the distances again later. Unlike the `.npy` files written by
+            `beta_diversity(out=...)`, which only hold the distances, these can be checked against
+            the collection.
+
+        Returns
+        -------
+        skbio.stats.distance.DistanceMatrix, a distance matrix.
+
+        Notes
+        -----
+        Aitchison distances can't be updated, since zero replacement depends on every sample.
+        """
+        import json
+
+        import numpy as np
+        from scipy.spatial.distance import cdist
+        from skbio.stats.distance import DistanceMatrix
+
+        if not BetaDiversityMetric.has_value(metric):
+            raise OneCodexException(
+                "For beta diversity, metric must be one of: {}".format(
+                    ", ".join(BetaDiversityMetric.values())
+                )
+            )
+        if metric == BetaDiversityMetric.Aitchison:
+            raise OneCodexException(
+                "Aitchison distances depend on every sample in the collection and can't be updated"
+            )
+        if block_size < 1:
+            raise OneCodexException("block_size must be at least 1")
+
+        if metric == BetaDiversityMetric.Manhattan:
+            metric = BetaDiversityMetric.CityBlock
+        metric = BetaDiversityMetric(metric)
+
+        df = self.to_df(rank=rank, normalize=self._guess_normalized())
+        params = {
+            "metric": metric.value,
+            "rank": getattr(df.ocx_rank, "value", df.ocx_rank),
+            "abundance_metric": getattr(df.ocx_metric, "value", df.ocx_metric),
+            "normalized": bool(self._guess_normalized()),
+        }
+
+        if isinstance(previous, str):
+            saved = np.load(previous, mmap_mode="r")
+            if not isinstance(saved, np.lib.npyio.NpzFile):
+                raise OneCodexException(
+                    "{} only holds distances (e.g. from beta_diversity(out=...)), not the samples "
+                    "and parameters they were calculated with. Pass a file saved by "
+                    "update_beta_diversity(save_to=...), or a DistanceMatrix, instead".format(
+                        previous
+                    )
+                )
+
+            with saved:
+                if not {"distances", "ids", "params"}.issubset(saved.files):
+                    raise OneCodexException(
+                        "{} wasn't saved by update_beta_diversity(save_to=...)".format(previous)
+                    )
+
+                saved_params = json.loads(str(saved["params"]))
+                if saved_params != params:
+                    raise OneCodexException(
+                        "{} was calculated with {}, not {}".format(previous, saved_params, params)
+                    )
+                previous = DistanceMatrix(saved["distances"], saved["ids"].tolist(), validate=False)
+
+        mean_depths = None
+        if metric in (BetaDiversityMetric.WeightedUnifrac, BetaDiversityMetric.UnweightedUnifrac):
+            values, pdist_metric, mean_depths = self._unifrac_features(
+                self.to_df(rank=rank, normalize=self._guess_normalized(), fill_missing=True),
+                weighted=metric == BetaDiversityMetric.WeightedUnifrac,
             )
+        else:
+            values = _sparse_to_csr(df).astype(float) if _is_sparse(df) else df.to_numpy()
+            pdist_metric = metric
+            if metric == BetaDiversityMetric.Jaccard:
+                values = values > 0
 
-    def aitchison_distance(self, rank=Rank.Auto):
+        if hasattr(values, "toarray"):
+            # a sparse collection: only densify `block_size` samples at a time
+            def dense(rows):
+                return values[rows].toarray()
+
+            non_negative = not values.nnz or values.data.min() >= 0.0
+        else:
+
+            def dense(rows):
+                return values[rows]
+
+            non_negative = bool((values >= 0.0).all())
+
+        # as in `blocked_pdist`, two samples with all zero abundances are 0 apart
+        zero_nans = metric == BetaDiversityMetric.BrayCurtis and non_negative
+
+        ids = df.index.tolist()
+        positions = {sample_id: pos for pos, sample_id in enumerate(ids)}
+        kept = [] if previous is None else [i for i in previous.ids if i in positions]
+        if kept:
+            previous = previous.filter(kept)
+        old = np.array([positions[i] for i in kept], dtype=np.intp)
+        new = np.setdiff1d(np.arange(len(ids)), old)
+
+        distance_matrix = np.zeros((len(ids), len(ids)))
+        if kept:
+            distance_matrix[np.ix_(old, old)] = previous.data
+
+        everyone = np.arange(len(ids))
+        for start in range(0, len(new), block_size):
+            rows = new[start : start + block_size]
+            row_values = dense(rows)
+
+            for col_start in range(0, len(ids), block_size):
+                cols = everyone[col_start : col_start + block_size]
+                block = cdist(row_values, dense(cols), metric=pdist_metric)
+
+                if zero_nans:
+                    block[np.isnan(block)] = 0.0
+                if mean_depths is not None:
+                    norm = mean_depths[rows, None] + mean_depths[None, cols]
+                    np.divide(block, norm, out=block, where=norm > 0)
+
+                distance_matrix[np.ix_(rows, cols)] = block
+                distance_matrix[np.ix_(cols, rows)] = block.T
+
+        # force the distances between new samples to be exactly symmetric and hollow
+        within = np.triu(distance_matrix[np.ix_(new, new)], k=1)
+        distance_matrix[np.ix_(new, new)] = within + within.T
+
+        dm = DistanceMatrix(distance_matrix, df.index, validate=False)
+
+        if save_to is not None:
+            with open(save_to, "wb") as f:
+                np.savez(
+                    f,
+                    distances=dm.condensed_form(),
+                    ids=np.array(ids, dtype=str),
+                    params=np.array(json.dumps(params)),
+                )
+
+        return dm
+
+    def aitchison_distance(
+        self,
+        rank=Rank.Auto,
+        n_jobs=1,
+        block_size=DEFAULT_BLOCK_SIZE,
+        out=None,
+        dtype="float64",
+    ):
         """Calculate the Aitchison distance between samples.
 
         Aitchison distance is the Euclidean distance between centre logratio-normalized samples (abundances).
@@ -197,6 +497,16 @@ class DistanceMixin(TaxonomyMixin):
         ----------
         rank : {'auto', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species'}, optional
             Analysis will be restricted to abundances of taxa at the specified level.
+        n_jobs : `int`, optional
+            Number of processes to calculate the distances with. -1 uses every CPU.
+        block_size : `int`, optional
+            Number of samples that are transformed, and whose distances are calculated, at a time.
+        out : `string`, optional
+            Path of a `.npy` file to write the condensed distances to, as they're calculated. The
+            distance matrix returned is still a full n x n array in memory.
+        dtype : {'float64', 'float32'}, optional
+            Type to store the transformed abundances and the distances as. 'float32' halves the
+            memory needed, at the cost of precision.
 
         Returns
         -------
@@ -204,22 +514,242 @@ class DistanceMixin(TaxonomyMixin):
         """
         import numpy as np
         from skbio.stats.composition import multi_replace, clr
-        from sklearn.metrics.pairwise import euclidean_distances
         from skbio.stats.distance import DistanceMatrix
 
+        if block_size < 1:
+            raise OneCodexException("block_size must be at least 1")
+
         df = self.to_df(
             rank=rank, normalize=self._guess_normalized()
         )  # get a dataframe of abundances
-        df_n0 = multi_replace(df)  # replace 0s with positive small numbers
-        df_n0_clr = clr(df_n0)  # clr-normalize
-        aitchison_array = euclidean_distances(df_n0_clr, df_n0_clr)  # get the euclidean distances
-
-        # Due to rounding differences, we must force mirroring on the matrix
-        aitchison_dm = np.zeros(aitchison_array.shape)
-        aitchison_dm[np.triu_indices(aitchison_array.shape[0], k=0)] = aitchison_array[
-            np.triu_indices(aitchison_array.shape[0], k=0)
-        ]
-        aitchison_dm = aitchison_dm + aitchison_dm.T - np.diag(np.diag(aitchison_dm))
-        aitchison_dm = DistanceMatrix(aitchison_dm, df.index)
-
-        return aitchison_dm
+
+        # zero replacement and the clr transform work on each sample independently, so transform a
+        # block of samples at a time, straight into the (possibly single-precision) result
+        sparse = _sparse_to_csr(df) if _is_sparse(df) else None
+        transformed = np.empty(df.shape, dtype=dtype)
+        for start in range(0, len(df.index), block_size):
+            stop = min(start + block_size, len(df.index))
+            if sparse is not None:
+                block = sparse[start:stop].toarray().astype(float)
+            else:
+                block = df.iloc[start:stop].to_numpy(dtype=float)
+
+            block_n0 = multi_replace(block)  # replace 0s with positive small numbers
+            transformed[start:stop] = clr(block_n0).reshape(block.shape)  # clr-normalize
+
+        # only one triangle of distances is calculated, so the result is exactly symmetric
+        distances = blocked_pdist(
+            transformed, "euclidean", block_size=block_size, n_jobs=n_jobs, out=out, dtype=dtype
+        )
+
+        return DistanceMatrix(distances, df.index, validate=False)
+
+
+def _is_sparse(df):
+    """Return True if every column of `df` is sparse, e.g. the results of a sparse collection."""
+    import pandas as pd
+
+    return len(df.columns) > 0 and all(isinstance(dt, pd.SparseDtype) for dt in df.dtypes)
+
+
+def _sparse_to_csr(df):
+    """Return a sparse df (with no missing values) as a `scipy.sparse.csr_matrix`.
+
+    `to_coo()` requires every column to have a fill value of 0. Filling in the missing values of a
+    column doesn't change its fill value if it had none to fill, so fix those columns up first.
+    """
+    import pandas as pd
+
+    nonzero_fill = {
+        col: pd.SparseDtype(dtype.subtype, 0)
+        for col, dtype in df.dtypes.items()
+        if not dtype.fill_value == 0
+    }
+    if nonzero_fill:
+        df = df.astype(nonzero_fill)
+
+    return df.sparse.to_coo().tocsr()
+
+
+def _check_alpha_diversity_metrics(metrics):
+    if not all(AlphaDiversityMetric.has_value(metric) for metric in metrics):
+        raise OneCodexException(
+            "For alpha diversity, metric must be one of: {}".format(
+                ", ".join(AlphaDiversityMetric.values())
+            )
+        )
+
+    if AlphaDiversityMetric.Chao1 in metrics:
+        warnings.warn(
+            "`Chao1` is deprecated and will be removed in a future release. Please use `observed_taxa` instead.",
+            DeprecationWarning,
+        )
+
+
+def _alpha_diversity(values, metric):
+    """Calculate an alpha diversity metric for every row of a samples x taxa array at once.
+
+    `values` is a `numpy.ndarray` or a `scipy.sparse` matrix, in which case only the non-zero
+    abundances are used. The results are the same as `scikit-bio`'s implementation of each metric.
+    """
+    import numpy as np
+    import scipy.sparse
+    from scipy.special import xlogy
+
+    n_samples = values.shape[0]
+    if scipy.sparse.issparse(values):
+        values = scipy.sparse.csr_matrix(values, copy=True)
+        values.eliminate_zeros()
+        data = values.data
+        rows = np.repeat(np.arange(n_samples), np.diff(values.indptr))
+
+        def row_sums(x):
+            return np.bincount(rows, weights=x, minlength=n_samples)
+
+        def by_row(x):
+            return x[rows]
+
+    else:
+        data = values
+
+        def row_sums(x):
+            return x.sum(axis=1, dtype=float)
+
+        def by_row(x):
+            return x[:, None]
+
+    observed = row_sums(data != 0)
+    if metric == AlphaDiversityMetric.ObservedTaxa:
+        return observed.astype(np.int64)
+
+    if metric == AlphaDiversityMetric.Chao1:
+        singles = row_sums(data == 1)
+        doubles = row_sums(data == 2)
+        return observed + singles * (singles - 1) / (2 * (doubles + 1))
+
+    totals = row_sums(data)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        proportions = data / by_row(totals)
+
+    if metric == AlphaDiversityMetric.Simpson:
+        return np.where(totals > 0, 1.0 - row_sums(proportions**2), 1.0)
+
+    # Shannon diversity, in bits
+    return np.where(observed > 1, -row_sums(xlogy(proportions, proportions)) / np.log(2), 0.0)
+
+
+def _condensed_array(n, out=None, dtype=float):
+    """Return an empty condensed distance array for `n` samples, memory-mapped to `out` if given."""
+    import numpy as np
+
+    size = n * (n - 1) // 2
+    if out is None:
+        return np.empty(size, dtype=dtype)
+
+    return np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(size,))
+
+
+def _condensed_offset(n, i):
+    """Return the position of the distance between samples `i` and `i + 1` in a condensed array."""
+    return i * n - i * (i + 1) // 2
+
+
+# the abundances, in each worker process of `blocked_pdist`
+_block_values = None
+
+
+def _init_block_worker(values):
+    global _block_values
+    _block_values = values
+
+
+def _block_worker(args):
+    return _block_distances(_block_values, *args)
+
+
+def _block_distances(values, start, stop, metric, zero_nans):
+    """Return the condensed distances between samples `start` to `stop` and every later sample."""
+    import numpy as np
+    from scipy.spatial.distance import cdist
+
+    block = cdist(values[start:stop], values[start:], metric=metric)
+    distances = np.concatenate([block[row, row + 1 :] for row in range(stop - start)])
+
+    if zero_nans:
+        distances[np.isnan(distances)] = 0.0
+
+    return distances
+
+
+def blocked_pdist(values, metric, block_size=DEFAULT_BLOCK_SIZE, n_jobs=1, out=None, dtype=float):
+    """Calculate the condensed pairwise distances between the rows of `values`, a block at a time.
+
+    Each block of `block_size` rows is compared to every later row with `scipy`'s `cdist`, so only
+    one triangle of distances is calculated, and the result is exactly symmetric. Unlike `pdist`,
+    this only needs memory for the condensed result (which can be memory-mapped to a file) and a
+    `block_size` x n block per process.
+
+    Parameters
+    ----------
+    values : `numpy.ndarray`
+        A samples x taxa array.
+    metric : {'jaccard', 'braycurtis', 'cityblock'}
+        Any metric supported by `scipy.spatial.distance.cdist`.
+    block_size : `int`, optional
+        Number of rows whose distances are calculated at a time.
+    n_jobs : `int`, optional
+        Number of processes to calculate blocks in. -1 uses every CPU.
+    out : `string`, optional
+        Path of a `.npy` file to memory-map the condensed distances to.
+    dtype : `numpy.dtype`, optional
+        Type to store the condensed distances as. They're calculated in double precision.
+
+    Returns
+    -------
+    `numpy.ndarray`, the condensed distances, as returned by `scipy.spatial.distance.pdist`.
+    """
+    import numpy as np
+
+    if block_size < 1:
+        raise OneCodexException("block_size must be at least 1")
+
+    n = values.shape[0]
+    condensed = _condensed_array(n, out=out, dtype=dtype)
+
+    # Bray-Curtis can return nan distances when comparing samples with all zero abundances (e.g.
+    # [0, 0, 0] vs [0, 0, 0]). We replace nan distances with zero because:
+    #
+    # 1) this is a reasonable substitute value (R packages do this by default)
+    # 2) it matches how the other distance metrics behave in this case
+    # 3) it prevents `skbio.DistanceMatrix` from erroring out on nan values
+    zero_nans = metric == BetaDiversityMetric.BrayCurtis and bool((values >= 0.0).all())
+
+    blocks = [
+        (start, min(start + block_size, n), metric, zero_nans)
+        for start in range(0, n - 1, block_size)
+    ]
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs > 1 and len(blocks) > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(blocks)),
+            initializer=_init_block_worker,
+            initargs=(np.ascontiguousarray(values),),
+        ) as executor:
+            results = executor.map(_block_worker, blocks)
+            for (start, stop, _, _), distances in zip(blocks, results):
+                condensed[_condensed_offset(n, start) : _condensed_offset(n, stop)] = distances
+    else:
+        for start, stop, _, _ in blocks:
+            condensed[_condensed_offset(n, start) : _condensed_offset(n, stop)] = _block_distances(
+                values, start, stop, metric, zero_nans
+            )
+
+    if isinstance(condensed, np.memmap):
+        condensed.flush()
+
+    return condensed
@@ -1,10 +1,11 @@
 import click
 import re
 import os
-import shutil
 import logging
 from collections import defaultdict
 
+from onecodex.lib.files import ConcatenatedFile
+
 # Captures parts before and after ordinal
 # (. or _ followed by num followed by . or _ and non-digits)
 ORDINAL_REV_PATTERN = r"([._])\d([._][\D._]+)$"
@@ -33,18 +34,25 @@ def _replace_paired_filename_ordinal(filename, replacement):
     return re.sub(PAIRED_ORDINAL_REV_PATTERN, replace_pattern, first_pass)
 
 
-def concatenate_ont_groups(files, prompt, tempdir):
-    """Concatenate ONT split files and return the group as a single entry on the files list."""
+def concatenate_ont_groups(files, prompt):
+    """Concatenate ONT split files and return the group as a single entry on the files list.
+
+    Each group is returned as a `ConcatenatedFile`, which reads the files back-to-back when it's
+    uploaded rather than copying them into a new file first.
+    """
     single_files = set(files)
     ont_groups = defaultdict(set)
     auto_group = True
 
     for filename in files:
+        if not isinstance(filename, str):
+            continue
+
         ont_zero_filename = _replace_filename_ordinal(filename, "0", multi_digit=True)
         if os.path.exists(ont_zero_filename):
             # strip the ordinal and preceding . or _
             base_filename = re.sub(r"[._]\d+([._][\D._]+)$", r"\1", filename)
-            base_filename = os.path.join(tempdir, os.path.basename(base_filename))
+            base_filename = os.path.basename(base_filename)
 
             ont_groups[base_filename].add(filename)
 
@@ -56,7 +64,7 @@ def concatenate_ont_groups(files, prompt, tempdir):
         n_grouped_files = 0
         for base_ont_filename, group in ont_groups.items():
             n_grouped_files += len(group)
-            group_list += f"\n  {os.path.basename(base_ont_filename)}"
+            group_list += f"\n  {base_ont_filename}"
         answer = click.confirm(
             "It appears there are {n_grouped_files} ONT files (of {n_files} total):{group_list}\nConcatenate them before upload?".format(
                 n_grouped_files=n_grouped_files,
@@ -83,7 +91,7 @@ def concatenate_ont_groups(files, prompt, tempdir):
             if expected_file not in files:
                 log.warning(
                     "Detected a gap in the ONT file sequence for "
-                    f"{os.path.basename(base_ont_filename)}, missing file:"
+                    f"{base_ont_filename}, missing file:"
                     f" {os.path.basename(expected_file)}. Skipping concatenation"
                 )
                 full_sequence = False
@@ -93,12 +101,9 @@ def concatenate_ont_groups(files, prompt, tempdir):
             continue
 
         log.info(f"Concatenating to {base_ont_filename}")
-        with open(base_ont_filename, "wb") as outf:
-            for ont_filename in expected_sequence:
-                with open(ont_filename, "rb") as inf:
-                    shutil.copyfileobj(inf, outf)
-                single_files.remove(ont_filename)
-        single_files.add(base_ont_filename)
+        for ont_filename in expected_sequence:
+            single_files.remove(ont_filename)
+        single_files.add(ConcatenatedFile(expected_sequence, base_ont_filename))
     return list(single_files)
 
 
@@ -116,8 +121,9 @@ def auto_detect_pairs(files, prompt):
     pairs = []
 
     for filename in files:
-        if filename not in single_files:
-            # filename may have been already removed as a pair
+        if filename not in single_files or not isinstance(filename, str):
+            # filename may have been already removed as a pair, or be a group of concatenated
+            # files, which we don't pair
             continue
 
         paired_r1_filename = _replace_paired_filename_ordinal(filename, "1")
@@ -252,31 +258,23 @@ def _find_multilane_groups(files):
     return multilane_groups
 
 
-def concatenate_multilane_files(files, prompt, tempdir):
+def concatenate_multilane_files(files, prompt):
     """Concatenate multilane files before uploading.
 
     The files are grouped based on filename. If `prompt` is set to True, the user
     is asked whether this should happen first.
 
-    The concatenated files replace the matched sequence files. They're put in a temporary
-    directory and overwrite any existing files.
+    The concatenated files replace the matched sequence files. Each is a `ConcatenatedFile`, which
+    reads the lanes back-to-back when it's uploaded rather than copying them into a new file.
 
-    Returns a new list with multilane groups replaced with a path to the single
-    concatenated file.
+    Returns a new list with multilane groups replaced with a single concatenated file.
     """
 
     def _concatenate_group(group, first_elem):
-        """Concatenate all the files on the list and return the target file path."""
+        """Return a `ConcatenatedFile` reading all the files on the list in order."""
         target_file_name = re.sub(pattern_lane_num, r"\1", os.path.basename(first_elem))
-        target_path = os.path.join(tempdir, os.path.basename(target_file_name))
-
-        # Overwriting all files by default
-        with open(target_path, "wb") as outf:
-            for fname in group:
-                with open(fname, "rb") as inf:
-                    # TODO: check for newline at the end of file first?
-                    shutil.copyfileobj(inf, outf)
-        return target_path
+        # TODO: check for newline at the end of each file first?
+        return ConcatenatedFile(group, target_file_name)
 
     groups = _find_multilane_groups(files)
 
@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# bump this if the format of cached entries changes, so that old entries are ignored
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_SIZE = 2 * 1024**3
+
+
+def default_cache_dir():
+    """Return the directory the results cache is stored in by default.
+
+    `ONE_CODEX_CACHE_DIR` if it's set, otherwise `onecodex` under `XDG_CACHE_HOME` (`~/.cache`).
+    Note that `~/.onecodex` can't be used, since it's the credentials file.
+    """
+    if os.environ.get("ONE_CODEX_CACHE_DIR"):
+        return os.path.expanduser(os.environ["ONE_CODEX_CACHE_DIR"])
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return os.path.join(os.path.expanduser(cache_home), "onecodex")
+
+
+class ResultsCache(object):
+    """A size-bounded, on-disk cache of analysis results, shared across sessions.
+
+    Results are stored zlib-compressed in a SQLite database. Once the cache is larger than
+    `max_size`, the least recently used results are evicted.
+
+    Parameters
+    ----------
+    path : `string`, optional
+        Directory to store the cache in. Defaults to `default_cache_dir()`.
+    max_size : `int`, optional
+        Maximum total size, in bytes, of the (compressed) cached results.
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_CACHE_SIZE):
+        self.path = os.path.abspath(path if path is not None else default_cache_dir())
+        self.max_size = max_size
+        self._db_path = os.path.join(self.path, "results.sqlite")
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, "
+                "accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def __repr__(self):
+        return "<ResultsCache {}>".format(self.path)
+
+    @contextmanager
+    def _connect(self):
+        # a new connection each time, so the cache can be used from several threads (and processes)
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(key):
+        return "{}:{}".format(CACHE_VERSION, key)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if it isn't cached."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT data FROM results WHERE key = ?", (self._key(key),)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), self._key(key))
+            )
+
+        try:
+            return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        except (zlib.error, ValueError):
+            self.delete(key)
+            return None
+
+    def set(self, key, value):
+        """Cache the JSON-serializable `value` under `key`, evicting old entries to make room.
+
+        Values that can't be serialized, or that are larger than the whole cache, aren't cached.
+        """
+        try:
+            data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            return
+        data = zlib.compress(data)
+
+        if len(data) > self.max_size:
+            return
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, data, size, accessed) VALUES (?, ?, ?, ?)",
+                (self._key(key), sqlite3.Binary(data), len(data), time.time()),
+            )
+            self._evict(conn)
+
+    def delete(self, key):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE key = ?", (self._key(key),))
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+    @property
+    def size(self):
+        """Total size, in bytes, of the cached results."""
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def __contains__(self, key):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT 1 FROM results WHERE key = ?", (self._key(key),)).fetchone()
+        return row is not None
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        evict = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed ASC"):
+            if total <= self.max_size:
+                break
+            evict.append((key,))
+            total -= size
+
+        conn.executemany("DELETE FROM results WHERE key = ?", evict)
+
+
+class MemoryCache(object):
+    """A size-bounded, in-memory least recently used cache.
+
+    Parameters
+    ----------
+    max_size : `int`
+        Maximum total size, in bytes, of the cached values, as measured by `sizeof`.
+    sizeof : `callable`
+        Returns the size of a value in bytes.
+    """
+
+    def __init__(self, max_size, sizeof):
+        self.max_size = max_size
+        self.size = 0
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<MemoryCache: {} entries, {} bytes>".format(len(self), self.size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value for `key`, marking it as recently used, or `default` if it isn't cached."""
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the least recently used values to make room.
+
+        Values larger than the whole cache aren't cached.
+        """
+        size = self._sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            if size > self.max_size:
+                return
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -1,15 +1,322 @@
+import concurrent.futures
+import json
 import logging
 import os
 import os.path
+import re
+import tempfile
+import threading
 import warnings
 
 import click
+import requests
 
 from onecodex.utils import FakeProgressBar
 from onecodex.exceptions import OneCodexException
 
 log = logging.getLogger("onecodex")
 
+DEFAULT_DOWNLOAD_THREADS = 4
+DEFAULT_DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_CHUNK_SIZE = 1024**2
+WRITE_BUFFER_SIZE = 8 * 1024**2
+MIN_SEGMENT_SIZE = 64 * 1024**2
+MAX_SEGMENT_ATTEMPTS = 3
+
+
+def _parse_content_range(value):
+    """Return the total size from a `Content-Range: bytes <start>-<end>/<size>` header, if any."""
+    match = re.match(r"^bytes \d+-\d+/(\d+)$", value or "")
+    return int(match.group(1)) if match else None
+
+
+class PartialDownload(object):
+    """A file being downloaded in byte ranges to `<path>.part`, which can be resumed later.
+
+    The ranges (segments) of the file and how much of each has been written are recorded in
+    `<path>.part.json`, so that an interrupted download can continue from the last byte written to
+    each segment.
+
+    Parameters
+    ----------
+    path : `string`
+        Path the file will be moved to once it has been downloaded.
+    size : `int`
+        Size of the file in bytes.
+    n_segments : `int`
+        Number of segments to split the file into, if the download isn't being resumed.
+    """
+
+    def __init__(self, path, size, n_segments):
+        self.path = path
+        self.part_path = path + ".part"
+        self.state_path = self.part_path + ".json"
+        self.size = size
+        self._lock = threading.Lock()
+        self.segments = self._load()
+
+        if self.segments is None:
+            bounds = [size * i // n_segments for i in range(n_segments + 1)]
+            self.segments = [[start, end, start] for start, end in zip(bounds, bounds[1:])]
+
+            # preallocate the file so that each segment can be written in place
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+            self._save()
+
+    def _load(self):
+        if not os.path.exists(self.part_path) or not os.path.exists(self.state_path):
+            return None
+
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if state.get("size") != self.size or os.path.getsize(self.part_path) != self.size:
+            return None
+
+        log.info("Resuming download of {}".format(os.path.basename(self.path)))
+        return state["segments"]
+
+    def _save(self):
+        # write atomically so an interrupted save never leaves a corrupt record behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.state_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"size": self.size, "segments": self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def downloaded(self):
+        """Return the number of bytes already written to the `.part` file."""
+        return sum(pos - start for start, _, pos in self.segments)
+
+    def advance(self, index, n_bytes):
+        """Record that `n_bytes` more bytes of segment `index` have been written."""
+        with self._lock:
+            self.segments[index][2] += n_bytes
+            self._save()
+
+    def finish(self):
+        """Move the downloaded file into place."""
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+
+
+class _EitherEvent(object):
+    """Quacks like a `threading.Event` that is set once either `first` or `second` is set."""
+
+    def __init__(self, first, second=None):
+        self.first = first
+        self.second = second
+
+    def is_set(self):
+        return self.first.is_set() or (self.second is not None and self.second.is_set())
+
+
+def _write_buffered(f, chunks, on_flush, progress_callback=None, canceled=None):
+    """Write an iterable of chunks to `f`, batching them into `WRITE_BUFFER_SIZE` writes.
+
+    `on_flush` is called with the number of bytes after each write, including when iterating over
+    `chunks` raises, so that everything received before an error is kept.
+    """
+    buf = bytearray()
+
+    def _flush():
+        if buf:
+            f.write(buf)
+            f.flush()
+            on_flush(len(buf))
+            del buf[:]
+
+    try:
+        for data in chunks:
+            if canceled is not None and canceled.is_set():
+                break
+
+            buf += data
+            if progress_callback is not None:
+                progress_callback(len(data))
+
+            if len(buf) >= WRITE_BUFFER_SIZE:
+                _flush()
+    finally:
+        _flush()
+
+
+def _download_segment(session, url, partial, index, progress_callback=None, canceled=None):
+    """Download the rest of segment `index` of `partial`, retrying from the last byte written."""
+    for attempt in range(1, MAX_SEGMENT_ATTEMPTS + 1):
+        _, end, pos = partial.segments[index]
+
+        if pos >= end or (canceled is not None and canceled.is_set()):
+            return
+
+        try:
+            resp = session.get(
+                url, headers={"Range": "bytes={}-{}".format(pos, end - 1)}, stream=True
+            )
+            resp.raise_for_status()
+
+            if resp.status_code != 206:
+                raise OneCodexException("The server does not support resuming downloads.")
+
+            with open(partial.part_path, "r+b") as f:
+                f.seek(pos)
+                _write_buffered(
+                    f,
+                    resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+                    lambda n_bytes: partial.advance(index, n_bytes),
+                    progress_callback=progress_callback,
+                    canceled=canceled,
+                )
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == MAX_SEGMENT_ATTEMPTS:
+                raise
+
+            log.debug(
+                "Retrying download of {} from byte {} ({}/{}): {}".format(
+                    os.path.basename(partial.path),
+                    partial.segments[index][2],
+                    attempt,
+                    MAX_SEGMENT_ATTEMPTS,
+                    str(e),
+                )
+            )
+
+    if partial.segments[index][2] < end and not (canceled is not None and canceled.is_set()):
+        raise OneCodexException(
+            "Download of {} ended early. Try again to resume it.".format(
+                os.path.basename(partial.path)
+            )
+        )
+
+
+def download_url(
+    session,
+    url,
+    path,
+    max_connections=DEFAULT_DOWNLOAD_CONNECTIONS,
+    progress_callback=None,
+    segment_size=MIN_SEGMENT_SIZE,
+    canceled=None,
+):
+    """Download `url` to `path`, over several connections at once and resuming any earlier attempt.
+
+    Data is written to `<path>.part` in large buffered writes and only moved to `path` once the
+    download is complete. If the server supports HTTP range requests, files larger than
+    `segment_size` are split into byte ranges that are downloaded concurrently, and a download that
+    fails or is interrupted resumes from the last byte written the next time it's attempted.
+    Otherwise, the file is downloaded in one piece.
+
+    Parameters
+    ----------
+    session : `requests.Session`
+        Session to make requests with.
+    url : `string`
+        URL to download.
+    path : `string`
+        Path to save the file to.
+    max_connections : `int`, optional
+        Maximum number of byte ranges to download at once.
+    progress_callback : `callable`, optional
+        Called with the number of bytes in each chunk of data received, plus once with the number
+        of bytes that were already downloaded, if resuming.
+    segment_size : `int`, optional
+        Minimum size of each byte range.
+    canceled : `threading.Event`, optional
+        Stop downloading once this is set. The data received so far is kept, so that the download
+        can be resumed.
+
+    Returns
+    -------
+    `string`
+        The path the file was downloaded to.
+
+    Raises
+    ------
+    concurrent.futures.CancelledError
+        If `canceled` was set before the download finished.
+    """
+    if canceled is not None and canceled.is_set():
+        raise concurrent.futures.CancelledError()
+
+    # ask for the first byte to find out whether we can use range requests and how big the file is
+    resp = session.get(url, headers={"Range": "bytes=0-0"}, stream=True)
+
+    if resp.status_code == 416:
+        # empty files can't satisfy any range
+        resp = session.get(url, stream=True)
+
+    resp.raise_for_status()
+    size = None
+    if resp.status_code == 206:
+        size = _parse_content_range(resp.headers.get("Content-Range"))
+
+    if size is None:
+        # no range support, so the whole file is on its way already
+        part_path = path + ".part"
+        with open(part_path, "wb") as f:
+            _write_buffered(
+                f,
+                resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+                lambda n_bytes: None,
+                progress_callback=progress_callback,
+                canceled=canceled,
+            )
+        if canceled is not None and canceled.is_set():
+            raise concurrent.futures.CancelledError()
+
+        os.replace(part_path, path)
+        return path
+
+    resp.close()
+
+    n_segments = max(1, min(max_connections, size // max(1, segment_size)))
+    partial = PartialDownload(path, size, n_segments)
+
+    if progress_callback is not None and partial.downloaded:
+        progress_callback(partial.downloaded)
+
+    # a failure of this download stops its other segments, but not other downloads
+    failed = threading.Event()
+    stop = _EitherEvent(failed, canceled)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(partial.segments))
+    futures = {
+        executor.submit(
+            _download_segment,
+            session,
+            url,
+            partial,
+            index,
+            progress_callback=progress_callback,
+            canceled=stop,
+        )
+        for index in range(len(partial.segments))
+    }
+
+    try:
+        while futures:
+            # use a timeout so the main thread stays responsive to ctrl+c
+            done, futures = concurrent.futures.wait(
+                futures, timeout=1, return_when=concurrent.futures.FIRST_EXCEPTION
+            )
+            for future in done:
+                future.result()
+    except BaseException:
+        failed.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown(wait=True)
+
+    if canceled is not None and canceled.is_set():
+        raise concurrent.futures.CancelledError()
+
+    partial.finish()
+    return path
+
 
 def get_project(ocx, project_name_or_id):
     project = ocx.Projects.get(project_name_or_id)
@@ -53,6 +360,7 @@ def download_samples(
     prompt=False,
     min_samples_for_prompt=50,
     progressbar=False,
+    max_threads=DEFAULT_DOWNLOAD_THREADS,
 ):
     if project_name_or_id:
         log.info("Fetching samples in project '{}'...".format(project_name_or_id))
@@ -83,15 +391,39 @@ def download_samples(
     else:
         progressbar = FakeProgressBar()
 
-    filepaths = []
+    # set on ctrl+c (or an unexpected error), to stop the downloads in progress
+    canceled = threading.Event()
+
+    def _download_sample(sample, filepath):
+        try:
+            return sample.download(path=filepath, progressbar=False, canceled=canceled)
+        except OneCodexException as e:
+            warnings.warn(
+                "Skipping download of sample {} to {}: {}".format(sample.id, filepath, str(e))
+            )
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_threads))
     with progressbar as bar:
-        for sample in samples:
-            filepath = os.path.join(outdir, get_download_filename(sample))
-            try:
-                filepaths.append(sample.download(path=filepath, progressbar=False))
-            except OneCodexException as e:
-                warnings.warn(
-                    "Skipping download of sample {} to {}: {}".format(sample.id, filepath, str(e))
-                )
-            bar.update(1)
-    return filepaths
+        futures = [
+            executor.submit(
+                _download_sample, sample, os.path.join(outdir, get_download_filename(sample))
+            )
+            for sample in samples
+        ]
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                bar.update(1)
+        except BaseException:
+            # don't wait for the downloads in progress to finish; their `.part` files are kept
+            canceled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    executor.shutdown(wait=True)
+
+    # keep the order samples were listed in
+    filepaths = [future.result() for future in futures]
+
+    return [filepath for filepath in filepaths if filepath is not None]
@@ -1,3 +1,6 @@
+import collections
+import concurrent.futures
+import gzip
 import os
 import re
 import logging
@@ -9,6 +12,10 @@ R1_FILENAME_RE = re.compile(".*[._][Rr]?[1][_.].*")
 R2_FILENAME_RE = re.compile(".*[._][Rr]?[2][_.].*")
 log = logging.getLogger("onecodex")
 
+COMPRESSED_EXTENSIONS = {".gz", ".gzip", ".bz", ".bz2", ".bzip", ".bzip2"}
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_COMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+
 
 def _check_for_ascii_filename(filename, coerce_ascii):
     """Check that the filename is ASCII.
@@ -34,13 +41,129 @@ def _check_for_ascii_filename(filename, coerce_ascii):
     return filename
 
 
+class ConcatenatedFile(object):
+    """Read-only, seekable view of several files as if they had been concatenated into one.
+
+    This lets a group of files (e.g. the lanes of a multilane run) be uploaded as a single file
+    without first copying them into a temporary file. The underlying files are opened one at a
+    time, as they are read.
+
+    Parameters
+    ----------
+    file_paths : `list` of `string`
+        Paths to the files to concatenate, in order.
+    filename : `string`
+        Name of the concatenated file, e.g. `Sample_R1.fastq.gz`.
+    """
+
+    def __init__(self, file_paths, filename):
+        self.file_paths = list(file_paths)
+        self.filename = filename
+        self._sizes = [os.path.getsize(path) for path in self.file_paths]
+        self._fsize = sum(self._sizes)
+        self._fp = None
+        self._index = 0
+        self._pos = 0
+
+    def __repr__(self):
+        return "<{} {}: {} files>".format(
+            self.__class__.__name__, self.filename, len(self.file_paths)
+        )
+
+    def _open_current(self):
+        """Open the file that `self._pos` falls in, returning `False` at EOF."""
+        if self._fp is not None:
+            return True
+
+        offset = self._pos
+        for index, size in enumerate(self._sizes):
+            if offset < size:
+                self._index = index
+                self._fp = open(self.file_paths[index], mode="rb")
+                self._fp.seek(offset)
+                return True
+            offset -= size
+
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._fsize - self._pos
+
+        chunks = []
+        while size > 0 and self._open_current():
+            chunk = self._fp.read(size)
+
+            if not chunk:
+                # move on to the next file
+                self._fp.close()
+                self._fp = None
+                continue
+
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._pos += len(chunk)
+
+        return b"".join(chunks)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._fsize
+
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+
+        self.close()
+        self._pos = offset
+        return self._pos
+
+    def size(self):
+        return self._fsize
+
+    @property
+    def len(self):
+        """Size of data left to be read."""
+        return max(0, self._fsize - self._pos)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def get_file_size(file_path):
+    """Return the size in bytes of a file path or `ConcatenatedFile`."""
+    if isinstance(file_path, ConcatenatedFile):
+        return file_path.size()
+    return os.path.getsize(file_path)
+
+
+def _filename_of(file_path):
+    if isinstance(file_path, ConcatenatedFile):
+        return file_path.filename
+    return os.path.basename(file_path)
+
+
+def _open_file(file_path):
+    """Open a file path or `ConcatenatedFile` for reading, returning the file object and its size."""
+    if isinstance(file_path, ConcatenatedFile):
+        file_path.seek(0)
+        return file_path, file_path.size()
+    return open(file_path, mode="rb"), os.path.getsize(file_path)
+
+
 def get_fastx_format(file_path):
     """Return format of given file: fasta or fastq.
 
     Assumes Illumina-style naming conventions where each file has _R1_ or _R2_ in its name.
     If the file is not fasta or fastq, raises an exception
     """
-    new_filename, ext = os.path.splitext(os.path.basename(file_path))
+    new_filename, ext = os.path.splitext(_filename_of(file_path))
 
     if ext in {".gz", ".gzip", ".bz", ".bz2", ".bzip"}:
         new_filename, ext = os.path.splitext(new_filename)
@@ -60,20 +183,20 @@ class FilePassthru(object):
 
     Parameters
     ----------
-    file_path : `string`
-        Path to file.
+    file_path : `string` or `ConcatenatedFile`
+        Path to file, or several files to be read back-to-back.
     progressbar : `click.progressbar`, optional
         The progress bar to update.
     """
 
     def __init__(self, file_path, progressbar=None):
-        self._fp = open(file_path, mode="rb")
-        self._fsize = os.path.getsize(file_path)
+        self._fp, self._fsize = _open_file(file_path)
+        self.file_path = file_path
 
         self.progressbar = progressbar
 
-        _, ext = os.path.splitext(file_path)
-        self.filename = os.path.basename(file_path)
+        self.filename = _filename_of(file_path)
+        _, ext = os.path.splitext(self.filename)
 
         if self._fsize == 0:
             raise UploadException("{}: empty files can not be uploaded".format(self.filename))
@@ -106,13 +229,12 @@ class FilePassthru(object):
 
         Notes
         -----
-        This is called if an upload fails and must be retried.
+        This is called if an upload fails and must be retried, or to skip over parts of the file
+        that were already uploaded when resuming an upload.
         """
-        assert loc == 0
-
-        # rewind progress bar
+        # move progress bar along with the file
         if self.progressbar:
-            self.progressbar.update(-self._fp.tell())
+            self.progressbar.update(loc - self._fp.tell())
 
         self._fp.seek(loc)
 
@@ -124,8 +246,230 @@ class FilePassthru(object):
         self.filename = _check_for_ascii_filename(self.filename, coerce_ascii)
 
 
+def _gzip_block(block, compresslevel):
+    # mtime=0 keeps the output deterministic, so re-reading the file produces identical bytes
+    return gzip.compress(block, compresslevel=compresslevel, mtime=0)
+
+
+class GzipCompressedPassthru(object):
+    """Wrapper around an uncompressed `file` object that gzip-compresses it on the fly.
+
+    The file is split into blocks of `block_size` bytes which are compressed independently, as
+    separate gzip members, by a pool of background threads while earlier blocks are being uploaded.
+    Concatenated gzip members are themselves a valid gzip file, so the result can be decompressed
+    with any gzip reader. Nothing is written to disk.
+
+    Parameters
+    ----------
+    file_path : `string` or `ConcatenatedFile`
+        Path to file, or several files to be read back-to-back.
+    progressbar : `click.progressbar`, optional
+        The progress bar to update. Progress is measured in uncompressed bytes.
+    threads : `int`, optional
+        Number of background compression threads.
+    compresslevel : `int`, optional
+        gzip compression level, from 1 (fastest) to 9 (smallest).
+    block_size : `int`, optional
+        Number of uncompressed bytes in each gzip member.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        progressbar=None,
+        threads=DEFAULT_COMPRESSION_THREADS,
+        compresslevel=DEFAULT_COMPRESSION_LEVEL,
+        block_size=4 * 1024**2,
+    ):
+        # the compressed size isn't known ahead of time, but won't meaningfully exceed this
+        self._fp, self._fsize = _open_file(file_path)
+        self.file_path = file_path
+        self.filename = _filename_of(file_path) + ".gz"
+        self.mime_type = "application/x-gzip"
+
+        if self._fsize == 0:
+            raise UploadException(
+                "{}: empty files can not be uploaded".format(_filename_of(file_path))
+            )
+
+        # named so that S3 uploads leave us in charge of progress, which is in uncompressed bytes
+        self._bar = progressbar
+        self._threads = max(1, threads)
+        self._compresslevel = compresslevel
+        self._block_size = block_size
+        self._executor = None
+        self._reset()
+
+    def _reset(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+        self._fp.seek(0)
+        self._executor = None
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._raw_eof = False
+        self._raw_consumed = 0
+        self._pos = 0
+
+    def _fill(self):
+        """Keep up to two blocks per thread queued for compression."""
+        if self._executor is None and not self._raw_eof:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._threads)
+
+        while not self._raw_eof and len(self._pending) < 2 * self._threads:
+            block = self._fp.read(self._block_size)
+
+            if not block:
+                self._raw_eof = True
+                self._executor.shutdown(wait=False)
+                break
+
+            future = self._executor.submit(_gzip_block, block, self._compresslevel)
+            self._pending.append((future, len(block)))
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            self._fill()
+
+            if not self._pending:
+                break
+
+            future, raw_size = self._pending.popleft()
+            self._buffer += future.result()
+            self._raw_consumed += raw_size
+
+            if self._bar:
+                self._bar.update(raw_size)
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+
+        bytes_read = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._pos += len(bytes_read)
+        return bytes_read
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, loc):
+        """Seek to a position in the compressed stream.
+
+        Notes
+        -----
+        Seeking backwards restarts compression from the beginning of the file, and seeking forwards
+        compresses and discards everything in between.
+        """
+        if loc < self._pos:
+            if self._bar:
+                self._bar.update(-self._raw_consumed)
+            self._reset()
+
+        while self._pos < loc:
+            if not self.read(min(loc - self._pos, self._block_size)):
+                break
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._fp.close()
+
+    def enforce_ascii_filename(self, coerce_ascii):
+        """Update the filename to be ASCII. Raises an exception if `coerce_ascii` is `False` and the filename is not ASCII."""
+        self.filename = _check_for_ascii_filename(self.filename, coerce_ascii)
+
+
+class GzipBlockWriter(object):
+    """Writable file object that gzip-compresses what's written to it on background threads.
+
+    The counterpart of `GzipCompressedPassthru` for output files: data is split into blocks of
+    `block_size` bytes which are compressed as separate gzip members by a pool of threads, and
+    written to `file_path` in order.
+
+    Parameters
+    ----------
+    file_path : `string`
+        Path of the gzip file to write.
+    threads : `int`, optional
+        Number of background compression threads.
+    compresslevel : `int`, optional
+        gzip compression level, from 1 (fastest) to 9 (smallest).
+    block_size : `int`, optional
+        Number of uncompressed bytes in each gzip member.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        threads=DEFAULT_COMPRESSION_THREADS,
+        compresslevel=DEFAULT_COMPRESSION_LEVEL,
+        block_size=4 * 1024**2,
+    ):
+        self._fp = open(file_path, "wb")
+        self._threads = max(1, threads)
+        self._compresslevel = compresslevel
+        self._block_size = block_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._threads)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._n_blocks = 0
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(_gzip_block, block, self._compresslevel))
+        self._n_blocks += 1
+
+    def _drain(self, keep):
+        """Write compressed blocks out until at most `keep` are still pending."""
+        while len(self._pending) > keep:
+            self._fp.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[: self._block_size])
+            del self._buffer[: self._block_size]
+            self._submit(block)
+
+            # bound memory use to two blocks per thread
+            self._drain(2 * self._threads)
+
+        return len(data)
+
+    def close(self):
+        if self._fp.closed:
+            return
+
+        try:
+            # an empty file still gets a (empty) gzip member, so that it's a valid gzip file
+            if self._buffer or self._n_blocks == 0:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._drain(0)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _wrap_file(file_path, progressbar=None, compress=False):
+    """Return a `GzipCompressedPassthru` if `compress` is set and the file is uncompressed, otherwise a `FilePassthru`."""
+    _, ext = os.path.splitext(_filename_of(file_path))
+
+    if compress and ext not in COMPRESSED_EXTENSIONS:
+        return GzipCompressedPassthru(file_path, progressbar)
+
+    return FilePassthru(file_path, progressbar)
+
+
 class PairedEndFiles(object):
-    def __init__(self, files, progressbar=None):
+    def __init__(self, files, progressbar=None, compress=False):
         if len(files) != 2:
             raise OneCodexException("Paired files uploading can only take 2 files")
 
@@ -133,33 +477,36 @@ class PairedEndFiles(object):
             if get_fastx_format(f) != "fastq":
                 raise OneCodexException("Interleaving FASTA files is currently unsupported")
 
-        if R1_FILENAME_RE.match(files[0]) and R2_FILENAME_RE.match(files[1]):
+        names = [f.filename if isinstance(f, ConcatenatedFile) else f for f in files]
+
+        if R1_FILENAME_RE.match(names[0]) and R2_FILENAME_RE.match(names[1]):
             file1 = files[0]
             file2 = files[1]
-        elif R2_FILENAME_RE.match(files[0]) and R1_FILENAME_RE.match(files[1]):
+        elif R2_FILENAME_RE.match(names[0]) and R1_FILENAME_RE.match(names[1]):
             file1 = files[1]
             file2 = files[0]
         else:
             raise OneCodexException("Paired files need to have _R1/_1 and _R2/_2 in their name")
 
-        self.r1 = FilePassthru(file1, progressbar)
-        self.r2 = FilePassthru(file2, progressbar)
+        self.r1 = _wrap_file(file1, progressbar, compress=compress)
+        self.r2 = _wrap_file(file2, progressbar, compress=compress)
 
     def enforce_ascii_filename(self, coerce_ascii):
         self.r1.enforce_ascii_filename(coerce_ascii)
         self.r2.enforce_ascii_filename(coerce_ascii)
 
 
-def get_file_wrapper(file, coerce_ascii, bar):
+def get_file_wrapper(file, coerce_ascii, bar, compress=False):
     """Take a str or tuple (str) and return the corresponding file wrapper object.
 
     If there is more than one file, it must be a paired end uploads and the filenames will be validated.
+    If `compress` is set, uncompressed files are gzip-compressed on the fly as they are uploaded.
     """
     if isinstance(file, tuple):
-        fobj = PairedEndFiles(file, bar)
+        fobj = PairedEndFiles(file, bar, compress=compress)
         fobj.enforce_ascii_filename(coerce_ascii)
         return fobj
 
-    fobj = FilePassthru(file, bar)
+    fobj = _wrap_file(file, bar, compress=compress)
     fobj.enforce_ascii_filename(coerce_ascii)
     return fobj
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from onecodex.lib.files import ConcatenatedFile
+
+log = logging.getLogger("onecodex")
+
+FINGERPRINT_BYTES = 1024**2
+
+
+def get_upload_state_dir():
+    """Return the directory used to store upload manifests, creating it if needed.
+
+    Defaults to `~/.onecodex_uploads` and may be overridden with the `ONE_CODEX_UPLOAD_STATE_DIR`
+    environment variable.
+    """
+    state_dir = os.environ.get("ONE_CODEX_UPLOAD_STATE_DIR") or os.path.expanduser(
+        "~/.onecodex_uploads"
+    )
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def file_fingerprint(file_path):
+    """Identify the contents of a local file without reading all of it.
+
+    Returns
+    -------
+    `dict`
+        The file's size and mtime, along with a SHA-1 hash of its first and last
+        `FINGERPRINT_BYTES` bytes.
+    """
+    if isinstance(file_path, ConcatenatedFile):
+        parts = [file_fingerprint(path) for path in file_path.file_paths]
+        return {"size": sum(part["size"] for part in parts), "files": parts}
+
+    stat = os.stat(file_path)
+    digest = hashlib.sha1()
+
+    with open(file_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": digest.hexdigest()}
+
+
+class UploadManifest(object):
+    """On-disk record of a multipart upload of a single local file, used to resume it later.
+
+    The manifest is stored as JSON in the upload state directory, keyed by the absolute path of the
+    file. It records the sample and S3 object the file is being uploaded to, the S3 multipart
+    upload ID and the parts that have already been sent. If the file has changed since the manifest
+    was written, the manifest is discarded.
+
+    Parameters
+    ----------
+    file_path : `string` or `ConcatenatedFile`
+        Path to the local file being uploaded. A group of concatenated files is keyed by the paths
+        of all of the files in it.
+    state_dir : `string`, optional
+        Directory to store the manifest in. Defaults to `get_upload_state_dir()`.
+    """
+
+    def __init__(self, file_path, state_dir=None):
+        if isinstance(file_path, ConcatenatedFile):
+            self.file_path = os.pathsep.join(os.path.abspath(path) for path in file_path.file_paths)
+            self.filename = file_path.filename
+        else:
+            self.file_path = os.path.abspath(file_path)
+            self.filename = os.path.basename(self.file_path)
+        self.state_dir = state_dir if state_dir is not None else get_upload_state_dir()
+        self.fingerprint = file_fingerprint(file_path)
+        self._reset()
+
+        key = hashlib.sha1(self.file_path.encode("utf-8")).hexdigest()
+        self.state_path = os.path.join(self.state_dir, "{}.json".format(key))
+
+    def _reset(self):
+        self.sample_id = None
+        self.bucket = None
+        self.key = None
+        self.upload_id = None
+        self.chunksize = None
+        self.parts = {}
+        self.completed = False
+
+    @classmethod
+    def load(cls, file_path, state_dir=None):
+        """Load the manifest for `file_path`, or return an empty one if there is no usable manifest."""
+        manifest = cls(file_path, state_dir=state_dir)
+
+        if not os.path.exists(manifest.state_path):
+            return manifest
+
+        try:
+            with open(manifest.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            log.debug("Ignoring unreadable upload manifest {}".format(manifest.state_path))
+            return manifest
+
+        if state.get("file_path") != manifest.file_path:
+            return manifest
+
+        if state.get("fingerprint") != manifest.fingerprint:
+            log.info(
+                "{} has changed since it was last uploaded, starting over".format(manifest.filename)
+            )
+            manifest.delete()
+            return manifest
+
+        manifest.sample_id = state.get("sample_id")
+        manifest.bucket = state.get("bucket")
+        manifest.key = state.get("key")
+        manifest.upload_id = state.get("upload_id")
+        manifest.chunksize = state.get("chunksize")
+        manifest.parts = {int(k): v for k, v in state.get("parts", {}).items()}
+        manifest.completed = state.get("completed", False)
+        return manifest
+
+    def bind(self, sample_id, bucket, key):
+        """Associate the manifest with an S3 object, forgetting any progress made on a different one."""
+        if (self.sample_id, self.bucket, self.key) != (sample_id, bucket, key):
+            if self.upload_id is not None or self.completed:
+                log.info(
+                    "Previous upload of {} can't be resumed, starting over".format(self.filename)
+                )
+            self._reset()
+            self.sample_id = sample_id
+            self.bucket = bucket
+            self.key = key
+        self.save()
+
+    def start(self, upload_id, chunksize):
+        """Record a newly-created S3 multipart upload."""
+        self.upload_id = upload_id
+        self.chunksize = chunksize
+        self.parts = {}
+        self.completed = False
+        self.save()
+
+    def add_part(self, part_number, etag, size):
+        """Record a part that has been uploaded to S3."""
+        self.parts[part_number] = {"ETag": etag, "Size": size}
+        self.save()
+
+    def complete(self):
+        """Record that the file has been fully uploaded to S3."""
+        self.completed = True
+        self.save()
+
+    def save(self):
+        state = {
+            "file_path": self.file_path,
+            "fingerprint": self.fingerprint,
+            "sample_id": self.sample_id,
+            "bucket": self.bucket,
+            "key": self.key,
+            "upload_id": self.upload_id,
+            "chunksize": self.chunksize,
+            "parts": {str(k): v for k, v in self.parts.items()},
+            "completed": self.completed,
+        }
+
+        # write atomically so an interrupted save never leaves a corrupt manifest behind
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def delete(self):
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
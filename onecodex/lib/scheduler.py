@@ -0,0 +1,133 @@
+import concurrent.futures
+import io
+import threading
+import time
+
+DEFAULT_PART_CONCURRENCY = 4
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket used to limit the rate at which bytes are sent.
+
+    Parameters
+    ----------
+    rate : `float`
+        Number of tokens (bytes) added to the bucket per second.
+    capacity : `float`, optional
+        Maximum number of tokens the bucket can hold, i.e. the largest burst allowed. Defaults to
+        one second's worth of tokens.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive, not {}".format(rate))
+
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else self.rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        """Take `n` tokens from the bucket, sleeping until they are available.
+
+        Callers take tokens on credit and then wait for the bucket to refill, so that concurrent
+        callers are served in the order they arrive and the long-run rate never exceeds `rate`.
+        """
+        while n > 0:
+            take = min(n, self.capacity)
+
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= take
+                wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+            if wait > 0:
+                time.sleep(wait)
+
+            n -= take
+
+
+class ThrottledReader(io.BytesIO):
+    """In-memory file-like object that draws from a `TokenBucket` as it is read.
+
+    Used as the body of S3 requests so that a bandwidth limit applies while the bytes are actually
+    being sent, rather than once per (potentially very large) part.
+    """
+
+    def __init__(self, data, bucket):
+        super(ThrottledReader, self).__init__(data)
+        self._bucket = bucket
+
+    def read(self, size=-1):
+        data = super(ThrottledReader, self).read(size)
+        self._bucket.consume(len(data))
+        return data
+
+
+class UploadScheduler(object):
+    """Share a fixed number of part upload slots, and optionally a bandwidth limit, between uploads.
+
+    Every multipart upload using the same scheduler competes for the same pool of slots, so a
+    single large file may use all of them while smaller files that finish early don't leave
+    capacity idle. A slot is taken before a part is read into memory and released once the part
+    has been sent, which also bounds memory use to `max_parts` parts in total.
+
+    Parameters
+    ----------
+    max_parts : `int`, optional
+        Maximum number of parts to upload at once, across all files.
+    max_bandwidth : `int`, optional
+        If passed, limit the combined upload rate to this many bytes per second.
+    """
+
+    def __init__(self, max_parts=DEFAULT_PART_CONCURRENCY, max_bandwidth=None):
+        self.max_parts = max(1, int(max_parts))
+        self.bandwidth = TokenBucket(max_bandwidth) if max_bandwidth else None
+        self._slots = threading.Semaphore(self.max_parts)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_parts, thread_name_prefix="onecodex-upload"
+                )
+            return self._executor
+
+    def acquire(self, timeout=None):
+        """Take a part slot, waiting up to `timeout` seconds. Returns `False` if none was free."""
+        if timeout == 0:
+            return self._slots.acquire(blocking=False)
+        return self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        """Return a part slot taken with `acquire` that wasn't handed to `submit`."""
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn` in the background using a slot taken with `acquire`.
+
+        The slot is released once `fn` finishes, or if the returned future is canceled before it
+        starts.
+        """
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def throttle(self, body):
+        """Wrap a request body so that sending it draws from the bandwidth limit, if there is one."""
+        if self.bandwidth is None:
+            return body
+        return ThrottledReader(body, self.bandwidth)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -1,19 +1,25 @@
 from __future__ import print_function, division
 
 import atexit
+import concurrent.futures
 import copy
 import logging
 import math
 import requests
 import six
+import threading
+import time
 
 from onecodex.exceptions import OneCodexException, raise_connectivity_error, raise_api_error
 from onecodex.utils import snake_case, FakeProgressBar
 from onecodex.lib.files import FilePassthru, get_file_wrapper
+from onecodex.lib.resume import UploadManifest
+from onecodex.lib.scheduler import DEFAULT_PART_CONCURRENCY, UploadScheduler
 
 
 log = logging.getLogger("onecodex")
 DEFAULT_THREADS = 4
+MAX_PART_ATTEMPTS = 3
 
 
 def _choose_boto3_chunksize(file_obj):
@@ -147,6 +153,9 @@ def upload_sequence(
     progressbar=None,
     sample_id=None,
     external_sample_id=None,
+    resume=False,
+    compress=False,
+    scheduler=None,
 ):
     """Upload a sequence file (or pair of files) to One Codex directly to S3.
 
@@ -168,6 +177,16 @@ def upload_sequence(
         If passed, will upload the file(s) to the sample with that id. Only works if the sample was pre-uploaded
     external_sample_id : `string`, optional
         If passed, will upload the file(s) to the sample with that metadata external id. Only works if the sample was pre-uploaded
+    resume : `bool`, optional
+        If true, record upload progress on disk (see `onecodex.lib.resume.UploadManifest`) and
+        continue a previous interrupted upload of the same file(s) where it left off. Interrupted
+        resumable uploads are not canceled, so that they can be resumed later.
+    compress : `bool`, optional
+        If true, gzip-compress uncompressed files on the fly as they are uploaded (see
+        `onecodex.lib.files.GzipCompressedPassthru`). Already-compressed files are sent as-is.
+    scheduler : `onecodex.lib.scheduler.UploadScheduler`, optional
+        If passed, share its part upload slots and bandwidth limit with any other uploads using it.
+        Otherwise each file gets its own slots.
 
     Returns
     -------
@@ -178,7 +197,7 @@ def upload_sequence(
         progressbar = FakeProgressBar()
 
     with progressbar as bar:
-        fobj = get_file_wrapper(file, coerce_ascii, bar)
+        fobj = get_file_wrapper(file, coerce_ascii, bar, compress=compress)
         # So we don't have to check with isinstance which is going to be some mocks in tests
         is_paired = isinstance(file, tuple)
 
@@ -189,6 +208,22 @@ def upload_sequence(
         # into a newly-created Sample model.
         # We also pass the `sample_id` and `external_sample_id`, which are typically None, to
         # support retries of pre-uploaded samples
+        if is_paired:
+            filename = "{} and {}".format(fobj.r1.filename, fobj.r2.filename)
+        else:
+            filename = fobj.filename
+
+        manifests = {}
+        if resume:
+            for wrapper in [fobj.r1, fobj.r2] if is_paired else [fobj]:
+                manifests[wrapper.file_path] = UploadManifest.load(wrapper.file_path)
+
+            # continue uploading to the sample we were uploading to before, if there was one
+            previous_sample_ids = {m.sample_id for m in manifests.values() if m.sample_id}
+            if sample_id is None and external_sample_id is None and len(previous_sample_ids) == 1:
+                sample_id = previous_sample_ids.pop()
+                log.info(f"Resuming upload of {filename} as sample {sample_id}")
+
         payload = _get_init_multipart_upload_payload(
             fobj,
             is_paired,
@@ -208,11 +243,6 @@ def upload_sequence(
             bar.canceled = True
             bar.update(1)
 
-            if is_paired:
-                filename = "{} and {}".format(fobj.r1.filename, fobj.r2.filename)
-            else:
-                filename = fobj.filename
-
             log.info(f"Canceled upload for {filename} as sample {fields['sample_id']}")
 
             try:
@@ -227,27 +257,101 @@ def upload_sequence(
                 else:
                     raise
 
-        atexit.register(cancel_atexit)
+        # resumable uploads are left in place on failure, so there's nothing to cancel
+        if not resume:
+            atexit.register(cancel_atexit)
 
-        if is_paired:
-            # 2 files to upload
-            # The backend will check for the r1 file in the callback so we upload r2 first
-            fields_pe = copy.deepcopy(fields)
-            fields_pe["file_id"] = fields_pe["paired_end_file_id"]
-            _upload_sequence_fileobj(
-                fobj.r2, fobj.r2.filename, fields_pe, samples_resource, callback=False
-            )
-            sample_id = _upload_sequence_fileobj(
-                fobj.r1, fobj.r1.filename, fields, samples_resource
-            )
-        else:
-            sample_id = _upload_sequence_fileobj(fobj, fobj.filename, fields, samples_resource)
+        try:
+            if is_paired:
+                # 2 files to upload, sent to S3 at the same time. The backend will check for the r2
+                # file in the r1 callback, so we only issue that once both files are uploaded
+                fields_pe = copy.deepcopy(fields)
+                fields_pe["file_id"] = fields_pe["paired_end_file_id"]
+                r1_manifest = manifests.get(fobj.r1.file_path)
+                r2_manifest = manifests.get(fobj.r2.file_path)
+
+                if resume:
+                    r2_manifest.bind(fields["sample_id"], fields["s3_bucket"], fields_pe["file_id"])
+                    r1_manifest.bind(fields["sample_id"], fields["s3_bucket"], fields["file_id"])
+
+                # if either file fails, stop sending the other one too
+                canceled = threading.Event()
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pair_executor:
+                    r2_future = pair_executor.submit(
+                        _upload_sequence_fileobj,
+                        fobj.r2,
+                        fobj.r2.filename,
+                        fields_pe,
+                        samples_resource,
+                        callback=False,
+                        manifest=r2_manifest,
+                        scheduler=scheduler,
+                        cancel_event=canceled,
+                    )
+
+                    try:
+                        sample_id = _upload_sequence_fileobj(
+                            fobj.r1,
+                            fobj.r1.filename,
+                            fields,
+                            samples_resource,
+                            manifest=r1_manifest,
+                            scheduler=scheduler,
+                            cancel_event=canceled,
+                            wait_for=r2_future,
+                        )
+                    except BaseException as e:
+                        canceled.set()
+
+                        if isinstance(e, concurrent.futures.CancelledError):
+                            # r1 stopped because r2 failed, so report why r2 failed instead
+                            r2_error = r2_future.exception()
+                            if r2_error is not None:
+                                raise r2_error
+                        raise
+            else:
+                manifest = manifests.get(fobj.file_path)
+
+                if resume:
+                    manifest.bind(fields["sample_id"], fields["s3_bucket"], fields["file_id"])
+
+                sample_id = _upload_sequence_fileobj(
+                    fobj,
+                    fobj.filename,
+                    fields,
+                    samples_resource,
+                    manifest=manifest,
+                    scheduler=scheduler,
+                )
+        except BaseException:
+            if resume:
+                log.info(
+                    f"Upload of {filename} as sample {fields['sample_id']} was interrupted. "
+                    "Upload the same file(s) again with `onecodex upload --resume` to continue."
+                )
+            raise
+
+        for manifest in manifests.values():
+            manifest.delete()
+
+        if not resume:
+            atexit.unregister(cancel_atexit)
 
-        atexit.unregister(cancel_atexit)
         return sample_id
 
 
-def _upload_sequence_fileobj(file_obj, file_name, fields, samples_resource, callback=True):
+def _upload_sequence_fileobj(
+    file_obj,
+    file_name,
+    fields,
+    samples_resource,
+    callback=True,
+    manifest=None,
+    scheduler=None,
+    cancel_event=None,
+    wait_for=None,
+):
     """Upload a single file-like object to One Codex to S3.
 
     Parameters
@@ -261,6 +365,17 @@ def _upload_sequence_fileobj(file_obj, file_name, fields, samples_resource, call
         The fields boto will need to have to upload to S3
     samples_resource : `onecodex.models.Samples`
         Wrapped potion-client object exposing `init_upload` and `confirm_upload` routes to mainline.
+    callback : `bool`, optional
+        If false, don't notify One Codex once the file has been uploaded, e.g. for the first file of
+        a pair.
+    manifest : `onecodex.lib.resume.UploadManifest`, optional
+        If passed, record upload progress in this manifest so the upload can be resumed.
+    scheduler : `onecodex.lib.scheduler.UploadScheduler`, optional
+        If passed, send parts using the scheduler's shared part slots.
+    cancel_event : `threading.Event`, optional
+        Stop uploading if this is set, and set it if the upload fails.
+    wait_for : `concurrent.futures.Future`, optional
+        Wait for this (e.g., the upload of the other file of a pair) before notifying One Codex.
 
     Raises
     ------
@@ -279,6 +394,10 @@ def _upload_sequence_fileobj(file_obj, file_name, fields, samples_resource, call
         samples_resource._client._root_url + fields["callback_url"]
         if callback
         else None,  # full callback url
+        manifest=manifest,
+        scheduler=scheduler,
+        cancel_event=cancel_event,
+        wait_for=wait_for,
     )
     sample_id = s3_upload.get("sample_id")
 
@@ -425,7 +544,308 @@ def _upload_asset_fileobj(file_obj, file_name, assets_resource, name=None):
     return asset_uuid
 
 
-def _s3_intermediate_upload(file_obj, file_name, fields, session, callback_url, name=None):
+def _list_uploaded_parts(client, bucket, key, upload_id, recorded_parts):
+    """Return the recorded parts of a multipart upload that S3 still has, keyed by part number.
+
+    Returns `None` if the multipart upload no longer exists (e.g., it was aborted or has expired).
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    uploaded = {}
+    kwargs = {"Bucket": bucket, "Key": key, "UploadId": upload_id}
+
+    try:
+        while True:
+            resp = client.list_parts(**kwargs)
+
+            for part in resp.get("Parts", []):
+                recorded = recorded_parts.get(part["PartNumber"])
+
+                if recorded is not None and recorded["ETag"] == part["ETag"]:
+                    uploaded[part["PartNumber"]] = {"ETag": part["ETag"], "Size": part["Size"]}
+
+            if not resp.get("IsTruncated"):
+                break
+
+            kwargs["PartNumberMarker"] = resp["NextPartNumberMarker"]
+    except (BotoCoreError, ClientError) as e:
+        log.debug("Could not list parts of multipart upload {}: {}".format(upload_id, str(e)))
+        return None
+
+    return uploaded
+
+
+def _s3_multipart_upload(
+    client,
+    file_obj,
+    file_name,
+    bucket,
+    key,
+    chunksize,
+    max_concurrency=DEFAULT_PART_CONCURRENCY,
+    progress_callback=None,
+    manifest=None,
+    scheduler=None,
+    cancel_event=None,
+):
+    """Upload a file-like object to S3, sending several parts at once.
+
+    Parts are read sequentially from `file_obj` on the calling thread and sent to S3 from the
+    worker threads of an `UploadScheduler`. A part is only read once a part slot is free, so at
+    most one part per slot is held in memory. A part that fails is retried on its own rather than
+    restarting the whole file. Objects that fit in a single part are sent with one `PutObject`
+    request.
+
+    Parameters
+    ----------
+    client : `botocore.client.S3`
+        A boto3 S3 client.
+    file_obj : `FilePassthru`, or a file-like object
+        The object to read from. Only `read(size)` is required, plus `seek(offset)` when resuming.
+    file_name : `string`
+        The file_name of the uploaded file, used in log and error messages.
+    bucket : `string`
+        The S3 bucket to upload to.
+    key : `string`
+        The S3 key to upload to.
+    chunksize : `int`
+        Size of each part in bytes.
+    max_concurrency : `int`, optional
+        Maximum number of parts to upload at once, if no `scheduler` is passed.
+    progress_callback : `callable`, optional
+        Called with the number of bytes in each part once that part has been uploaded.
+    manifest : `onecodex.lib.resume.UploadManifest`, optional
+        If passed, record progress in this manifest and skip any parts it shows as already
+        uploaded. The multipart upload is left in place on failure so that it can be resumed.
+    scheduler : `onecodex.lib.scheduler.UploadScheduler`, optional
+        If passed, compete for part slots (and bandwidth) with all other uploads using the same
+        scheduler. Otherwise, use a private scheduler with `max_concurrency` slots.
+    cancel_event : `threading.Event`, optional
+        If passed, stop uploading once this is set, and set it if this upload fails.
+
+    Raises
+    ------
+    UploadException
+        If a part could not be uploaded after `MAX_PART_ATTEMPTS` attempts.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    canceled = cancel_event if cancel_event is not None else threading.Event()
+
+    def _call_with_retries(description, fn, **kwargs):
+        for attempt in range(1, MAX_PART_ATTEMPTS + 1):
+            try:
+                return fn(**kwargs)
+            except (BotoCoreError, ClientError) as e:
+                log.debug(
+                    "Caught {} uploading {} on attempt {}/{}: {}".format(
+                        type(e).__name__, description, attempt, MAX_PART_ATTEMPTS, str(e)
+                    )
+                )
+
+                if attempt == MAX_PART_ATTEMPTS or canceled.is_set():
+                    raise
+
+                log.error(
+                    "{}: Connectivity issue, retrying {} via intermediary ({}/{})...".format(
+                        file_name, description, attempt, MAX_PART_ATTEMPTS
+                    )
+                )
+                time.sleep(2**attempt)
+
+    def _report_progress(n_bytes):
+        if progress_callback is not None:
+            progress_callback(n_bytes)
+
+    if manifest is not None and manifest.completed:
+        log.info("{}: already uploaded, skipping".format(file_name))
+        _report_progress(manifest.fingerprint["size"])
+        return
+
+    upload_id = None
+    uploaded_parts = {}
+    unsent = []
+
+    if manifest is not None and manifest.upload_id and manifest.chunksize == chunksize:
+        uploaded_parts = _list_uploaded_parts(
+            client, bucket, key, manifest.upload_id, manifest.parts
+        )
+
+        if uploaded_parts is not None:
+            upload_id = manifest.upload_id
+            log.info(
+                "{}: resuming upload, {} parts already uploaded".format(
+                    file_name, len(uploaded_parts)
+                )
+            )
+            _report_progress(sum(part["Size"] for part in uploaded_parts.values()))
+        else:
+            uploaded_parts = {}
+
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = UploadScheduler(max_parts=max_concurrency)
+
+    if upload_id is None:
+        unsent = [file_obj.read(chunksize)]
+        unsent.append(file_obj.read(chunksize) if len(unsent[0]) == chunksize else b"")
+
+        if not unsent[1]:
+            body = unsent[0]
+
+            def _put_object():
+                return client.put_object(
+                    Bucket=bucket,
+                    Key=key,
+                    Body=scheduler.throttle(body),
+                    ServerSideEncryption="AES256",
+                )
+
+            scheduler.acquire()
+            try:
+                _call_with_retries("file", _put_object)
+            except (BotoCoreError, ClientError):
+                log.debug("{}: exhausted all retries via intermediary".format(file_name))
+                raise_connectivity_error(file_name)
+            finally:
+                scheduler.release()
+
+            _report_progress(len(unsent[0]))
+
+            if manifest is not None:
+                manifest.complete()
+            return
+
+        try:
+            upload_id = _call_with_retries(
+                "file",
+                client.create_multipart_upload,
+                Bucket=bucket,
+                Key=key,
+                ServerSideEncryption="AES256",
+            )["UploadId"]
+        except (BotoCoreError, ClientError):
+            raise_connectivity_error(file_name)
+
+        if manifest is not None:
+            manifest.start(upload_id, chunksize)
+
+    def _upload_part(part_number, body):
+        if canceled.is_set():
+            raise concurrent.futures.CancelledError()
+
+        def _send():
+            # wrap the body on every attempt, so that a retry sends it from the start
+            return client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=scheduler.throttle(body),
+            )
+
+        resp = _call_with_retries("part {}".format(part_number), _send)
+        return {"PartNumber": part_number, "ETag": resp["ETag"]}, len(body)
+
+    in_flight = set()
+    parts = [
+        {"PartNumber": part_number, "ETag": part["ETag"]}
+        for part_number, part in uploaded_parts.items()
+    ]
+    part_number = 0
+    eof = False
+
+    try:
+        while not eof or in_flight:
+            if canceled.is_set():
+                raise concurrent.futures.CancelledError()
+
+            # read and send as many parts as there are free slots. only block waiting for a slot
+            # if we have nothing in flight, so that finished parts are still collected promptly
+            while not eof and scheduler.acquire(timeout=0 if in_flight else 1):
+                part_number += 1
+
+                if unsent:
+                    body = unsent.pop(0)
+                else:
+                    if part_number in uploaded_parts:
+                        while part_number in uploaded_parts:
+                            part_number += 1
+                        file_obj.seek((part_number - 1) * chunksize)
+                    body = file_obj.read(chunksize)
+
+                if not body:
+                    scheduler.release()
+                    eof = True
+                    break
+
+                in_flight.add(scheduler.submit(_upload_part, part_number, body))
+
+            if not in_flight:
+                continue
+
+            # use a timeout so the main thread stays responsive to ctrl+c
+            done, in_flight = concurrent.futures.wait(
+                in_flight, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                part, n_bytes = future.result()
+                parts.append(part)
+                _report_progress(n_bytes)
+
+                if manifest is not None:
+                    manifest.add_part(part["PartNumber"], part["ETag"], n_bytes)
+
+        _call_with_retries(
+            "file",
+            client.complete_multipart_upload,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+    except BaseException as e:
+        canceled.set()
+
+        for future in in_flight:
+            future.cancel()
+
+        if own_scheduler:
+            scheduler.shutdown(wait=False, cancel_futures=True)
+
+        if manifest is None:
+            try:
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except (BotoCoreError, ClientError):
+                log.debug("{}: failed to abort multipart upload {}".format(file_name, upload_id))
+
+        if isinstance(e, (BotoCoreError, ClientError)):
+            log.debug("{}: exhausted all retries via intermediary".format(file_name))
+            raise_connectivity_error(file_name)
+
+        raise
+    else:
+        if own_scheduler:
+            scheduler.shutdown()
+
+    if manifest is not None:
+        manifest.complete()
+
+
+def _s3_intermediate_upload(
+    file_obj,
+    file_name,
+    fields,
+    session,
+    callback_url,
+    name=None,
+    max_concurrency=DEFAULT_PART_CONCURRENCY,
+    manifest=None,
+    scheduler=None,
+    cancel_event=None,
+    wait_for=None,
+):
     """Upload a single file-like object to an intermediate S3 bucket.
 
     One Codex will pull the file from S3 after receiving a callback.
@@ -445,72 +865,71 @@ def _s3_intermediate_upload(file_obj, file_name, fields, session, callback_url,
         API callback at One Codex which will trigger a pull from this S3 bucket.
     name : `string`, optional
         Optionally, a name you wish to associate the file with
+    max_concurrency : `int`, optional
+        Maximum number of multipart upload parts to send to S3 at once, if no `scheduler` is passed.
+    manifest : `onecodex.lib.resume.UploadManifest`, optional
+        If passed, record upload progress in this manifest so the upload can be resumed.
+    scheduler : `onecodex.lib.scheduler.UploadScheduler`, optional
+        If passed, send parts using the scheduler's shared part slots and bandwidth limit.
+    cancel_event : `threading.Event`, optional
+        Stop uploading if this is set, and set it if the upload fails.
+    wait_for : `concurrent.futures.Future`, optional
+        Wait for this to finish before issuing the callback, re-raising any exception it raised.
 
     Raises
     ------
     UploadException
-        In the case of a fatal exception during an upload. Note we rely on boto3 to handle its own
-        retry logic.
+        In the case of a fatal exception during an upload. Each part is retried independently
+        before giving up.
 
     Returns
     -------
     `dict` : JSON results from internal confirm import callback URL
     """
     import boto3
-    from boto3.s3.transfer import TransferConfig
-    from boto3.exceptions import S3UploadFailedError
+    from botocore.config import Config
 
     boto3_session = boto3.session.Session()
 
-    # actually do the upload
+    # actually do the upload; boto3 clients (unlike sessions) are safe to share across threads
     client = boto3_session.client(
         "s3",
         aws_access_key_id=fields["upload_aws_access_key_id"],
         aws_secret_access_key=fields["upload_aws_secret_access_key"],
+        config=Config(
+            max_pool_connections=max(
+                10, scheduler.max_parts if scheduler is not None else max_concurrency
+            )
+        ),
     )
 
     multipart_chunksize = _choose_boto3_chunksize(file_obj)
 
-    # if boto uses threads, ctrl+c won't work
-    config = TransferConfig(use_threads=False, multipart_chunksize=multipart_chunksize)
+    # update our progressbar once per finished part rather than from our FASTX wrappers, if
+    # applicable, so that retried parts don't have to rewind it
+    progress_callback = None
 
-    # let boto3 update our progressbar rather than our FASTX wrappers, if applicable
-    boto_kwargs = {}
-
-    if hasattr(file_obj, "progressbar"):
-        boto_kwargs["Callback"] = file_obj.progressbar.update
+    if getattr(file_obj, "progressbar", None) is not None:
+        progress_callback = file_obj.progressbar.update
         file_obj._progressbar = file_obj.progressbar
         file_obj.progressbar = None
 
-    for attempt in range(1, 4):
-        try:
-            client.upload_fileobj(
-                file_obj,
-                fields["s3_bucket"],
-                fields["file_id"],
-                ExtraArgs={"ServerSideEncryption": "AES256"},
-                Config=config,
-                **boto_kwargs,
-            )
-            break
-        except S3UploadFailedError as e:
-            logging.debug("Caught S3UploadFailedError on attempt {}/3: {}".format(attempt, str(e)))
-            logging.error(
-                "{}: Connectivity issue, retrying upload via intermediary ({}/3)...".format(
-                    file_name, attempt
-                )
-            )
+    _s3_multipart_upload(
+        client,
+        file_obj,
+        file_name,
+        fields["s3_bucket"],
+        fields["file_id"],
+        multipart_chunksize,
+        max_concurrency=max_concurrency,
+        progress_callback=progress_callback,
+        manifest=manifest,
+        scheduler=scheduler,
+        cancel_event=cancel_event,
+    )
 
-            # rewind the progressbar if possible, then remove so boto3 can update the bar directly
-            if hasattr(file_obj, "_progressbar"):
-                file_obj.progressbar = file_obj._progressbar
-                file_obj.seek(0)
-                file_obj.progressbar = None
-            else:
-                file_obj.seek(0)
-    else:
-        logging.debug("{}: exhausted all retries via intermediary")
-        raise_connectivity_error(file_name)
+    if wait_for is not None:
+        wait_for.result()
 
     # In paired uploads, we only want to call the callback url once both files are uploaded
     if not callback_url:
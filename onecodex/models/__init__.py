@@ -19,6 +19,7 @@ from onecodex.models.helpers import (
     check_bind,
     generate_potion_sort_clause,
     generate_potion_keyword_where,
+    prefetch_related,
 )
 from onecodex.vendored.potion_client.converter import PotionJSONEncoder
 from onecodex.vendored.potion_client.resource import Resource
@@ -403,6 +404,10 @@ class OneCodexBase(object):
         limit : `int`, optional
             Number of records to return. For smaller searches, this can reduce the number of
             network requests made.
+        include : `list` of `str`, optional
+            Related objects to fetch in bulk along with the results, e.g. `["sample"]`, rather than
+            one at a time as they're accessed. Use dots to follow references, e.g.
+            `"sample.metadata"`.
         keyword_filters : `str` or `object`
             Filter the results by specific keywords (or filter objects, in advanced usage)
 
@@ -423,6 +428,7 @@ class OneCodexBase(object):
 
         # do this here to avoid passing this on to potion
         filter_func = keyword_filters.pop("filter", None)
+        include = keyword_filters.pop("include", None)
 
         public = False
         if any(x["rel"] == "instances_public" for x in cls._resource._schema["links"]):
@@ -480,6 +486,9 @@ class OneCodexBase(object):
                     "Expected callable for filter, got: {}".format(type(filter_func).__name__)
                 )
 
+        if include:
+            prefetch_related([obj._resource for obj in wrapped], include)
+
         return wrapped
 
     @classmethod
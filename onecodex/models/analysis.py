@@ -26,11 +26,43 @@ class Analyses(OneCodexBase):
     def _results(self):
         try:
             if not getattr(self._resource, "_cached_result", None):
-                self._resource._cached_result = self._resource.results()
+                self._resource._cached_result = self._fetch_results()
             return self._resource._cached_result
         except AttributeError:
             raise NotImplementedError(".results() not implemented for this Analyses resource.")
 
+    def _results_cache_key(self):
+        """Return the key of these results in the on-disk results cache, or None.
+
+        Only the results of successfully completed analyses are cached, since they can't change.
+        The key includes the job, so that the results of re-running a sample are never confused.
+        """
+        if getattr(self._api, "_results_cache", None) is None:
+            return None
+
+        properties = self._resource._properties
+        if properties.get("complete") is not True or properties.get("success") is not True:
+            return None
+
+        job = properties.get("job")
+        job_uri = getattr(job, "_uri", None) or (job or {}).get("$ref")
+        return "{}:{}".format(self._resource._uri, job_uri)
+
+    def _fetch_results(self):
+        key = self._results_cache_key()
+
+        if key is not None:
+            results = self._api._results_cache.get(key)
+            if results is not None:
+                return results
+
+        results = self._resource.results()
+
+        if key is not None:
+            self._api._results_cache.set(key, results)
+
+        return results
+
 
 class Alignments(Analyses):
     _resource_path = "/api/v1/alignments"
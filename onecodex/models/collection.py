@@ -1,14 +1,19 @@
 from collections import defaultdict, OrderedDict
 from datetime import datetime
+import functools
+import inspect
 import json
+import sys
 import warnings
 
 from onecodex.exceptions import OneCodexException
+from onecodex.lib.cache import MemoryCache
 from onecodex.lib.enums import (
     AbundanceMetric,
     Metric,
     FunctionalAnnotations,
     FunctionalAnnotationsMetric,
+    Rank,
 )
 
 try:
@@ -20,6 +25,14 @@ except ImportError:
 
 
 from onecodex.models import OneCodexBase, ResourceList
+from onecodex.models.helpers import prefetch_related
+from onecodex.taxonomy import NO_PARENT, TaxonomyTable
+
+# number of classification results to fetch from the API at once
+DEFAULT_RESULTS_THREADS = 8
+
+# maximum size, in bytes, of the `to_df()` tables and diversity results memoized per collection
+DEFAULT_MEMO_SIZE = 256 * 1024**2
 
 CANONICAL_RANKS = (
     "superkingdom",
@@ -33,6 +46,39 @@ CANONICAL_RANKS = (
 )
 
 
+def _memo_sizeof(value):
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True).sum())
+    elif hasattr(value, "data") and hasattr(value.data, "nbytes"):
+        # skbio.stats.distance.DistanceMatrix
+        return value.data.nbytes + sys.getsizeof(value.ids)
+    return sys.getsizeof(value)
+
+
+def _make_read_only(df):
+    """Mark the arrays holding a memoized DataFrame's data read-only, so they can't be changed."""
+    import numpy as np
+
+    for array in df._mgr.arrays:
+        # the non-fill values of a pd.arrays.SparseArray
+        array = getattr(array, "sp_values", array)
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+
+
+def _memoized(name):
+    """Memoize the `AnalysisMixin` method `name` in a `SampleCollection`'s `_memo` cache."""
+
+    def method(self, *args, **kwargs):
+        return self._memoize(name, args, kwargs)
+
+    # keep the original docstring and signature (AnalysisMixin is a stub without pandas)
+    if hasattr(AnalysisMixin, name):
+        functools.update_wrapper(method, getattr(AnalysisMixin, name))
+
+    return method
+
+
 class SampleCollection(ResourceList, AnalysisMixin):
     """A collection of `Samples` or `Classifications` objects.
 
@@ -66,6 +112,11 @@ class SampleCollection(ResourceList, AnalysisMixin):
         include_host : bool, optional
             If True, keep (rather than drop) count/abundance data for host taxa
 
+        sparse : bool, optional
+            If True, store the collated results as sparse columns, which only hold the taxa
+            actually observed in each sample. This uses much less memory for large collections
+            with many taxa. Missing abundances remain distinct from zero abundances.
+
         Examples
         --------
         Given a list of Samples, create a new SampleCollection using abundances:
@@ -104,17 +155,25 @@ class SampleCollection(ResourceList, AnalysisMixin):
         metric="auto",
         include_host=False,
         job=None,
+        sparse=False,
     ):
         self._kwargs = {
             "skip_missing": skip_missing,
             "metric": metric,
             "include_host": include_host,
             "job": job,
+            "sparse": sparse,
         }
         super(SampleCollection, self).__init__(_resource, oc_model, **self._kwargs)
 
     def _sample_collection_constructor(
-        self, objects, skip_missing=True, metric="auto", include_host=False, job=None
+        self,
+        objects,
+        skip_missing=True,
+        metric="auto",
+        include_host=False,
+        job=None,
+        sparse=False,
     ):
         # are they all wrapped potion resources?
         if not all([hasattr(obj, "_resource") for obj in objects]):
@@ -138,6 +197,7 @@ class SampleCollection(ResourceList, AnalysisMixin):
             "metric": metric,
             "include_host": include_host,
             "job": job,
+            "sparse": sparse,
         }
         super(SampleCollection, self).__init__(resources, model, **self._kwargs)
 
@@ -175,6 +235,104 @@ class SampleCollection(ResourceList, AnalysisMixin):
         self._cached = {}
         super(SampleCollection, self)._update()
 
+    @property
+    def _memo(self):
+        # kept in _cached, so changes to the collection (or re-collating the results) clear it
+        if "memo" not in self._cached:
+            self._cached["memo"] = MemoryCache(DEFAULT_MEMO_SIZE, _memo_sizeof)
+
+        return self._cached["memo"]
+
+    def _memoize(self, name, args, kwargs):
+        """Call the `AnalysisMixin` method `name`, or return its memoized result for these arguments.
+
+        Arguments are normalized against the method's signature, so e.g. `to_df()` and
+        `to_df(rank="auto")` share an entry. Rather than copying the memoized result, callers share
+        it: DataFrames are new frames over its data, which is marked read-only so it can't be
+        modified in place (with pandas Copy-on-Write on, it's copied when modified instead), and
+        distance matrices are returned as they are, since skbio needs their data to be writeable.
+        Calls with unhashable arguments, or writing their result to a file with `out`, aren't
+        memoized.
+        """
+        method = getattr(super(SampleCollection, self), name)
+
+        # collate the results first, since that clears the memo
+        self._results
+
+        bound = inspect.signature(method).bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name,) + tuple(bound.arguments.items())
+
+        if bound.arguments.get("out") is not None:
+            # the file has to be written by every call
+            key = value = None
+        else:
+            try:
+                value = self._memo.get(key)
+            except TypeError:
+                key = value = None
+
+        if value is None:
+            value = method(*args, **kwargs)
+            if hasattr(value, "_mgr"):
+                _make_read_only(value)
+
+            if key is not None:
+                self._memo.set(key, value)
+
+        if not hasattr(value, "_mgr"):
+            return value
+
+        result = value.copy(deep=False)
+        if hasattr(result, "ocx_metadata"):
+            # the metadata may have been changed since the result was memoized
+            result.ocx_metadata = self.metadata.copy(deep=False)
+            result.ocx_taxonomy = value.ocx_taxonomy.copy(deep=False)
+
+        return result
+
+    _to_classification_df = _memoized("_to_classification_df")
+    alpha_diversity = _memoized("alpha_diversity")
+    beta_diversity = _memoized("beta_diversity")
+
+    def prefetch(self, *include):
+        """Fetch the related objects of everything in the collection in bulk.
+
+        Rather than fetching e.g. each sample's metadata with its own request when it's first
+        accessed, the objects are fetched a chunk at a time with `$uri $in` queries and filled in
+        place. Objects that were already fetched are skipped.
+
+        Parameters
+        ----------
+        include : `str`, optional
+            Fields to fetch, e.g. `"sample"`. Use dots to follow references, e.g.
+            `"sample.metadata"`. By default, fetches everything used to build `metadata` and
+            collate the classification results.
+
+        Examples
+        --------
+        >>> samples = ocx.Samples.where(project=project)
+        >>> samples.prefetch("metadata", "primary_classification")
+        """
+        if not include:
+            include = self._prefetch_paths("metadata") + self._prefetch_paths("classifications")
+
+        prefetch_related(self._resource, include)
+
+    def _prefetch_paths(self, purpose):
+        """Return the related objects needed to build `metadata` or find the classifications."""
+        from onecodex.models import Classifications
+
+        if issubclass(self._oc_model, Classifications):
+            paths = {"metadata": ("sample.metadata", "sample.project"), "classifications": ("job",)}
+        else:
+            paths = {
+                "metadata": ("metadata", "project"),
+                "classifications": ("primary_classification.job",),
+            }
+
+        return paths[purpose]
+
     def _classification_fetch(self, skip_missing=None):
         """Transform a list of Samples or Classifications into a list of Classifications objects.
 
@@ -191,6 +349,9 @@ class SampleCollection(ResourceList, AnalysisMixin):
 
         skip_missing = skip_missing if skip_missing else self._kwargs["skip_missing"]
 
+        # fetch the classifications (and their jobs) in bulk, rather than one by one below
+        self.prefetch(*self._prefetch_paths("classifications"))
+
         new_classifications = []
 
         for obj in self._res_list:
@@ -240,6 +401,9 @@ class SampleCollection(ResourceList, AnalysisMixin):
         DEFAULT_FIELDS = None
         metadata = []
 
+        # fetch the samples, metadata and projects in bulk, rather than one by one below
+        self.prefetch(*self._prefetch_paths("metadata"))
+
         for obj in self._res_list:
             try:
                 classification_id = (
@@ -285,6 +449,61 @@ class SampleCollection(ResourceList, AnalysisMixin):
 
         return self._cached["metadata"]
 
+    def prefetch_results(self, max_threads=DEFAULT_RESULTS_THREADS, progressbar=False):
+        """Fetch the results of every classification in the collection, several at once.
+
+        Results that were already fetched (or are in the on-disk results cache) are skipped. This is
+        called automatically before results are collated, but can be called ahead of time, e.g. to
+        show progress for a large collection.
+
+        Parameters
+        ----------
+        max_threads : `int`, optional
+            Number of results to fetch from the API at once.
+        progressbar : `bool`, optional
+            Display a progress bar using Click?
+
+        Returns
+        -------
+        None, but each classification's results are cached on it.
+        """
+        import concurrent.futures
+
+        import click
+
+        missing = [
+            c for c in self._classifications if not getattr(c._resource, "_cached_result", None)
+        ]
+
+        if not missing:
+            return
+
+        if len(missing) == 1 or max_threads <= 1:
+            for c in missing:
+                c.results()
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_threads, len(missing)), thread_name_prefix="onecodex-results"
+        ) as executor:
+            futures = [executor.submit(c.results) for c in missing]
+
+            try:
+                if progressbar:
+                    with click.progressbar(
+                        length=len(futures), label="Fetching results", file=sys.stderr
+                    ) as bar:
+                        for future in concurrent.futures.as_completed(futures):
+                            future.result()
+                            bar.update(1)
+                else:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
     def _collate_results(self, metric=None, include_host=None):
         """Transform a list of Classifications into `pd.DataFrames` of taxonomy and results data.
 
@@ -328,11 +547,25 @@ class SampleCollection(ResourceList, AnalysisMixin):
         metric = metric.value
         self._cached["metric"] = metric
 
+        # pulling results from the API is the slowest part of the function, so fetch all of them at
+        # once ahead of the passes below
+        self.prefetch_results()
+
+        if self._kwargs.get("sparse"):
+            df, tax_info = self._collate_sparse_results(
+                metric, metric_dtype, include_host, classification_ids
+            )
+            self._cached["results"] = df
+            self._cached["taxonomy_table"] = tax_info
+            self._cached.pop("taxonomy", None)
+            self._cached.pop("memo", None)
+            return
+
         # Compile info about all taxa observed in the classification results.
         tax_info = {"tax_id": [], "name": [], "rank": [], "parent_tax_id": []}
         tax_ids = set()
         for c_idx, c in enumerate(self._classifications):
-            # pulling results from API is the slowest part of the function, 75% of the execution time
+            # results are cached by the prefetch above
             results = c.results()
             host_tax_ids = results.get("host_tax_ids", [])
 
@@ -348,8 +581,9 @@ class SampleCollection(ResourceList, AnalysisMixin):
                         tax_info[k].append(d[k])
                     tax_ids.add(d_tax_id)
 
-        tax_info = pd.DataFrame(tax_info, dtype=object, copy=False)
-        tax_info.set_index("tax_id", inplace=True)
+        tax_info = TaxonomyTable(
+            tax_info["tax_id"], tax_info["name"], tax_info["rank"], tax_info["parent_tax_id"]
+        )
 
         # Now that we have a complete list of taxa in these classification results, take a second
         # pass through the results, filling in the abundances/counts into a single numpy array.
@@ -389,7 +623,89 @@ class SampleCollection(ResourceList, AnalysisMixin):
         )
 
         self._cached["results"] = df
-        self._cached["taxonomy"] = tax_info
+        self._cached["taxonomy_table"] = tax_info
+        self._cached.pop("taxonomy", None)
+        self._cached.pop("memo", None)
+
+    def _collate_sparse_results(self, metric, metric_dtype, include_host, classification_ids):
+        """Collate the classification results into a `pd.DataFrame` of sparse columns.
+
+        Rather than filling in a dense samples x taxa array, the observed (row, column, value)
+        triplets are collected in a single pass over the results and each taxon's column is stored
+        as a `pd.arrays.SparseArray`. Missing values are NaN for abundance metrics (so explicit zero
+        abundances are kept) and 0 for read counts, as in the dense results.
+
+        Returns
+        -------
+        `tuple` of the results `pd.DataFrame` and its `TaxonomyTable`.
+        """
+        import numpy as np
+        import pandas as pd
+
+        is_abundance = AbundanceMetric.has_value(metric)
+        fill_value = np.nan if is_abundance else 0
+
+        tax_info = {"tax_id": [], "name": [], "rank": [], "parent_tax_id": []}
+        tax_id_to_idx = {}
+        rows, cols, values = [], [], []
+
+        for c_idx, c in enumerate(self._classifications):
+            results = c.results()
+            host_tax_ids = set(results.get("host_tax_ids", []))
+
+            for d in results["table"]:
+                d_tax_id = d["tax_id"]
+
+                if not include_host and d_tax_id in host_tax_ids:
+                    continue
+
+                t_idx = tax_id_to_idx.get(d_tax_id)
+                if t_idx is None:
+                    t_idx = tax_id_to_idx[d_tax_id] = len(tax_id_to_idx)
+                    for k in ("tax_id", "name", "rank", "parent_tax_id"):
+                        tax_info[k].append(d[k])
+
+                value = d[metric]
+                if is_abundance and value is None:
+                    continue
+                elif not is_abundance:
+                    value = value or 0
+                    if value == 0:
+                        continue
+
+                rows.append(c_idx)
+                cols.append(t_idx)
+                values.append(value)
+
+        tax_info = TaxonomyTable(
+            tax_info["tax_id"], tax_info["name"], tax_info["rank"], tax_info["parent_tax_id"]
+        )
+
+        # group the triplets by column
+        rows = np.asarray(rows, dtype=np.intp)
+        values = np.asarray(values, dtype=metric_dtype)
+        order = np.argsort(np.asarray(cols, dtype=np.intp), kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=len(tax_id_to_idx)))))
+        rows, values = rows[order], values[order]
+
+        n_rows = len(classification_ids)
+        dtype = pd.SparseDtype(metric_dtype, fill_value)
+        columns = {}
+
+        for t_idx, tax_id in enumerate(tax_info.index):
+            start, end = bounds[t_idx], bounds[t_idx + 1]
+
+            # only one dense column exists at a time
+            column = np.full(n_rows, fill_value, dtype=metric_dtype)
+            column[rows[start:end]] = values[start:end]
+            columns[tax_id] = pd.arrays.SparseArray(column, fill_value=fill_value, dtype=dtype)
+
+        df = pd.DataFrame(
+            columns, index=pd.Index(classification_ids, name="classification_id"), copy=False
+        )
+        df.columns.name = "tax_id"
+
+        return df, tax_info
 
     @property
     def _metric(self):
@@ -414,10 +730,18 @@ class SampleCollection(ResourceList, AnalysisMixin):
 
         return self._cached["results"]
 
+    @property
+    def _taxonomy_table(self):
+        if "taxonomy_table" not in self._cached:
+            self._collate_results()
+
+        return self._cached["taxonomy_table"]
+
     @property
     def taxonomy(self):
+        # the DataFrame is a view of the columnar taxonomy, built the first time it's used
         if "taxonomy" not in self._cached:
-            self._collate_results()
+            self._cached["taxonomy"] = self._taxonomy_table.to_frame()
 
         return self._cached["taxonomy"]
 
@@ -599,6 +923,8 @@ class SampleCollection(ResourceList, AnalysisMixin):
         otu_table : OrderedDict
             A BIOM OTU table, returned as a Python `OrderedDict` (can be dumped to JSON)
         """
+        import numpy as np
+
         otu_format = "Biological Observation Matrix 1.0.0"
 
         # Note: This is exact format URL is required by https://github.com/biocore/biom-format
@@ -623,7 +949,8 @@ class SampleCollection(ResourceList, AnalysisMixin):
 
         self._collate_results(include_host=True)  # make sure 9606 is in the taxonomy
 
-        root = self.tree_build()
+        taxonomy = self._taxonomy_table
+        ranks = np.asarray(taxonomy.ranks, dtype=object)
         for classification in self._classifications:
             col_id = len(otu["columns"])  # 0 index
 
@@ -641,14 +968,14 @@ class SampleCollection(ResourceList, AnalysisMixin):
 
             otu["columns"].append(columns_entry)
             sample_df = classification.table()
+            positions = taxonomy.positions(sample_df["tax_id"])
 
-            for row in sample_df.iterrows():
+            for row, pos in zip(sample_df.iterrows(), positions):
                 tax_id = row[1]["tax_id"]
-                tax_node = root.find(tax_id)
 
                 # only keep canonical rows (e.g., don't include things like
                 # "root" in the OTU table)
-                if tax_node.rank not in include_ranks:
+                if pos == NO_PARENT or ranks[pos] not in include_ranks:
                     continue
 
                 rows[tax_id][col_id] = int(row[1][Metric.Readcount])
@@ -659,16 +986,17 @@ class SampleCollection(ResourceList, AnalysisMixin):
         otu["shape"] = [num_rows, num_cols]
         otu["data"] = []
 
-        for tax_id in sorted(rows):
-            row_id = len(otu["rows"])
-            tax_node = root.find(tax_id)
-            lineage = tax_node.ancestors() + [tax_node]
+        # the position of each taxon's ancestor (or itself) at each canonical rank
+        ancestors = [taxonomy.ancestor_at_level(Rank(rank).level) for rank in CANONICAL_RANKS]
 
-            rank_to_name = {n.rank: n.tax_name for n in lineage}
+        for tax_id, pos in zip(sorted(rows), taxonomy.positions(sorted(rows))):
+            row_id = len(otu["rows"])
 
             canonical_names = []
-            for rank in CANONICAL_RANKS:
-                canonical_names.append(rank_to_name.get(rank, ""))
+            for ancestor in ancestors:
+                canonical_names.append(
+                    taxonomy.names[ancestor[pos]] if ancestor[pos] != NO_PARENT else ""
+                )
 
             otu["rows"].append({"id": tax_id, "metadata": {"taxonomy": canonical_names}})
 
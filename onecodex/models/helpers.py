@@ -5,6 +5,14 @@ import os.path
 import requests
 
 from onecodex.exceptions import OneCodexException, UnboundObject
+from onecodex.lib.download import (
+    DEFAULT_DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_CHUNK_SIZE,
+    download_url,
+)
+
+# maximum number of URIs in a single `$uri $in` query, to keep request URLs to a safe length
+MAX_URIS_PER_QUERY = 50
 
 
 def as_uri(uuid, base_class):
@@ -78,6 +86,81 @@ def generate_potion_keyword_where(keyword_filters, where_schema, base_class):
     return where
 
 
+def _resolve_in_bulk(references):
+    """Fetch unresolved potion references with one `$uri $in` query per model and chunk of URIs.
+
+    The fetched objects fill in the existing references in place. Objects that were already
+    fetched (and perhaps modified locally) are left alone, as are any that can't be fetched this
+    way, which are fetched individually when they're next accessed.
+    """
+    from onecodex.models import DEFAULT_PAGE_SIZE, _model_lookup
+    from onecodex.vendored.potion_client.converter import PotionJSONDecoder
+
+    by_route = {}
+    for ref in references:
+        if ref._uri is not None and ref._status is None:
+            by_route.setdefault(ref._uri.rsplit("/", 1)[0], {})[ref._uri] = ref
+
+    for route, refs in by_route.items():
+        model = _model_lookup.get(route)
+        if model is None or not hasattr(model, "_resource"):
+            continue
+
+        client = model._resource._client
+        uris = list(refs)
+
+        for idx in range(0, len(uris), MAX_URIS_PER_QUERY):
+            chunk = uris[idx : idx + MAX_URIS_PER_QUERY]
+            request = model._resource.instances.request_factory(
+                None, {"where": {"$uri": {"$in": chunk}}, "per_page": DEFAULT_PAGE_SIZE}
+            )
+            try:
+                response = client.session.send(
+                    client.session.prepare_request(request),
+                    **client.session.merge_environment_settings(request.url, {}, None, None, None),
+                )
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                # this is only an optimization, so leave these to be fetched individually
+                continue
+
+            # decode the objects as plain dicts, so that only the references we asked for are
+            # filled in, rather than every instance of each object that was returned
+            for item in response.json(cls=PotionJSONDecoder, client=client, uri_to_instance=False):
+                ref = refs.get(item.get("$uri"))
+                if ref is not None and ref._status is None:
+                    ref._properties = item
+
+
+def prefetch_related(resources, include):
+    """Resolve the related objects of potion resources in bulk, rather than one request at a time.
+
+    Parameters
+    ----------
+    resources : `list`
+        Potion resources, e.g. the `_resource` of a `ResourceList`.
+    include : `list` of `str`
+        Fields to resolve, e.g. `"sample"`. Use dots to follow references from those objects, e.g.
+        `"sample.metadata"` resolves each `sample` and then the `metadata` of each of those.
+    """
+    from onecodex.vendored.potion_client.resource import Reference
+
+    _resolve_in_bulk(resources)
+
+    for path in include:
+        current = list(resources)
+
+        for field in path.split("."):
+            related = []
+            for res in current:
+                value = res._properties.get(field)
+                values = value if isinstance(value, list) else [value]
+                related.extend(v for v in values if isinstance(v, Reference))
+
+            _resolve_in_bulk(related)
+            current = related
+
+
 def truncate_string(s, length=24):
     if len(s) < length - 3:
         return s
@@ -91,7 +174,14 @@ def truncate_string(s, length=24):
 
 
 class ResourceDownloadMixin(object):
-    def download(self, path=None, file_obj=None, progressbar=False):
+    def download(
+        self,
+        path=None,
+        file_obj=None,
+        progressbar=False,
+        max_connections=DEFAULT_DOWNLOAD_CONNECTIONS,
+        canceled=None,
+    ):
         """Download files from One Codex.
 
         Parameters
@@ -103,6 +193,11 @@ class ResourceDownloadMixin(object):
             Rather than save the file to a path, write it to this file-like object.
         progressbar : `bool`
             Display a progress bar using Click for the download?
+        max_connections : `int`, optional
+            When saving to a path, download up to this many byte ranges of a large file at once.
+        canceled : `threading.Event`, optional
+            When saving to a path, stop downloading (raising `concurrent.futures.CancelledError`)
+            once this is set, keeping the data received so far to resume from.
 
         Returns
         -------
@@ -114,7 +209,9 @@ class ResourceDownloadMixin(object):
         If no arguments specified, defaults to download the file as the original filename
         in the current working directory. If `file_obj` given, will write data into the
         passed file-like object. If `path` given, will download the file to the path provided,
-        but will not overwrite any existing files.
+        but will not overwrite any existing files. Data is saved to `<path>.part` until the
+        download completes, and if it is interrupted, downloading to the same path again
+        resumes it.
         """
         return self._download(
             "download_uri",
@@ -123,6 +220,8 @@ class ResourceDownloadMixin(object):
             path=path,
             file_obj=file_obj,
             progressbar=progressbar,
+            max_connections=max_connections,
+            canceled=canceled,
         )
 
     def _download(
@@ -133,6 +232,8 @@ class ResourceDownloadMixin(object):
         path=None,
         file_obj=None,
         progressbar=False,
+        max_connections=DEFAULT_DOWNLOAD_CONNECTIONS,
+        canceled=None,
     ):
         from requests.adapters import HTTPAdapter
         from requests.packages.urllib3.util.retry import Retry
@@ -179,31 +280,34 @@ class ResourceDownloadMixin(object):
             session.mount("http://", adapter)
             session.mount("https://", adapter)
 
-            resp = session.get(link, stream=True)
-
             if path:
-                f_out = open(path, "wb")
-            else:
-                f_out = file_obj
-
-            if progressbar:
-                progress_label = os.path.basename(path) if path else self.filename
-                with click.progressbar(length=self.size, label=progress_label) as bar:
-                    for data in resp.iter_content(chunk_size=1024):
-                        bar.update(len(data))
-                        f_out.write(data)
+                # downloads to `<path>.part` first, so an interrupted download can be resumed
+                if progressbar:
+                    with click.progressbar(length=self.size, label=os.path.basename(path)) as bar:
+                        download_url(
+                            session,
+                            link,
+                            path,
+                            max_connections=max_connections,
+                            progress_callback=bar.update,
+                            canceled=canceled,
+                        )
+                else:
+                    download_url(
+                        session, link, path, max_connections=max_connections, canceled=canceled
+                    )
             else:
-                for data in resp.iter_content(chunk_size=1024):
-                    f_out.write(data)
+                resp = session.get(link, stream=True)
 
-            # do not close the handle if file_obj is used
-            if not file_obj:
-                f_out.close()
+                if progressbar:
+                    with click.progressbar(length=self.size, label=self.filename) as bar:
+                        for data in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            bar.update(len(data))
+                            file_obj.write(data)
+                else:
+                    for data in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file_obj.write(data)
 
-        except KeyboardInterrupt:
-            if path and os.path.exists(path):
-                os.remove(path)
-            raise
         except requests.exceptions.HTTPError as exc:
             if exc.response.status_code == 401:
                 raise OneCodexException("You must be logged in to download files.")
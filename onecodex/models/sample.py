@@ -3,6 +3,7 @@ from six import string_types
 import warnings
 
 from onecodex.exceptions import OneCodexException
+from onecodex.lib.files import ConcatenatedFile
 from onecodex.lib.upload import upload_sequence, preupload_sample
 from onecodex.models import OneCodexBase, Projects, Tags
 from onecodex.models.helpers import truncate_string, ResourceDownloadMixin
@@ -64,6 +65,9 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
             with `ocx.Tags.get()` or `ocx.Tags.where()`
         project : `Project`, optional
             Filter by a Project
+        include : `list` of `str`, optional
+            Related objects to fetch in bulk along with the samples, e.g. `["metadata"]`. See
+            `SampleCollection.prefetch`.
         **keyword_filters : dict, optional
             Pass any additional sample or metadata attribute to filter by that attribute. Metadata filtering
             is *not* currently supported for
@@ -76,6 +80,7 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
 
         public = keyword_filters.pop("public", False)
         organization = keyword_filters.pop("organization", False)
+        include = keyword_filters.pop("include", None)
         instances_route = "instances"
         if organization is True:
             instances_route = "instances_organization"
@@ -178,7 +183,14 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
             # case that no filters/keyword_filters are specified, this is identical to Samples.all()
             samples = super(Samples, cls).where(*filters, **keyword_filters)
 
-        return SampleCollection([s._resource for s in samples[: keyword_filters["limit"]]], Samples)
+        collection = SampleCollection(
+            [s._resource for s in samples[: keyword_filters["limit"]]], Samples
+        )
+
+        if include:
+            collection.prefetch(*include)
+
+        return collection
 
     @classmethod
     def search_public(cls, *filters, **keyword_filters):
@@ -240,15 +252,19 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
         progressbar=None,
         sample_id=None,
         external_sample_id=None,
+        resume=False,
+        compress=False,
+        scheduler=None,
     ):
         """Upload a series of files to the One Codex server.
 
         Parameters
         ----------
-        files : `string` or `tuple`
+        files : `string`, `ConcatenatedFile` or `tuple`
             A single path to a file on the system, or a tuple containing a pairs of paths. Tuple
             values  will be interleaved as paired-end reads and both files should contain the same
-            number of records. Paths to single files will be uploaded as-is.
+            number of records. Paths to single files will be uploaded as-is. A `ConcatenatedFile`
+            may be passed in place of any path to upload several files (e.g. sequencing lanes) as one.
         metadata : `dict`, optional
         tags : `list`, optional
             A list of optional tags to create. Tags must be passed as dictionaries with a single key
@@ -264,12 +280,21 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
             If passed, will upload the file(s) to the sample with that id. Only works if the sample was pre-uploaded
         external_sample_id : `string`, optional
             If passed, will upload the file(s) to the sample with that metadata external id. Only works if the sample was pre-uploaded
+        resume : `bool`, optional
+            If true, save upload progress locally so that an interrupted upload of the same file(s)
+            can be continued where it left off by uploading them again with `resume=True`.
+        compress : `bool`, optional
+            If true, gzip-compress uncompressed FASTA/Q files on the fly while uploading them. No
+            compressed copy is written to disk.
+        scheduler : `onecodex.lib.scheduler.UploadScheduler`, optional
+            If passed, share its pool of part upload slots and bandwidth limit with other uploads
+            using the same scheduler, e.g. when uploading several samples at once.
 
         Returns
         -------
         A `Samples` object upon successful upload. None if the upload failed.
         """
-        if not isinstance(files, string_types) and not isinstance(files, tuple):
+        if not isinstance(files, (string_types, ConcatenatedFile, tuple)):
             raise OneCodexException(
                 "Please pass a string or tuple or forward and reverse filepaths."
             )
@@ -289,6 +314,9 @@ class Samples(OneCodexBase, ResourceDownloadMixin):
             progressbar=progressbar,
             sample_id=sample_id,
             external_sample_id=external_sample_id,
+            resume=resume,
+            compress=compress,
+            scheduler=scheduler,
         )
 
         return cls.get(sample_id)
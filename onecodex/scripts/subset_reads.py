@@ -1,43 +1,126 @@
 import click
-import bz2
+import concurrent.futures
 import csv
 import gzip
 import io
+import itertools
 import os
+import re
+import shutil
+import subprocess
+import sys
 import warnings
+from contextlib import ExitStack, contextmanager
 
 from onecodex.auth import login_required
 from onecodex.exceptions import OneCodexException, ValidationError
+from onecodex.lib.files import GzipBlockWriter
 from onecodex.utils import download_file_helper, get_download_dest, pretty_errors
 
+# number of read-level results rows (and FASTX records) to process at once
+DEFAULT_CHUNKSIZE = 100000
 
-def fastfastq(file_path):
-    filename, ext = os.path.splitext(file_path)
+# number of bytes of FASTQ to read and split into records at once
+FASTQ_BLOCK_SIZE = 4 * 1024**2
+
+# bin names are used in output filenames
+BIN_NAME_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+def _decompress_command(file_path):
+    """Return a command that writes the decompressed contents of `file_path` to stdout.
+
+    Uses `pigz`/`igzip` (or `lbzip2`/`pbzip2`) when installed, and otherwise a Python subprocess.
+    Returns None for uncompressed files.
+    """
+    ext = os.path.splitext(file_path)[1]
 
     if ext in {".gz", ".gzip"}:
-        open_func = gzip.open
+        tools, module = ["pigz", "igzip"], "gzip"
     elif ext in {".bz", ".bz2", ".bzip", ".bzip2"}:
-        open_func = bz2.open
+        tools, module = ["lbzip2", "pbzip2"], "bz2"
     else:
-        open_func = io.open
+        return None
+
+    for tool in tools:
+        if shutil.which(tool):
+            return [tool, "-dc", file_path]
+
+    return [
+        sys.executable,
+        "-c",
+        "import {0}, shutil, sys; "
+        "shutil.copyfileobj({0}.open(sys.argv[1]), sys.stdout.buffer, 1 << 20)".format(module),
+        file_path,
+    ]
+
+
+@contextmanager
+def open_decompressed(file_path):
+    """Open a possibly compressed file for reading, decompressing it in a separate process."""
+    command = _decompress_command(file_path)
+
+    if command is None:
+        with io.open(file_path, "rb") as fp:
+            yield fp
+        return
+
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield proc.stdout
+    finally:
+        # if we stopped reading early, the decompressor is killed by the closed pipe
+        eof = not proc.stdout.read(1)
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+
+        if proc.wait() != 0 and eof:
+            raise ValidationError(
+                "Failed to decompress {}: {}".format(file_path, stderr.decode("utf-8", "replace"))
+            )
 
-    with open_func(file_path, "rb") as fp:
+
+def fastfastq(file_path):
+    """Iterate over the records of a FASTQ file, without validating them.
+
+    The file is read in large blocks, which are split into 4-line records all at once rather than
+    line by line. Compressed files are decompressed in a separate process.
+    """
+    with open_decompressed(file_path) as fp:
         idx = 0
-        buf = []
+        leftover = b""
 
-        for line in fp:
-            idx += 1
-            buf.append(line)
+        while True:
+            block = fp.read(FASTQ_BLOCK_SIZE)
+            lines = (leftover + block).split(b"\n")
 
-            if len(buf) == 4:
-                buf = b"".join(buf)
+            if block:
+                # the last line is incomplete, so hold it (and any partial record) back
+                n_lines = (len(lines) - 1) // 4 * 4
+                leftover = b"\n".join(lines[n_lines:])
+                ends_with_newline = True
+            else:
+                ends_with_newline = lines[-1] == b""
+                if ends_with_newline:
+                    lines.pop()
+                n_lines = len(lines) // 4 * 4
+
+            for i in range(0, n_lines, 4):
+                idx += 4
+                record = lines[i : i + 4]
 
-                if not buf.startswith(b"@"):
+                if not record[0].startswith(b"@"):
                     raise ValidationError("FASTQ record line {} does not start with @".format(idx))
 
-                yield buf
+                if ends_with_newline or i + 4 < n_lines or n_lines < len(lines):
+                    yield b"\n".join(record) + b"\n"
+                else:
+                    # the last record of a file that doesn't end with a newline
+                    yield b"\n".join(record)
 
-                buf = []
+            if not block:
+                break
 
 
 def validating_parser(file_path, **io_kwargs):
@@ -50,14 +133,66 @@ def validating_parser(file_path, **io_kwargs):
         yield buf.read()
 
 
-def get_filtered_filename(file_path):
+def get_filtered_filename(file_path, suffix="filtered"):
     filename = os.path.basename(file_path)
     filename, ext = os.path.splitext(filename)
 
     if ext in {".gz", ".gzip", ".bz", ".bzip", ".bz2", ".bzip2"}:
         filename, ext = os.path.splitext(filename)
 
-    return "{}.filtered{}".format(filename, ext), ext
+    return "{}.{}{}".format(filename, suffix, ext), ext
+
+
+def parse_bins(bins=(), bins_file=None):
+    """Parse output bins from `--bin` options and a bins file into a `dict` of name to tax IDs.
+
+    Each `--bin` is `name:taxid[,taxid...]`. Each line of the bins file is a tab-separated name
+    and tax ID (or comma-separated tax IDs); blank lines and lines starting with `#` are skipped. A
+    name may be given more than once, in which case the tax IDs are combined.
+    """
+    entries = []
+
+    for value in bins:
+        name, sep, tax_ids = value.partition(":")
+        if not sep:
+            raise OneCodexException(
+                "--bin must be given as name:taxid[,taxid...], not {}".format(value)
+            )
+        entries.append((name, tax_ids))
+
+    if bins_file:
+        with io.open(bins_file, "r") as fp:
+            for line_no, line in enumerate(fp, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+
+                fields = line.split("\t")
+                if len(fields) != 2:
+                    raise OneCodexException(
+                        "{} line {}: expected a bin name and tax ID(s) separated by a tab".format(
+                            bins_file, line_no
+                        )
+                    )
+                entries.append(tuple(fields))
+
+    parsed = {}
+    for name, tax_ids in entries:
+        name = name.strip()
+        tax_ids = [t.strip() for t in tax_ids.split(",") if t.strip()]
+
+        if not BIN_NAME_PATTERN.match(name):
+            raise OneCodexException(
+                "Bin names may only contain letters, numbers, '.', '_' and '-', not {!r}".format(
+                    name
+                )
+            )
+        if not tax_ids:
+            raise OneCodexException("Bin {} has no tax IDs".format(name))
+
+        parsed.setdefault(name, []).extend(tax_ids)
+
+    return parsed
 
 
 def make_taxonomy_dict(classification, parent=False):
@@ -121,6 +256,177 @@ def recurse_taxonomy_map(tax_id_map, tax_id, parent=False):
         return list(set(_child_recurse(tax_id, [])))
 
 
+def _readlevel_columns(tsv_file, chunksize):
+    """Yield blocks of the `Tax ID` and `Passed Filter` columns of a gzipped read-level TSV.
+
+    Each block is a `(tax_ids, passed_filter)` tuple of up to `chunksize` rows. `passed_filter` is
+    None if the results don't have a `Passed Filter` column. The columns are pandas Series if
+    pandas is installed, and lists otherwise.
+    """
+    columns = ("Tax ID", "Passed Filter")
+
+    with gzip.GzipFile(fileobj=tsv_file, mode="rb") as tsv:
+        try:
+            import pandas as pd
+        except ImportError:
+            pd = None
+
+        if pd is not None:
+            reader = pd.read_csv(
+                tsv,
+                sep="\t",
+                usecols=lambda col: col in columns,
+                dtype=str,
+                na_filter=False,
+                chunksize=chunksize,
+            )
+
+            for df in reader:
+                yield df["Tax ID"], df["Passed Filter"] if "Passed Filter" in df else None
+            return
+
+        reader = csv.reader(io.TextIOWrapper(tsv), delimiter="\t")
+        header = next(reader, [])
+        tax_id_idx = header.index("Tax ID") if "Tax ID" in header else None
+        passed_idx = header.index("Passed Filter") if "Passed Filter" in header else None
+
+        while True:
+            rows = list(itertools.islice(reader, chunksize))
+            if not rows:
+                return
+
+            yield (
+                [row[tax_id_idx] for row in rows],
+                [row[passed_idx] for row in rows] if passed_idx is not None else None,
+            )
+
+
+def readlevel_bin_masks(
+    tsv_file,
+    bins,
+    paired=False,
+    subset_pairs_independently=False,
+    exclude_reads=False,
+    include_lowconf=False,
+    chunksize=DEFAULT_CHUNKSIZE,
+):
+    """Compute which reads belong in each of several bins from read-level classification results.
+
+    The results are read only once, in blocks of `chunksize` rows. Each block is matched against
+    every bin a whole column at a time: the distinct tax IDs in the block are found once, and each
+    bin only checks those, rather than every row.
+
+    Parameters
+    ----------
+    tsv_file : file-like object
+        The gzipped read-level results TSV, opened in binary mode.
+    bins : `dict`
+        Mapping of bin name to the tax IDs (as strings) of reads that belong in that bin.
+    paired : `bool`, optional
+        If True, the rows alternate between the R1 and R2 read of each pair.
+    subset_pairs_independently : `bool`, optional
+        If False, keep both reads of a pair if either of them is kept.
+    exclude_reads : `bool`, optional
+        Put reads that do *not* match a bin's tax IDs in that bin, rather than those that do.
+    include_lowconf : `bool`, optional
+        Don't ignore reads with low confidence assignments (`Passed Filter` is not `T`).
+    chunksize : `int`, optional
+        Number of rows to read at once. Must be even if `paired` is True.
+
+    Yields
+    ------
+    A `dict` mapping each bin name to its mask for the block. For single-end reads, a mask is a
+    sequence of `bool`, one per read. For paired-end reads, it's a tuple of two such sequences (R1
+    and R2), one entry per pair.
+
+    Raises
+    ------
+    ValidationError
+        If `paired` is True and the results have an odd number of rows.
+    """
+    bins = {name: set(tax_ids) for name, tax_ids in bins.items()}
+
+    for read_tax_ids, passed_filter in _readlevel_columns(tsv_file, chunksize):
+        if paired and len(read_tax_ids) % 2 != 0:
+            raise ValidationError(
+                "Classification results cannot have odd number of records if using --reverse/-r"
+            )
+
+        check_passed = not include_lowconf and passed_filter is not None
+
+        if isinstance(read_tax_ids, list):
+            passed = [p == "T" for p in passed_filter] if check_passed else None
+        else:
+            codes, uniques = read_tax_ids.factorize()
+            passed = (passed_filter == "T").to_numpy() if check_passed else None
+
+        masks = {}
+        for name, tax_ids in bins.items():
+            if isinstance(read_tax_ids, list):
+                keep = [(tax_id in tax_ids) != exclude_reads for tax_id in read_tax_ids]
+
+                if passed is not None:
+                    keep = [k and p for k, p in zip(keep, passed)]
+            else:
+                keep = uniques.isin(tax_ids)[codes] != exclude_reads
+
+                if passed is not None:
+                    keep &= passed
+
+            masks[name] = _pair_masks(keep, subset_pairs_independently) if paired else keep
+
+        yield masks
+
+
+def _pair_masks(keep, subset_pairs_independently):
+    """Split a mask over interleaved R1 and R2 rows into a `(fwd_keep, rev_keep)` tuple."""
+    fwd_keep, rev_keep = keep[0::2], keep[1::2]
+
+    if not subset_pairs_independently:
+        if isinstance(fwd_keep, list):
+            fwd_keep = [f or r for f, r in zip(fwd_keep, rev_keep)]
+        else:
+            fwd_keep = fwd_keep | rev_keep
+        rev_keep = fwd_keep
+
+    return fwd_keep, rev_keep
+
+
+def write_binned_records(records, keeps, out_files):
+    """Write the records from `records` to the output file of each bin they're kept in.
+
+    Consumes one record from `records` per entry in the masks, which must all have the same length.
+    If `records` runs out first, the masks are truncated to the records that are left.
+
+    Parameters
+    ----------
+    records : iterator
+        Records, as `bytes`.
+    keeps : `dict`
+        Mapping of bin name to the mask of records to keep in that bin.
+    out_files : `dict`
+        Mapping of bin name to the file to write the bin's records to.
+
+    Returns
+    -------
+    `bool`, False if `records` ran out before the masks did.
+    """
+    n_records = len(next(iter(keeps.values())))
+    batch = list(itertools.islice(records, n_records))
+
+    for name, keep in keeps.items():
+        out_files[name].write(b"".join(itertools.compress(batch, keep)))
+
+    return len(batch) == n_records
+
+
+def open_output(file_path, compress=False):
+    """Open an output file for writing, gzip-compressing it on background threads if `compress`."""
+    if compress:
+        return GzipBlockWriter(file_path)
+    return io.open(file_path, "wb")
+
+
 def too_many_fastx_records():
     raise ValidationError(
         "FASTX file(s) provided have more records than the classification results"
@@ -139,10 +445,23 @@ def too_many_fastx_records():
     "-t",
     "--tax-id",
     "tax_ids",
-    required=True,
     multiple=True,
     help="Subset reads mapping to tax IDs. May be passed multiple times.",
 )
+@click.option(
+    "--bin",
+    "bins",
+    multiple=True,
+    metavar="NAME:TAXID[,TAXID...]",
+    help="Instead of -t, write reads mapping to these tax IDs to their own NAME output file(s). "
+    "May be passed multiple times to split reads into several outputs in a single pass; a read "
+    "may be written to more than one output.",
+)
+@click.option(
+    "--bins-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Like --bin, but read from a TSV file with a bin name and tax ID(s) on each line.",
+)
 @click.option("-r", "--reverse", type=click.Path(), help="The reverse (R2) read file, optionally.")
 @click.option(
     "--validate/--do-not-validate",
@@ -154,7 +473,7 @@ def too_many_fastx_records():
     "--with-children",
     default=False,
     is_flag=True,
-    help="Match child taxa of those given with -t (e.g., all strains of E. coli)",
+    help="Match child taxa of those given with -t or --bin (e.g., all strains of E. coli)",
 )
 @click.option(
     "--subset-pairs-independently",
@@ -182,6 +501,12 @@ def too_many_fastx_records():
 @click.option(
     "-o", "--out", default=".", type=click.Path(), help="Where to save the filtered outputs"
 )
+@click.option(
+    "--compress-output",
+    default=False,
+    is_flag=True,
+    help="gzip-compress the filtered outputs, using multiple threads.",
+)
 @click.pass_context
 @pretty_errors
 @login_required
@@ -191,19 +516,30 @@ def cli(
     fastx,
     reverse,
     tax_ids,
+    bins,
+    bins_file,
     with_children,
     subset_pairs_independently,
     exclude_reads,
     include_lowconf,
     out,
     validate,
+    compress_output,
 ):
     if ctx.info_name == "filter_reads":
         warnings.warn(
             "filter_reads will be removed in a future version. Please use subset_reads instead!"
         )
 
-    if not len(tax_ids):
+    if tax_ids and (bins or bins_file):
+        raise OneCodexException("Pass either -t/--tax-id or --bin/--bins-file, not both")
+
+    if bins or bins_file:
+        bins = parse_bins(bins, bins_file)
+    elif tax_ids:
+        # a plain subset is a single bin, written to the usual .filtered output(s)
+        bins = {None: list(tax_ids)}
+    else:
         raise OneCodexException("You must supply at least one tax ID")
 
     # fetch classification result object from API
@@ -211,18 +547,20 @@ def cli(
     if classification is None:
         raise ValidationError("Classification {} not found.".format(classification_id))
 
-    # if with children, expand tax_ids by referring to the taxonomic tree
+    # if with children, expand each bin's tax_ids by referring to the taxonomic tree, which is
+    # only fetched and built once
     if with_children:
         tax_id_map = make_taxonomy_dict(classification)
 
-        new_tax_ids = []
+        for name, bin_tax_ids in bins.items():
+            new_tax_ids = []
 
-        for t_id in tax_ids:
-            new_tax_ids.extend(recurse_taxonomy_map(tax_id_map, t_id))
+            for t_id in bin_tax_ids:
+                new_tax_ids.extend(recurse_taxonomy_map(tax_id_map, t_id))
 
-        tax_ids = new_tax_ids
+            bins[name] = new_tax_ids
 
-    tax_ids = set(tax_ids)
+    bins = {name: set(bin_tax_ids) for name, bin_tax_ids in bins.items()}
 
     # pull the classification result TSV
     tsv_url = classification._readlevel()["url"]
@@ -232,35 +570,16 @@ def cli(
     else:
         click.echo("Using cached read-level results: {}".format(readlevel_path), err=True)
 
-    # count the number of rows in the TSV file
-    with gzip.open(readlevel_path, "rt") as tsv:
-        try:
-            tsv_row_count = 0
-            for _ in tsv:
-                tsv_row_count += 1
-            tsv_row_count -= 1  # discount header line
-        except EOFError:
-            click.echo(
-                "\nWe encountered an error while processing the read "
-                "level results. Please delete {} and try again.".format(readlevel_path),
-                err=True,
-            )
-            raise
-
-    if reverse:
-        if tsv_row_count % 2 != 0:
-            raise ValidationError(
-                "Classification results cannot have odd number of records if using --reverse/-r"
-            )
+    # determine the name of the output file(s) of each bin
+    def _output_filename(file_path, name):
+        filename = get_filtered_filename(file_path, "filtered" if name is None else name)[0]
+        filename = os.path.join(out, filename)
+        return filename + ".gz" if compress_output else filename
 
-        tsv_row_count = int(tsv_row_count / 2.0)
-
-    # determine the name of the output file(s)
-    filtered_filename, ext = get_filtered_filename(fastx)
-    filtered_filename = os.path.join(out, filtered_filename)
+    ext = get_filtered_filename(fastx)[1]
+    filtered_filenames = {name: _output_filename(fastx, name) for name in bins}
     if reverse:
-        rev_filtered_filename = get_filtered_filename(reverse)[0]
-        rev_filtered_filename = os.path.join(out, rev_filtered_filename)
+        rev_filtered_filenames = {name: _output_filename(reverse, name) for name in bins}
 
     if ext in {".fa", ".fna", ".fasta"}:
         io_kwargs = {"format": "fasta"}
@@ -272,136 +591,80 @@ def cli(
         )
 
     # do the actual filtering
-    save_msg = "Saving subsetted reads: {}".format(filtered_filename)
-    if reverse:
-        save_msg += " and {}".format(rev_filtered_filename)
-    click.echo(save_msg, err=True)
+    for name in bins:
+        save_msg = "Saving subsetted reads: {}".format(filtered_filenames[name])
+        if reverse:
+            save_msg += " and {}".format(rev_filtered_filenames[name])
+        click.echo(save_msg, err=True)
 
-    # see mainline/#3513. we must set idx=0 here for cases where the fastx file is empty
-    idx = 0
+    if not validate and io_kwargs["format"] == "fastq":
+        fwd_iter = fastfastq(fastx)
+        rev_iter = fastfastq(reverse) if reverse else None
+    else:
+        fwd_iter = validating_parser(fastx, **io_kwargs)
+        rev_iter = validating_parser(reverse, **io_kwargs) if reverse else None
+
+    # progress is measured in bytes of the (compressed) read-level results read so far, so we
+    # don't need a separate pass over them just to count the rows
+    with click.progressbar(length=os.path.getsize(readlevel_path)) as bar, io.open(
+        readlevel_path, "rb"
+    ) as raw_tsv, ExitStack() as outputs:
+        masks = readlevel_bin_masks(
+            raw_tsv,
+            bins,
+            paired=bool(reverse),
+            subset_pairs_independently=subset_pairs_independently,
+            exclude_reads=exclude_reads,
+            include_lowconf=include_lowconf,
+        )
 
-    with click.progressbar(length=tsv_row_count) as bar, gzip.open(readlevel_path, "rt") as tsv:
-        reader = csv.DictReader(tsv, delimiter="\t")
+        out_files = {
+            name: outputs.enter_context(open_output(filename, compress_output))
+            for name, filename in filtered_filenames.items()
+        }
 
-        if reverse:
-            if not validate and io_kwargs["format"] == "fastq":
-                fwd_iter = fastfastq(fastx)
-                rev_iter = fastfastq(reverse)
-            else:
-                fwd_iter = validating_parser(fastx, **io_kwargs)
-                rev_iter = validating_parser(reverse, **io_kwargs)
-
-            with io.open(filtered_filename, "wb") as out_file, io.open(
-                rev_filtered_filename, "wb"
-            ) as rev_out_file:  # noqa
-
-                for idx, (fwd, rev) in enumerate(zip(fwd_iter, rev_iter)):
-                    if idx == tsv_row_count:
-                        too_many_fastx_records()
-                    if idx % 1000 == 0:
-                        bar.update(1000)
-                    row = next(reader)  # necessary to do it this way for py2 compat
-                    row2 = next(reader)
-
-                    if subset_pairs_independently:
-                        if include_lowconf:
-                            if exclude_reads:
-                                if row["Tax ID"] not in tax_ids:
-                                    out_file.write(fwd)
-                                if row2["Tax ID"] not in tax_ids:
-                                    rev_out_file.write(rev)
-                            else:
-                                if row["Tax ID"] in tax_ids:
-                                    out_file.write(fwd)
-                                if row2["Tax ID"] in tax_ids:
-                                    rev_out_file.write(rev)
-                        else:
-                            if exclude_reads:
-                                if (
-                                    row.get("Passed Filter", "T") == "T"
-                                    and row["Tax ID"] not in tax_ids
-                                ):
-                                    out_file.write(fwd)
-                                if (
-                                    row2.get("Passed Filter", "T") == "T"
-                                    and row2["Tax ID"] not in tax_ids
-                                ):
-                                    rev_out_file.write(rev)
-                            else:
-                                if (
-                                    row.get("Passed Filter", "T") == "T"
-                                    and row["Tax ID"] in tax_ids
-                                ):
-                                    out_file.write(fwd)
-                                if (
-                                    row2.get("Passed Filter", "T") == "T"
-                                    and row2["Tax ID"] in tax_ids
-                                ):
-                                    rev_out_file.write(rev)
-                    else:
-                        if include_lowconf:
-                            if exclude_reads:
-                                if row["Tax ID"] not in tax_ids or row2["Tax ID"] not in tax_ids:
-                                    out_file.write(fwd)
-                                    rev_out_file.write(rev)
-                            else:
-                                if row["Tax ID"] in tax_ids or row2["Tax ID"] in tax_ids:
-                                    out_file.write(fwd)
-                                    rev_out_file.write(rev)
-                        else:
-                            if exclude_reads:
-                                if (
-                                    row.get("Passed Filter", "T") == "T"
-                                    and row["Tax ID"] not in tax_ids
-                                ) or (
-                                    row2.get("Passed Filter", "T") == "T"
-                                    and row2["Tax ID"] not in tax_ids
-                                ):
-                                    out_file.write(fwd)
-                                    rev_out_file.write(rev)
-                            else:
-                                if (
-                                    row.get("Passed Filter", "T") == "T"
-                                    and row["Tax ID"] in tax_ids
-                                ) or (
-                                    row2.get("Passed Filter", "T") == "T"
-                                    and row2["Tax ID"] in tax_ids
-                                ):
-                                    out_file.write(fwd)
-                                    rev_out_file.write(rev)
-        else:
-            if not validate and io_kwargs["format"] == "fastq":
-                fwd_iter = fastfastq(fastx)
+        # like zip(), stop at the end of the FASTX file(s) if they're shorter than the results (e.g.
+        # when they're empty)
+        fastx_ended = False
+        try:
+            if reverse:
+                rev_out_files = {
+                    name: outputs.enter_context(open_output(filename, compress_output))
+                    for name, filename in rev_filtered_filenames.items()
+                }
+
+                # R1 and R2 are parsed and written in parallel, a block at a time
+                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                    for block_masks in masks:
+                        fwd_keeps = {name: keep[0] for name, keep in block_masks.items()}
+                        rev_keeps = {name: keep[1] for name, keep in block_masks.items()}
+                        futures = [
+                            executor.submit(write_binned_records, fwd_iter, fwd_keeps, out_files),
+                            executor.submit(
+                                write_binned_records, rev_iter, rev_keeps, rev_out_files
+                            ),
+                        ]
+                        fastx_ended = not all([future.result() for future in futures])
+                        bar.update(raw_tsv.tell() - bar.pos)
+                        if fastx_ended:
+                            break
             else:
-                fwd_iter = validating_parser(fastx, **io_kwargs)
-
-            with io.open(filtered_filename, "wb") as out_file:
-                for idx, (fwd, row) in enumerate(zip(fwd_iter, reader)):
-                    if idx == tsv_row_count:
-                        too_many_fastx_records()
-                    if idx % 1000 == 0:
-                        bar.update(1000)
-                    if include_lowconf:
-                        if exclude_reads:
-                            if row["Tax ID"] not in tax_ids:
-                                out_file.write(fwd)
-                        else:
-                            if row["Tax ID"] in tax_ids:
-                                out_file.write(fwd)
-                    else:
-                        if exclude_reads:
-                            if (
-                                row.get("Passed Filter", "T") == "T"
-                                and row["Tax ID"] not in tax_ids
-                            ):
-                                out_file.write(fwd)
-                        else:
-                            if row.get("Passed Filter", "T") == "T" and row["Tax ID"] in tax_ids:
-                                out_file.write(fwd)
-
-        if idx < tsv_row_count - 1:  # 0-based idx, 1-based tsv_row_count
-            raise ValidationError(
-                "FASTX file(s) provided have fewer records than the classification results"
+                for block_masks in masks:
+                    fastx_ended = not write_binned_records(fwd_iter, block_masks, out_files)
+                    bar.update(raw_tsv.tell() - bar.pos)
+                    if fastx_ended:
+                        break
+        except EOFError:
+            click.echo(
+                "\nWe encountered an error while processing the read "
+                "level results. Please delete {} and try again.".format(readlevel_path),
+                err=True,
             )
+            raise
+
+        if not fastx_ended and (
+            next(fwd_iter, None) is not None or (reverse and next(rev_iter, None) is not None)
+        ):
+            too_many_fastx_records()
 
         bar.finish()
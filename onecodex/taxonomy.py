@@ -1,4 +1,298 @@
+import sys
 import warnings
+from collections import defaultdict
+
+from onecodex.lib.enums import _RANK_TO_LEVEL
+
+# sentinels used in the `parents` and `levels` arrays of a `TaxonomyTable`
+NO_PARENT = -1
+NO_LEVEL = -1
+
+_RANK_VALUE_TO_LEVEL = {rank.value: level for rank, level in _RANK_TO_LEVEL.items()}
+
+
+class TaxonomyTable(object):
+    """Compact, columnar store of the taxa observed in a set of classification results.
+
+    Taxa are stored by position: the parent of each taxon and its rank level are kept in small
+    integer arrays, so rank and lineage operations can be done with NumPy instead of looking up
+    each tax ID in a `pd.DataFrame`. `to_frame()` returns the equivalent `taxonomy` DataFrame.
+
+    Parameters
+    ----------
+    tax_ids : `list` of `str`
+        Tax IDs, in the order they were observed.
+    names : `list` of `str`
+        The name of each taxon.
+    ranks : `list` of `str`
+        The rank of each taxon (e.g. 'genus' or 'no rank').
+    parent_tax_ids : `list` of `str`
+        The tax ID of each taxon's parent, or None for the root.
+
+    Attributes
+    ----------
+    index : `pd.Index`
+        The tax IDs. The position of a tax ID in the index is its position in every other array.
+    names : `np.ndarray`
+        The (interned) name of each taxon.
+    ranks : `pd.Categorical`
+        The rank of each taxon.
+    levels : `np.ndarray` of `int8`
+        The `Rank.level` of each taxon, or `NO_LEVEL` if its rank isn't one of `Rank`.
+    parents : `np.ndarray` of `int32`
+        The position of each taxon's parent, or `NO_PARENT` if the parent isn't in the table.
+    """
+
+    def __init__(self, tax_ids, names, ranks, parent_tax_ids):
+        import numpy as np
+        import pandas as pd
+
+        self.index = pd.Index(tax_ids, dtype=object, name="tax_id")
+        self.names = np.array(
+            [sys.intern(n) if isinstance(n, str) else n for n in names], dtype=object
+        )
+        self.ranks = pd.Categorical(ranks)
+        # a missing rank has category code -1, which picks the trailing NO_LEVEL
+        category_levels = [_RANK_VALUE_TO_LEVEL.get(r, NO_LEVEL) for r in self.ranks.categories]
+        self.levels = np.array(category_levels + [NO_LEVEL], dtype=np.int8)[self.ranks.codes]
+        self._parent_tax_ids = pd.Index(parent_tax_ids, dtype=object)
+        self.parents = self.index.get_indexer(self._parent_tax_ids).astype(np.int32)
+        self._name_index = None
+        self._lineages = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a `TaxonomyTable` from a `taxonomy` DataFrame, as returned by `to_frame()`."""
+        return cls(df.index, df["name"], df["rank"], df["parent_tax_id"])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return "<TaxonomyTable: {} taxa>".format(len(self))
+
+    def positions(self, tax_ids):
+        """Return the position of each of `tax_ids`, or -1 for tax IDs that aren't in the table."""
+        import numpy as np
+
+        return self.index.get_indexer(list(tax_ids)).astype(np.int32)
+
+    def levels_of(self, tax_ids):
+        """Return the rank level of each of `tax_ids`, or `NO_LEVEL` if it has none."""
+        import numpy as np
+
+        positions = self.positions(tax_ids)
+        levels = self.levels[positions]
+        levels[positions == -1] = NO_LEVEL
+        return np.asarray(levels, dtype=np.int8)
+
+    def take(self, positions):
+        """Return a new `TaxonomyTable` with only the taxa at `positions`, in that order."""
+        import numpy as np
+
+        positions = np.asarray(positions, dtype=np.intp)
+        return TaxonomyTable(
+            self.index[positions],
+            self.names[positions],
+            np.asarray(self.ranks)[positions],
+            self._parent_tax_ids[positions],
+        )
+
+    def ancestors_mask(self, positions, include_self=True):
+        """Return a boolean array that's True for the taxa at `positions` and all of their ancestors.
+
+        Positions of -1 (i.e. tax IDs that aren't in the table) are ignored. Each taxon is visited
+        at most once, walking all the lineages up one level at a time.
+        """
+        import numpy as np
+
+        mask = np.zeros(len(self), dtype=bool)
+        frontier = np.asarray(positions, dtype=np.int32)
+        frontier = frontier[frontier != NO_PARENT]
+
+        if not include_self:
+            frontier = self.parents[frontier]
+
+        while len(frontier):
+            frontier = np.unique(frontier[frontier != NO_PARENT])
+            frontier = frontier[~mask[frontier]]
+            mask[frontier] = True
+            frontier = self.parents[frontier]
+
+        return mask
+
+    def ancestor_at_level(self, level):
+        """Return, for every taxon, the position of itself or its nearest ancestor at `level`.
+
+        Taxa without an ancestor at `level` (e.g. because they're above it) get `NO_PARENT`.
+        """
+        import numpy as np
+
+        result = np.full(len(self), NO_PARENT, dtype=np.int32)
+        current = np.arange(len(self), dtype=np.int32)
+        active = np.flatnonzero(current != NO_PARENT)
+
+        # walk every lineage up at once, dropping taxa once they reach or pass `level`
+        for _ in range(len(self)):
+            if not len(active):
+                break
+
+            curr_levels = self.levels[current[active]]
+            found = curr_levels == level
+            result[active[found]] = current[active[found]]
+
+            current[active] = self.parents[current[active]]
+            done = found | (curr_levels > level) | (current[active] == NO_PARENT)
+            active = active[~done]
+
+        return result
+
+    def highest_unclassified_at_level(self, level):
+        """Return, for every taxon, the highest ranked taxon in its lineage that's below `level`.
+
+        This is the taxon a "No <rank>" rollup should count the taxon under. Walking up from each
+        taxon, it's the last taxon with a rank below `level` before reaching a taxon above `level`
+        (or the root). Taxa that have a taxon at `level` in their lineage are classified at that
+        rank and get `NO_PARENT`.
+        """
+        import numpy as np
+
+        result = np.arange(len(self), dtype=np.int32)
+        current = np.arange(len(self), dtype=np.int32)
+        active = np.arange(len(self))
+
+        for _ in range(len(self)):
+            if not len(active):
+                break
+
+            curr = current[active]
+            curr_levels = self.levels[curr]
+            ranked = curr_levels != NO_LEVEL
+            classified = ranked & (curr_levels == level)
+            below = ranked & (curr_levels < level)
+
+            result[active[below]] = curr[below]
+            result[active[classified]] = NO_PARENT
+
+            current[active] = self.parents[curr]
+            done = classified | (ranked & (curr_levels > level)) | (current[active] == NO_PARENT)
+            active = active[~done]
+
+        return result
+
+    def lineage_matrix(self, positions):
+        """Return a sparse matrix of the lineages of the taxa at `positions`, and its columns.
+
+        Row `i` is 1 in the column of the taxon at `positions[i]` and of each of its ancestors, so
+        multiplying a samples x taxa matrix by it sums the abundance of every taxon into all of its
+        ancestors. The columns are the positions of every taxon in any of the lineages, i.e. the
+        tree pruned to `positions`, which are returned with the matrix. Results are cached by
+        `positions`.
+        """
+        import numpy as np
+        import scipy.sparse
+
+        positions = np.asarray(positions, dtype=np.int32)
+        key = positions.tobytes()
+        if key in self._lineages:
+            return self._lineages[key]
+
+        rows = [np.array([], dtype=np.intp)]
+        cols = [np.array([], dtype=np.int32)]
+        row = np.flatnonzero(positions != NO_PARENT)
+        current = positions[row]
+
+        # walk every lineage up at once, one level at a time
+        for _ in range(len(self)):
+            if not len(current):
+                break
+
+            rows.append(row)
+            cols.append(current)
+            current = self.parents[current]
+            row, current = row[current != NO_PARENT], current[current != NO_PARENT]
+
+        rows = np.concatenate(rows)
+        nodes, cols = np.unique(np.concatenate(cols), return_inverse=True)
+        matrix = scipy.sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(positions), len(nodes))
+        )
+
+        self._lineages[key] = (matrix, nodes)
+        return matrix, nodes
+
+    def _build_name_index(self):
+        """Index the lower-cased taxon names by exact name and by trigram."""
+        import numpy as np
+
+        if self._name_index is not None:
+            return self._name_index
+
+        lower_names = [name.lower() if isinstance(name, str) else "" for name in self.names]
+
+        exact = {}
+        trigrams = defaultdict(list)
+        for pos, name in enumerate(lower_names):
+            exact.setdefault(name, pos)
+            for trigram in {name[i : i + 3] for i in range(len(name) - 2)}:
+                trigrams[trigram].append(pos)
+
+        trigrams = {k: np.array(v, dtype=np.int32) for k, v in trigrams.items()}
+        self._name_index = (lower_names, exact, trigrams)
+        return self._name_index
+
+    def search_name(self, query):
+        """Return the position of the taxon whose name best matches `query`, or `NO_PARENT`.
+
+        Matching is case-insensitive. A taxon named exactly `query` is preferred (the first one, if
+        several share the name); otherwise, it's the taxon with the lowest tax ID among those whose
+        names contain `query`. Candidates for a partial match are found with a trigram index, so
+        only a few names are actually compared.
+        """
+        import numpy as np
+
+        lower_names, exact, trigrams = self._build_name_index()
+        query = query.lower()
+
+        if query in exact:
+            return exact[query]
+
+        if len(query) >= 3:
+            # every name containing `query` contains all of its trigrams
+            postings = sorted(
+                (
+                    trigrams.get(query[i : i + 3], np.array([], dtype=np.int32))
+                    for i in range(len(query) - 2)
+                ),
+                key=len,
+            )
+            candidates = postings[0]
+            for posting in postings[1:]:
+                if not len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        else:
+            candidates = np.arange(len(self))
+
+        hits = [pos for pos in candidates if query in lower_names[pos]]
+        if not hits:
+            return NO_PARENT
+
+        return int(min(hits, key=lambda pos: int(self.index[pos])))
+
+    def to_frame(self):
+        """Return the taxonomy as a `pd.DataFrame` of names, ranks and parent tax IDs."""
+        import pandas as pd
+
+        return pd.DataFrame(
+            {
+                "name": self.names,
+                "rank": pd.Index(self.ranks, dtype=object),
+                "parent_tax_id": self._parent_tax_ids,
+            },
+            index=self.index,
+            dtype=object,
+        )
 
 
 class TaxonomyMixin(object):
@@ -57,11 +351,19 @@ class TaxonomyMixin(object):
         `skbio.tree.TreeNode`, the root of a tree containing the given taxonomic IDs and their
         parents, leading back to the root node.
         """
-        tax_ids_to_keep = []
+        tax_ids_to_keep = set()
 
         for tax_id in tax_ids:
-            tax_ids_to_keep.append(tax_id)
-            tax_ids_to_keep.extend([x.name for x in tree.find(tax_id).ancestors()])
+            if tax_id in tax_ids_to_keep:
+                continue
+
+            tax_ids_to_keep.add(tax_id)
+
+            # stop at the first ancestor that's already kept, since its lineage is too
+            for node in tree.find(tax_id).ancestors():
+                if node.name in tax_ids_to_keep:
+                    break
+                tax_ids_to_keep.add(node.name)
 
         tree = tree.copy()
         tree.remove_deleted(lambda n: n.name not in tax_ids_to_keep)
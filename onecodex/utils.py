@@ -9,8 +9,6 @@ import re
 import requests
 import sys
 import sentry_sdk
-from contextlib import contextmanager
-import tempfile
 
 try:
     from StringIO import StringIO
@@ -34,6 +32,9 @@ OPTION_HELP = {
     "no_pprint": "Do not pretty-print JSON responses",
     "threads": "Do not use multiple background threads to upload files",  # noqa
     "max_threads": "Specify a different max # of upload threads (defaults to 4)",  # noqa
+    "upload_max_threads": "Specify a different max # of upload threads (defaults to 4). Each thread adds 4 to the number of file parts sent at once, which are shared by all files",  # noqa
+    "download_max_threads": "Specify a different max # of samples to download at once (defaults to 4)",  # noqa
+    "max_bandwidth": "Limit the total upload rate, in bytes per second. Accepts K, M and G suffixes, e.g. 50M",  # noqa
     "verbose": "Log extra information to STDERR",
     "results": "Get a JSON array of the metagenomic classification results table",
     "readlevel": "Get the read-level data as a .tsv file",
@@ -82,6 +83,15 @@ OPTION_HELP = {
     "sample_id": "Provide an ID for a sample that was previously 'pre-uploaded' along with metadata.",
     "external_sample_id": "Provide an external sample ID for a sample that was previously 'pre-uploaded' along with metadata.",
     "name": "Provide a display name for your asset (optional).",
+    "resume": (
+        "Save upload progress locally and continue any previously interrupted upload of the same "
+        "file(s) where it left off. Interrupted uploads are kept (not canceled) so that they can "
+        "be resumed by running the same command again."
+    ),
+    "compress": (
+        "Gzip-compress uncompressed FASTA/Q files on the fly while uploading them. No compressed "
+        "copy is written to disk."
+    ),
 }
 
 SUPPORTED_EXTENSIONS = [
@@ -110,6 +120,21 @@ def valid_api_key(ctx, param, value):
         return value
 
 
+def valid_bandwidth(ctx, param, value):
+    """Parse a rate like `500K` or `50M` into bytes per second (this is a click callback)."""
+    if value is None:
+        return value
+
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$", value, re.IGNORECASE)
+    if not match or float(match.group(1)) <= 0:
+        raise click.BadParameter(
+            "Expected a positive number of bytes per second, e.g. 500K or 50M, not {}".format(value)
+        )
+
+    multiplier = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}[match.group(2).upper()]
+    return int(float(match.group(1)) * multiplier)
+
+
 def pprint(j, no_pretty):
     """Print as formatted JSON."""
     if not no_pretty:
@@ -486,9 +511,3 @@ def is_continuous(series):
 
 def has_missing_values(dataframe_or_series):
     return dataframe_or_series.isnull().values.any()
-
-
-@contextmanager
-def use_tempdir():
-    with tempfile.TemporaryDirectory() as tempdir:
-        yield tempdir
@@ -4,7 +4,7 @@ import warnings
 
 from onecodex.lib.enums import BetaDiversityMetric, Rank, Linkage, OrdinationMethod
 from onecodex.exceptions import OneCodexException, PlottingException, PlottingWarning
-from onecodex.distance import DistanceMixin
+from onecodex.distance import DistanceMixin, _is_sparse
 from onecodex.viz._primitives import (
     interleave_palette,
     prepare_props,
@@ -62,6 +62,8 @@ class VizDistanceMixin(DistanceMixin):
         from sklearn.metrics.pairwise import euclidean_distances
 
         df = self._results
+        if _is_sparse(df):
+            df = df.sparse.to_dense()
 
         if classification_ids_without_abundances:
             # subset in case we're plotting a facet
@@ -105,7 +107,10 @@ class VizDistanceMixin(DistanceMixin):
         from scipy.spatial.distance import squareform
         from sklearn.metrics.pairwise import euclidean_distances
 
-        df = self._results.dropna(how="all").replace(np.nan, 0)
+        df = self._results
+        if _is_sparse(df):
+            df = df.sparse.to_dense()
+        df = df.dropna(how="all").replace(np.nan, 0)
 
         dist_matrix = euclidean_distances(df.T).round(6)
 
@@ -360,6 +365,7 @@ class VizDistanceMixin(DistanceMixin):
         from scipy.spatial.distance import squareform
         from scipy.stats import pearsonr
         from skbio.stats import ordination
+        from skbio.stats.distance import DistanceMatrix
         from sklearn import manifold
         from sklearn.metrics.pairwise import euclidean_distances
 
@@ -444,9 +450,11 @@ class VizDistanceMixin(DistanceMixin):
             # opinionated about the analyses that we allow our users to do (roo)
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
+                # round to avoid float precision errors. scikit-bio needs a writable array, which
+                # a DataFrame's values aren't with pandas Copy-on-Write on
                 ord_result = ordination.pcoa(
-                    dists.round(6)
-                )  # round to avoid float precision errors
+                    DistanceMatrix(dists.round(6).to_numpy(copy=True), ids=dists.index)
+                )
 
             plot_data = ord_result.samples.iloc[:, [0, 1]]  # get first two components
             plot_data = plot_data.div(plot_data.abs().max(axis=0), axis=1)  # normalize to [0,1]
@@ -40,6 +40,8 @@ def test_classification_ids_without_abundances_property(samples):
     assert samples.to_df(fill_missing=False).ocx._classification_ids_without_abundances == []
 
     samples._results.iloc[0] = np.nan
+    # to_df() is memoized, and can't see in-place changes to the collated results
+    samples._memo.clear()
 
     assert samples.to_df(fill_missing=False).ocx._classification_ids_without_abundances == [
         samples._results.iloc[0].name
@@ -265,6 +267,47 @@ def test_to_df_include_taxa_missing_rank(samples, metric, rank):
     assert f"No {rank.value}" in df.columns
 
 
+def test_to_df_shares_metadata_and_taxonomy(samples):
+    import numpy as np
+
+    df = samples.to_df()
+    assert np.shares_memory(
+        df.ocx_metadata["filename"].to_numpy(), samples.metadata["filename"].to_numpy()
+    )
+    assert np.shares_memory(df.ocx_taxonomy["name"].to_numpy(), samples.taxonomy["name"].to_numpy())
+
+    # adding columns doesn't change the collection's
+    df.ocx_metadata["new_field"] = 1
+    assert "new_field" not in samples.metadata
+
+
+def test_to_df_copy_on_write(samples):
+    import numpy as np
+    import pandas as pd
+
+    with pd.option_context("mode.copy_on_write", True):
+        samples._collate_results(metric="readcount_w_children")
+        df = samples.to_df(rank=None, normalize=False, remove_zeros=False, fill_missing=False)
+
+        # the table, metadata and taxonomy share their data with the collection's...
+        assert np.shares_memory(df.to_numpy(), samples._results.to_numpy())
+        assert np.shares_memory(
+            df.ocx_metadata["filename"].to_numpy(), samples.metadata["filename"].to_numpy()
+        )
+        assert np.shares_memory(
+            df.ocx_taxonomy["name"].to_numpy(), samples.taxonomy["name"].to_numpy()
+        )
+
+        # ...until they're modified
+        df.iloc[0, 0] = -1
+        df.ocx_metadata.loc[:, "filename"] = None
+        assert samples._results.iloc[0, 0] != -1
+        assert samples.metadata["filename"].notnull().all()
+
+        again = samples.to_df(rank=None, normalize=False, remove_zeros=False, fill_missing=False)
+        assert again.iloc[0, 0] != -1
+
+
 @pytest.mark.parametrize("metric", ["readcount", "abundance"])
 def test_to_df_include_taxa_missing_rank_invalid_usage(samples, metric):
     samples._collate_results(metric=metric)
@@ -274,3 +317,50 @@ def test_to_df_include_taxa_missing_rank_invalid_usage(samples, metric):
 
     with pytest.raises(OneCodexException, match="`include_taxa_missing_rank`.*metrics"):
         samples.to_df(include_taxa_missing_rank=True)
+
+
+def test_to_df_long_drop_empty(samples):
+    long_df = samples.to_df(table_format="long", rank="genus", fill_missing=False)
+    dropped = samples.to_df(table_format="long", rank="genus", fill_missing=False, drop_empty=True)
+
+    value_name = long_df.columns[-1]
+    assert len(dropped) < len(long_df)
+    assert (dropped[value_name] > 0).all()
+    assert dropped[value_name].sum() == pytest.approx(long_df[value_name].sum())
+
+
+@pytest.mark.parametrize("filename", ["long.csv", "long.tsv.gz"])
+def test_write_long_table(samples, tmp_path, filename):
+    import pandas as pd
+
+    path = str(tmp_path / filename)
+    samples.write_long_table(path, chunk_size=100, rank="genus")
+
+    expected = samples.to_df(table_format="long", rank="genus")
+    written = pd.read_csv(path, sep="\t" if ".tsv" in filename else ",", dtype={"tax_id": str})
+    pd.testing.assert_frame_equal(written, pd.DataFrame(expected))
+
+    samples.write_long_table(path, chunk_size=100, rank="genus", drop_empty=True)
+    written = pd.read_csv(path, sep="\t" if ".tsv" in filename else ",", dtype={"tax_id": str})
+    assert len(written) == len(expected[expected.iloc[:, -1] != 0])
+
+
+def test_write_long_table_parquet(samples, tmp_path):
+    pytest.importorskip("pyarrow")
+    import pandas as pd
+
+    path = str(tmp_path / "long.parquet")
+    samples.write_long_table(path, chunk_size=100, rank="genus")
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(path), pd.DataFrame(samples.to_df(table_format="long", rank="genus"))
+    )
+
+
+def test_write_long_table_unknown_format(samples, tmp_path):
+    with pytest.raises(OneCodexException, match="file_format"):
+        samples.write_long_table(str(tmp_path / "long.xlsx"))
+
+
+def test_write_long_table_table_format(samples, tmp_path):
+    with pytest.raises(OneCodexException, match="always writes the long format"):
+        samples.write_long_table(str(tmp_path / "long.csv"), table_format="long")
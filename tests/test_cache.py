@@ -0,0 +1,103 @@
+import pytest
+
+from onecodex import Api
+from onecodex.lib.cache import MemoryCache, ResultsCache
+from tests.conftest import SCHEMA_ROUTES, mock_requests
+
+
+def test_results_cache_round_trip(tmp_path):
+    cache = ResultsCache(str(tmp_path))
+
+    assert cache.get("a") is None
+    cache.set("a", {"table": [{"tax_id": "816", "readcount": 1}]})
+    assert "a" in cache
+    assert cache.get("a") == {"table": [{"tax_id": "816", "readcount": 1}]}
+
+    # persists across instances
+    assert ResultsCache(str(tmp_path)).get("a") == {"table": [{"tax_id": "816", "readcount": 1}]}
+
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_results_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultsCache(str(tmp_path), max_size=10**6)
+    value = {"data": list(range(200))}
+
+    cache.set("a", value)
+    entry_size = cache.size
+    cache.max_size = entry_size * 2
+
+    cache.set("b", value)
+    cache.get("a")  # "b" is now the least recently used
+    cache.set("c", value)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.size <= cache.max_size
+
+
+def _make_api(results_cache):
+    return Api(
+        api_key="1eab4217d30d42849dbde0cd1bb94e39",
+        base_url="http://localhost:3000",
+        cache_schema=False,
+        results_cache=results_cache,
+    )
+
+
+def _results_calls(rsps):
+    return [c for c in rsps.calls if c.request.url.endswith("/results")]
+
+
+def test_classification_results_cached_across_sessions(api_data, tmp_path):
+    ocx = _make_api(str(tmp_path))
+    results = ocx.Classifications.get("45a573fb7833449a").results()
+    assert len(_results_calls(api_data)) == 1
+
+    # a new session (and so new, unfetched resources) reads the results from disk
+    ocx = _make_api(str(tmp_path))
+    assert ocx.Classifications.get("45a573fb7833449a").results() == results
+    assert len(_results_calls(api_data)) == 1
+
+    # without the cache, results are fetched again
+    ocx = _make_api(False)
+    ocx.Classifications.get("45a573fb7833449a").results()
+    assert len(_results_calls(api_data)) == 2
+
+
+@pytest.mark.parametrize("env_value,enabled", [("", False), ("0", False), ("1", True)])
+def test_results_cache_from_environment(monkeypatch, tmp_path, env_value, enabled):
+    monkeypatch.setenv("ONE_CODEX_RESULTS_CACHE", env_value)
+    monkeypatch.setenv("ONE_CODEX_CACHE_DIR", str(tmp_path))
+
+    with mock_requests(SCHEMA_ROUTES):
+        results_cache = _make_api(None)._results_cache
+    assert (results_cache is not None) == enabled
+    if enabled:
+        assert results_cache.path == str(tmp_path)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_size=25, sizeof=len)
+
+    cache.set("a", "x" * 10)
+    cache.set("b", "x" * 10)
+    cache.get("a")  # "b" is now the least recently used
+    cache.set("c", "x" * 10)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.get("c") == "x" * 10
+    assert cache.size == 20
+
+    # too large to cache at all
+    cache.set("d", "x" * 30)
+    assert "d" not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
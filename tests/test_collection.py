@@ -1,5 +1,6 @@
 from hashlib import sha256
 import json
+import mock
 
 import pytest
 
@@ -8,6 +9,7 @@ import warnings
 
 from onecodex.models.collection import SampleCollection
 from onecodex.exceptions import OneCodexException
+from onecodex.lib.enums import BetaDiversityMetric
 
 
 def test_sample_collection_pandas(samples):
@@ -132,6 +134,51 @@ def test_classification_fetch(ocx, samples):
     samples._resource[0].success = True
 
 
+def test_prefetch_results(samples, api_data):
+    classifications = samples._classifications
+    assert not any(getattr(c._resource, "_cached_result", None) for c in classifications)
+
+    samples.prefetch_results(max_threads=3, progressbar=True)
+
+    results_calls = [c for c in api_data.calls if c.request.url.endswith("/results")]
+    assert len(results_calls) == len(classifications)
+    for c in classifications:
+        assert c._resource._cached_result["table"]
+
+    # already-fetched results aren't fetched again
+    samples.prefetch_results()
+    samples._collate_results()
+    assert len([c for c in api_data.calls if c.request.url.endswith("/results")]) == len(
+        classifications
+    )
+
+
+def test_prefetch(samples, api_data):
+    from urllib.parse import unquote_plus
+
+    api_data.calls.reset()
+    samples.prefetch("metadata", "primary_classification.job")
+
+    urls = [unquote_plus(c.request.url) for c in api_data.calls]
+    assert len(urls) == 3
+    assert all('"$uri": {"$in": [' in url for url in urls)
+
+    # everything needed for the metadata was fetched in bulk
+    api_data.calls.reset()
+    assert len(samples.metadata) == 3
+    assert not [c for c in api_data.calls if "/api/v1/metadata/" in c.request.url]
+
+
+def test_where_include(ocx, api_data):
+    samples = ocx.Samples.where(project="4b53797444f846c4", include=["metadata"])
+    api_data.calls.reset()
+
+    for sample in samples:
+        assert sample.metadata.id
+
+    assert len(api_data.calls) == 0
+
+
 def test_collate_metadata(samples):
     # check contents of metadata df--at least that which can easily be coerced to strings
     metadata = samples.metadata
@@ -199,3 +246,95 @@ def test_collate_results(samples, metric, sha):
     with pytest.raises(OneCodexException) as e:
         samples._collate_results(metric="does_not_exist")
     assert "not valid" in str(e.value)
+
+
+@pytest.mark.parametrize("metric", ["readcount_w_children", "abundance_w_children", "readcount"])
+def test_sparse_collection(samples, metric):
+    import numpy as np
+    import pandas as pd
+
+    dense = SampleCollection(list(samples), metric=metric)
+    sparse = SampleCollection(list(samples), metric=metric, sparse=True)
+
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in sparse._results.dtypes)
+    pd.testing.assert_frame_equal(
+        sparse._results.sparse.to_dense(), dense._results, check_dtype=False
+    )
+    pd.testing.assert_frame_equal(sparse.taxonomy, dense.taxonomy)
+
+    for kwargs in [{}, {"rank": "genus"}, {"rank": None}, {"top_n": 5}]:
+        pd.testing.assert_frame_equal(
+            sparse.to_df(**kwargs).sparse.to_dense(),
+            pd.DataFrame(dense.to_df(**kwargs)),
+            check_dtype=False,
+            check_frame_type=False,
+        )
+
+    # long tables without empty cells are built from the sparse values
+    for kwargs in [{"rank": "genus"}, {"rank": "genus", "fill_missing": False}, {"rank": None}]:
+        kwargs.update(table_format="long", drop_empty=True)
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(sparse.to_df(**kwargs)),
+            pd.DataFrame(dense.to_df(**kwargs)),
+            check_dtype=False,
+        )
+
+    for alpha_metric in ["shannon", "simpson", "observed_taxa", "chao1"]:
+        pd.testing.assert_frame_equal(
+            sparse.alpha_diversity(alpha_metric), dense.alpha_diversity(alpha_metric)
+        )
+
+    for beta_metric in BetaDiversityMetric.values():
+        np.testing.assert_allclose(
+            sparse.beta_diversity(beta_metric).data,
+            dense.beta_diversity(beta_metric).data,
+            atol=1e-12,
+        )
+
+
+def test_memoized_to_df(samples):
+    import numpy as np
+    import pandas as pd
+
+    from onecodex.analyses import AnalysisMixin
+
+    with mock.patch.object(
+        AnalysisMixin,
+        "_to_classification_df",
+        autospec=True,
+        side_effect=AnalysisMixin._to_classification_df,
+    ) as to_df:
+        df = samples.to_df(rank="genus")
+        expected = df.copy()
+        expected_data = df.to_numpy()
+        assert to_df.call_count == 1
+
+        # equivalent arguments share an entry, and callers get read-only views of it
+        with pd.option_context("mode.copy_on_write", False):
+            with pytest.raises(ValueError, match="read-only"):
+                df.loc[:, :] = 0
+        df["new_column"] = 0
+        same_df = samples.to_df(rank="genus", normalize="auto")
+        assert to_df.call_count == 1
+        pd.testing.assert_frame_equal(same_df, expected)
+        assert np.shares_memory(same_df.to_numpy(), expected_data)
+        assert same_df.ocx_metadata is not df.ocx_metadata
+
+        samples.to_df(rank="family")
+        assert to_df.call_count == 2
+
+        # re-collating the results, or changing the collection, clears the memo
+        samples._collate_results(metric="readcount_w_children")
+        samples.to_df(rank="genus")
+        assert to_df.call_count == 3
+
+        del samples[0]
+        assert len(samples.to_df(rank="genus")) == 2
+        assert to_df.call_count == 4
+
+    # distance matrices aren't copied at all
+    dm = samples.beta_diversity("braycurtis")
+    assert samples.beta_diversity("braycurtis") is dm
+    pd.testing.assert_frame_equal(
+        samples.alpha_diversity("shannon"), samples.alpha_diversity(metric="shannon")
+    )
@@ -1,3 +1,4 @@
+import os
 import mock
 import pytest
 
@@ -22,6 +23,33 @@ def test_alpha_diversity(samples, metric, value, kwargs):
     assert divs[metric].tolist() == value
 
 
+@pytest.mark.parametrize("sparse", [False, True])
+def test_alpha_diversity_table(samples, sparse):
+    from onecodex.models.collection import SampleCollection
+
+    collection = SampleCollection(list(samples), sparse=sparse)
+    table = collection.alpha_diversity_table(
+        ["shannon", "simpson", "observed_taxa"], ["genus", "species"]
+    )
+    assert table.columns.names == ["rank", "metric"]
+    assert table.shape == (3, 6)
+
+    for rank in ["genus", "species"]:
+        for metric in ["shannon", "simpson", "observed_taxa"]:
+            pd.testing.assert_series_equal(
+                table[(rank, metric)],
+                collection.alpha_diversity(metric, rank=rank)[metric],
+                check_names=False,
+            )
+
+    # a single column for each metric at the automatically chosen rank by default
+    assert collection.alpha_diversity_table().columns.tolist() == [
+        ("auto", "simpson"),
+        ("auto", "observed_taxa"),
+        ("auto", "shannon"),
+    ]
+
+
 def test_alpha_diversity_exceptions(samples):
     # must be a metric that exists
     with pytest.raises(OneCodexException) as e:
@@ -53,7 +81,7 @@ def test_beta_diversity(samples, metric, value, kwargs):
 
 
 def test_beta_diversity_braycurtis_nans(samples):
-    mock_df = samples.to_df()
+    mock_df = samples.to_df().copy()
     mock_df.loc[:, :] = 0
 
     with mock.patch.object(samples, "to_df", return_value=mock_df):
@@ -70,6 +98,104 @@ def test_beta_diversity_exceptions(samples):
     assert "metric must be one of" in str(e.value)
 
 
+@pytest.mark.parametrize("metric", ["braycurtis", "cityblock", "jaccard"])
+def test_blocked_pdist(metric):
+    import numpy as np
+    from scipy.spatial.distance import pdist
+
+    from onecodex.distance import blocked_pdist
+
+    values = np.random.default_rng(42).random((23, 10))
+    values[values < 0.5] = 0
+    values[[3, 4]] = 0  # Bray-Curtis is nan between empty samples, which we replace with 0
+    if metric == "jaccard":
+        values = values > 0
+
+    expected = np.nan_to_num(pdist(values, metric=metric))
+    assert np.array_equal(blocked_pdist(values, metric), expected)
+    assert np.array_equal(blocked_pdist(values, metric, block_size=4, n_jobs=2), expected)
+
+
+def test_beta_diversity_blocked(samples, tmp_path):
+    import numpy as np
+
+    expected = samples.beta_diversity("braycurtis")
+
+    out = str(tmp_path / "distances.npy")
+    dm = samples.beta_diversity("braycurtis", block_size=1, n_jobs=2, out=out)
+    assert dm == expected
+    assert np.array_equal(np.load(out, mmap_mode="r"), expected.condensed_form())
+
+    # calls with `out` aren't memoized, so the file is written again
+    os.remove(out)
+    samples.beta_diversity("braycurtis", block_size=1, n_jobs=2, out=out)
+    assert np.array_equal(np.load(out, mmap_mode="r"), expected.condensed_form())
+
+
+def test_aitchison_distance_blocked(samples):
+    import numpy as np
+
+    expected = samples.aitchison_distance()
+
+    dm = samples.aitchison_distance(block_size=1, n_jobs=2, dtype="float32")
+    assert dm.data.dtype == np.float32
+    assert dm.ids == expected.ids
+    np.testing.assert_allclose(dm.condensed_form(), expected.condensed_form(), rtol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "metric", [m for m in BetaDiversityMetric.values() if m != BetaDiversityMetric.Aitchison]
+)
+@pytest.mark.parametrize("sparse", [False, True])
+def test_update_beta_diversity(samples, metric, sparse, tmp_path):
+    import numpy as np
+
+    from onecodex.models.collection import SampleCollection
+
+    collection = SampleCollection(list(samples), sparse=sparse)
+    expected = collection.beta_diversity(metric)
+
+    # the last sample is new
+    path = str(tmp_path / "distances.npz")
+    SampleCollection(list(samples)[:2], sparse=sparse).update_beta_diversity(
+        metric=metric, save_to=path
+    )
+    dm = collection.update_beta_diversity(path, metric=metric, block_size=1)
+    assert dm.ids == expected.ids
+    np.testing.assert_allclose(dm.data, expected.data, atol=1e-12)
+
+    # from a distance matrix in memory, with a sample that's since been removed
+    previous = collection.beta_diversity(metric)
+    dm = SampleCollection(list(samples)[1:], sparse=sparse).update_beta_diversity(
+        previous, metric=metric
+    )
+    assert dm == previous.filter(dm.ids)
+
+
+def test_update_beta_diversity_exceptions(samples, tmp_path):
+    import numpy as np
+
+    path = str(tmp_path / "distances.npz")
+    samples.update_beta_diversity(metric="braycurtis", rank="genus", save_to=path)
+
+    with pytest.raises(OneCodexException, match="was calculated with"):
+        samples.update_beta_diversity(path, metric="braycurtis", rank="species")
+
+    # the distances written by beta_diversity(out=...) don't say which samples they're between
+    npy_path = str(tmp_path / "distances.npy")
+    samples.beta_diversity("braycurtis", rank="genus", out=npy_path)
+    with pytest.raises(OneCodexException, match="only holds distances"):
+        samples.update_beta_diversity(npy_path, metric="braycurtis", rank="genus")
+
+    other_path = str(tmp_path / "other.npz")
+    np.savez(other_path, distances=np.zeros(3))
+    with pytest.raises(OneCodexException, match="wasn't saved by"):
+        samples.update_beta_diversity(other_path, metric="braycurtis", rank="genus")
+
+    with pytest.raises(OneCodexException, match="can't be updated"):
+        samples.update_beta_diversity(metric="aitchison")
+
+
 @pytest.mark.parametrize(
     "weighted,value",
     [(False, [0.6, 0.547486, 0.591304]), (True, [0.503168, 0.403155, 0.605155])],
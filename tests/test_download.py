@@ -1,16 +1,39 @@
+import json
 import os
 import os.path
+import re
 
 import pytest
+import requests
+import responses
 
 from onecodex.exceptions import OneCodexException
 from onecodex.lib.download import (
+    PartialDownload,
     download_samples,
+    download_url,
     filter_samples_by_tags,
     get_project,
     get_download_filename,
 )
 
+DOWNLOAD_URL = "http://localhost:3000/mock/download/ranged"
+DOWNLOAD_DATA = bytes(range(256)) * 40
+
+
+def _ranged_callback(requested_ranges):
+    def callback(request):
+        match = re.match(r"bytes=(\d+)-(\d+)", request.headers.get("Range", ""))
+        if not match:
+            return 200, {}, DOWNLOAD_DATA
+
+        start, end = int(match.group(1)), int(match.group(2))
+        requested_ranges.append((start, end))
+        headers = {"Content-Range": "bytes {}-{}/{}".format(start, end, len(DOWNLOAD_DATA))}
+        return 206, headers, DOWNLOAD_DATA[start : end + 1]
+
+    return callback
+
 
 class MockApi(object):
     def __init__(self, project_ids, project_names, tag_names):
@@ -90,6 +113,42 @@ def test_download_samples_outdir_exists(runner, ocx, api_data):
         download_samples(ocx, "output")
 
 
+def test_download_samples_stops_downloads_in_progress(runner, ocx, api_data):
+    import threading
+    import time
+
+    import mock
+
+    from onecodex.models.sample import Samples
+
+    started = threading.Event()
+    stopped = []
+
+    def download(self, path=None, progressbar=False, canceled=None):
+        if not started.is_set():
+            started.set()
+            # a download in progress, which only stops once it's canceled
+            stopped.append(canceled.wait(timeout=10))
+            return path
+
+        started.wait(timeout=10)
+        raise KeyboardInterrupt
+
+    with runner.isolated_filesystem(), mock.patch.object(
+        Samples, "download", autospec=True, side_effect=download
+    ):
+        with pytest.raises(KeyboardInterrupt):
+            download_samples(ocx, "output", max_threads=2)
+
+        started.wait(timeout=10)
+        for _ in range(100):
+            if stopped:
+                break
+            time.sleep(0.1)
+
+    assert stopped == [True]
+
+
 def test_get_project_by_id(mock_api):
     project = get_project(mock_api, "id2")
     assert project == "id2"
@@ -137,3 +196,112 @@ def test_get_download_filename(sample_id, sample_filename, output_filename):
     filename = get_download_filename(sample)
 
     assert filename == output_filename
+
+
+def test_download_url_in_ranges(tmp_path):
+    path = str(tmp_path / "sample.fq")
+    requested_ranges = []
+    progress = []
+
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(responses.GET, DOWNLOAD_URL, callback=_ranged_callback(requested_ranges))
+        download_url(
+            requests.Session(),
+            DOWNLOAD_URL,
+            path,
+            max_connections=4,
+            progress_callback=progress.append,
+            segment_size=1000,
+        )
+
+    with open(path, "rb") as f:
+        assert f.read() == DOWNLOAD_DATA
+
+    # one request to find the size, then one per segment
+    assert sorted(requested_ranges) == [
+        (0, 0),
+        (0, 2559),
+        (2560, 5119),
+        (5120, 7679),
+        (7680, 10239),
+    ]
+    assert sum(progress) == len(DOWNLOAD_DATA)
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_download_url_resumes_part_file(tmp_path):
+    path = str(tmp_path / "sample.fq")
+
+    # simulate an earlier attempt that wrote the first 100 bytes of each of 2 segments
+    half = len(DOWNLOAD_DATA) // 2
+    partial = PartialDownload(path, len(DOWNLOAD_DATA), 2)
+    with open(partial.part_path, "r+b") as f:
+        for start in [0, half]:
+            f.seek(start)
+            f.write(DOWNLOAD_DATA[start : start + 100])
+    partial.advance(0, 100)
+    partial.advance(1, 100)
+
+    with open(partial.state_path) as f:
+        assert json.load(f)["segments"] == [[0, half, 100], [half, len(DOWNLOAD_DATA), half + 100]]
+
+    requested_ranges = []
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(responses.GET, DOWNLOAD_URL, callback=_ranged_callback(requested_ranges))
+        download_url(requests.Session(), DOWNLOAD_URL, path, max_connections=4, segment_size=1000)
+
+    with open(path, "rb") as f:
+        assert f.read() == DOWNLOAD_DATA
+
+    # the segments from the earlier attempt are kept, and only the rest of each is requested
+    assert sorted(requested_ranges) == [
+        (0, 0),
+        (100, half - 1),
+        (half + 100, len(DOWNLOAD_DATA) - 1),
+    ]
+
+
+def test_download_url_without_range_support(tmp_path):
+    path = str(tmp_path / "sample.fq")
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, DOWNLOAD_URL, body=DOWNLOAD_DATA)
+        download_url(requests.Session(), DOWNLOAD_URL, path, segment_size=1000)
+
+    with open(path, "rb") as f:
+        assert f.read() == DOWNLOAD_DATA
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_url_canceled(tmp_path):
+    import concurrent.futures
+    import threading
+
+    path = str(tmp_path / "sample.fq")
+    canceled = threading.Event()
+
+    def progress(n_bytes):
+        canceled.set()
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(responses.GET, DOWNLOAD_URL, callback=_ranged_callback([]))
+        with pytest.raises(concurrent.futures.CancelledError):
+            download_url(
+                requests.Session(),
+                DOWNLOAD_URL,
+                path,
+                max_connections=4,
+                progress_callback=progress,
+                segment_size=1000,
+                canceled=canceled,
+            )
+
+        # what was downloaded is kept, and the download is resumed next time
+        assert not os.path.exists(path)
+        assert os.path.exists(path + ".part.json")
+
+        download_url(requests.Session(), DOWNLOAD_URL, path, max_connections=4, segment_size=1000)
+
+    with open(path, "rb") as f:
+        assert f.read() == DOWNLOAD_DATA
@@ -7,15 +7,19 @@ from onecodex.input_helpers import (
     auto_detect_pairs,
     concatenate_ont_groups,
 )
-from onecodex.utils import use_tempdir
+from onecodex.lib.files import ConcatenatedFile
 from tests.conftest import FASTQ_SEQUENCE
 
 
+def _get_basename(elem):
+    return elem.filename if isinstance(elem, ConcatenatedFile) else os.path.basename(elem)
+
+
 def _get_basenames(elems):
     return [
-        (os.path.basename(elem[0]), os.path.basename(elem[1]))
+        (_get_basename(elem[0]), _get_basename(elem[1]))
         if isinstance(elem, tuple)
-        else os.path.basename(elem)
+        else _get_basename(elem)
         for elem in elems
     ]
 
@@ -91,17 +95,17 @@ def test_concatenate_multilane_files(generate_fastq):
     non_multilane = [("Sample3_R1.fq", "Sample3_R2.fq"), "Sample3.fq"]
     files = pairs + singles + non_multilane
 
-    with use_tempdir() as tempdir:
-        concatenated = concatenate_multilane_files(files, prompt=False, tempdir=tempdir)
+    concatenated = concatenate_multilane_files(files, prompt=False)
 
-        basenames = _get_basenames(concatenated)
-        assert basenames == non_multilane + ["Sample2.fq", ("Sample1_R1.fq", "Sample1_R2.fq")]
+    basenames = _get_basenames(concatenated)
+    assert basenames == non_multilane + ["Sample2.fq", ("Sample1_R1.fq", "Sample1_R2.fq")]
 
-        with open(concatenated[len(non_multilane)], "r") as inf:
-            assert inf.read() == len(singles) * FASTQ_SEQUENCE
+    concat = concatenated[len(non_multilane)]
+    assert concat.read().decode("utf-8") == len(singles) * FASTQ_SEQUENCE
+    assert concat.file_paths == singles
 
-        with open(concatenated[len(non_multilane) + 1][0], "r") as inf:
-            assert inf.read() == len(pairs) * FASTQ_SEQUENCE
+    concat = concatenated[len(non_multilane) + 1][0]
+    assert concat.read().decode("utf-8") == len(pairs) * FASTQ_SEQUENCE
 
 
 def test_concatenate_gzipped_multilane_files(generate_fastq_gz):
@@ -110,12 +114,10 @@ def test_concatenate_gzipped_multilane_files(generate_fastq_gz):
         generate_fastq_gz("Sample2_L002.fq.gz"),
         generate_fastq_gz("Sample2_L003.fq.gz"),
     ]
-    with use_tempdir() as tempdir:
-        concatenated = concatenate_multilane_files(files, prompt=False, tempdir=tempdir)
-        assert len(concatenated) == 1
-        with gzip.open(concatenated[0], "r") as fin:
-            assert fin.read() == len(files) * FASTQ_SEQUENCE.encode("utf-8")
-    assert not os.path.exists(concatenated[0])
+    concatenated = concatenate_multilane_files(files, prompt=False)
+    assert len(concatenated) == 1
+    with gzip.GzipFile(fileobj=concatenated[0], mode="rb") as fin:
+        assert fin.read() == len(files) * FASTQ_SEQUENCE.encode("utf-8")
 
 
 @pytest.mark.parametrize(
@@ -153,19 +155,42 @@ def test_concatenate_gzipped_multilane_files(generate_fastq_gz):
 )
 def test_concatenate_ont_groups(generate_fastq, files, expected_grouping):
     files = [generate_fastq(x) for x in files]
-    with use_tempdir() as tempdir:
-        pairs = concatenate_ont_groups(files, prompt=False, tempdir=tempdir)
-        basenames = _get_basenames(pairs)
-        assert sorted(basenames) == sorted(expected_grouping)
+    pairs = concatenate_ont_groups(files, prompt=False)
+    basenames = _get_basenames(pairs)
+    assert sorted(basenames) == sorted(expected_grouping)
 
 
 def test_concatenate_ont_group_inform_about_missing_file(generate_fastq, caplog):
     filenames = ["test_0.fq", "test_1.fq", "test_3.fq"]
     files = [generate_fastq(x) for x in filenames]
-    with use_tempdir() as tempdir:
-        pairs = concatenate_ont_groups(files, prompt=False, tempdir=tempdir)
-        assert len(pairs) == len(filenames)
-        assert (
-            "Detected a gap in the ONT file sequence for test.fq, missing file: test_2.fq"
-            in caplog.text
-        )
+    pairs = concatenate_ont_groups(files, prompt=False)
+    assert len(pairs) == len(filenames)
+    assert (
+        "Detected a gap in the ONT file sequence for test.fq, missing file: test_2.fq"
+        in caplog.text
+    )
+
+
+def test_concatenated_file_read_and_seek(generate_fastq):
+    files = [generate_fastq("Sample_L001.fq"), generate_fastq("Sample_L002.fq")]
+    expected = (len(files) * FASTQ_SEQUENCE).encode("utf-8")
+
+    concat = ConcatenatedFile(files, "Sample.fq")
+    assert concat.size() == len(expected)
+
+    # reads may span the boundary between files
+    chunks = []
+    while True:
+        chunk = concat.read(7)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b"".join(chunks) == expected
+    assert concat.tell() == len(expected)
+
+    offset = len(FASTQ_SEQUENCE) - 3
+    concat.seek(offset)
+    assert concat.read(10) == expected[offset : offset + 10]
+    concat.seek(-5, os.SEEK_END)
+    assert concat.read() == expected[-5:]
+    concat.close()
@@ -237,3 +237,256 @@ def test_subset_reads(
                 (paired, subset_pairs_independently, with_children, exclude_reads, include_lowconf)
             ]
         )
+
+
+def _readlevel_tsv(rows, passed_filter=True):
+    import gzip
+    import io
+
+    header = ["Header", "Tax ID"] + (["Passed Filter"] if passed_filter else [])
+    lines = ["\t".join(header)]
+    for idx, (tax_id, passed) in enumerate(rows):
+        lines.append(
+            "\t".join(["read{}".format(idx), tax_id] + ([passed] if passed_filter else []))
+        )
+
+    return io.BytesIO(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+
+
+@pytest.mark.parametrize("use_pandas", [True, False])
+def test_readlevel_bin_masks(monkeypatch, use_pandas):
+    import sys
+
+    from onecodex.exceptions import ValidationError
+    from onecodex.scripts.subset_reads import readlevel_bin_masks
+
+    if not use_pandas:
+        monkeypatch.setitem(sys.modules, "pandas", None)
+
+    rows = [("816", "T"), ("2", "T"), ("816", "F"), ("816", "T"), ("", "T"), ("2", "T")]
+    bins = {"a": {"816"}, "b": {"2", "816"}}
+
+    masks = readlevel_bin_masks(_readlevel_tsv(rows), bins, chunksize=4)
+    assert [{k: list(m) for k, m in block.items()} for block in masks] == [
+        {"a": [True, False, False, True], "b": [True, True, False, True]},
+        {"a": [False, False], "b": [False, True]},
+    ]
+
+    masks = readlevel_bin_masks(
+        _readlevel_tsv(rows), bins, exclude_reads=True, include_lowconf=True, chunksize=4
+    )
+    assert [list(block["a"]) for block in masks] == [[False, True, False, False], [True, True]]
+
+    # without a Passed Filter column, every read is treated as high confidence
+    masks = readlevel_bin_masks(_readlevel_tsv(rows, passed_filter=False), bins, chunksize=4)
+    assert [list(block["a"]) for block in masks] == [[True, False, True, True], [False, False]]
+
+    masks = readlevel_bin_masks(_readlevel_tsv(rows), bins, paired=True, chunksize=4)
+    assert [(list(f), list(r)) for f, r in (block["a"] for block in masks)] == [
+        ([True, True], [True, True]),
+        ([False], [False]),
+    ]
+
+    masks = readlevel_bin_masks(
+        _readlevel_tsv(rows), bins, paired=True, subset_pairs_independently=True, chunksize=4
+    )
+    assert [(list(f), list(r)) for f, r in (block["a"] for block in masks)] == [
+        ([True, False], [False, True]),
+        ([False], [False]),
+    ]
+
+    with pytest.raises(ValidationError, match="odd number of records"):
+        list(readlevel_bin_masks(_readlevel_tsv(rows[:5]), bins, paired=True, chunksize=4))
+
+
+@pytest.mark.parametrize("ext", ["", ".gz", ".bz2"])
+def test_fastfastq_frames_records_across_blocks(tmp_path, monkeypatch, ext):
+    import bz2
+    import gzip
+
+    from onecodex.scripts import subset_reads
+
+    records = [
+        "@read{}\n{}\n+\n{}\n".format(idx, "ACGT" * (idx + 1), "I" * 4 * (idx + 1)).encode()
+        for idx in range(20)
+    ]
+    # the last record doesn't end with a newline
+    data = b"".join(records)[:-1]
+
+    path = str(tmp_path / ("reads.fastq" + ext))
+    open_func = {"": open, ".gz": gzip.open, ".bz2": bz2.open}[ext]
+    with open_func(path, "wb") as f:
+        f.write(data)
+
+    # force the Python decompression subprocess, and blocks that split records and lines
+    monkeypatch.setattr(subset_reads.shutil, "which", lambda tool: None)
+    monkeypatch.setattr(subset_reads, "FASTQ_BLOCK_SIZE", 7)
+
+    assert list(subset_reads.fastfastq(path)) == records[:-1] + [records[-1][:-1]]
+
+
+def test_subset_reads_compress_output(runner, api_data, mocked_creds_file):
+    import gzip
+
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    data_dir = os.path.join(basedir, "data/files")
+    files = [
+        "test_paired_filtering_001.fastq.gz.results.tsv.gz",
+        "test_paired_filtering_R1_001.fastq.gz",
+        "test_paired_filtering_R2_001.fastq.gz",
+    ]
+    outfiles = [
+        "test_paired_filtering_R1_001.filtered.fastq",
+        "test_paired_filtering_R2_001.filtered.fastq",
+    ]
+    args = [
+        "scripts",
+        "subset_reads",
+        "bef0bc57dd7f4c43",
+        "test_paired_filtering_R1_001.fastq.gz",
+        "-r",
+        "test_paired_filtering_R2_001.fastq.gz",
+        "-t",
+        "816",
+    ]
+
+    with runner.isolated_filesystem():
+        for f in files:
+            shutil.copy(os.path.join(data_dir, f), os.getcwd())
+
+        runner.invoke(Cli, args, catch_exceptions=False)
+        runner.invoke(Cli, args + ["--compress-output"], catch_exceptions=False)
+
+        for f in outfiles:
+            with open(f, "rb") as uncompressed, gzip.open(f + ".gz", "rb") as compressed:
+                assert compressed.read() == uncompressed.read()
+
+
+def test_parse_bins(tmp_path):
+    from onecodex.exceptions import OneCodexException
+    from onecodex.scripts.subset_reads import parse_bins
+
+    bins_file = tmp_path / "bins.tsv"
+    bins_file.write_text("# name\ttax IDs\nbacteroides\t816\n\nclostridia\t186802,1720194\n")
+
+    assert parse_bins(["bacteroides:171549", "other:301302"], str(bins_file)) == {
+        "bacteroides": ["171549", "816"],
+        "other": ["301302"],
+        "clostridia": ["186802", "1720194"],
+    }
+
+    for bad_bin in ["816", "no/slashes:816", "empty:"]:
+        with pytest.raises(OneCodexException):
+            parse_bins([bad_bin])
+
+
+@pytest.mark.parametrize("paired", [False, True])
+def test_subset_reads_bins(runner, api_data, mocked_creds_file, paired):
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    data_dir = os.path.join(basedir, "data/files")
+    if paired:
+        files = [
+            "test_paired_filtering_001.fastq.gz.results.tsv.gz",
+            "test_paired_filtering_R1_001.fastq.gz",
+            "test_paired_filtering_R2_001.fastq.gz",
+        ]
+        args = ["bef0bc57dd7f4c43", files[1], "-r", files[2]]
+        prefixes = ["test_paired_filtering_R1_001", "test_paired_filtering_R2_001"]
+    else:
+        files = [
+            "test_single_filtering_001.fastq.gz",
+            "test_single_filtering_001.fastq.gz.results.tsv.gz",
+        ]
+        args = ["0f4ee4ecb3a3412f", files[0]]
+        prefixes = ["test_single_filtering_001"]
+    args = ["scripts", "subset_reads"] + args
+    bins = {"bacteroides": ["816"], "mixed": ["816", "171549", "186802"]}
+
+    with runner.isolated_filesystem():
+        for f in files:
+            shutil.copy(os.path.join(data_dir, f), os.getcwd())
+
+        # each bin should match a separate run with the same tax IDs
+        expected = {}
+        for name, tax_ids in bins.items():
+            tax_id_args = [arg for tax_id in tax_ids for arg in ("-t", tax_id)]
+            result = runner.invoke(Cli, args + tax_id_args, catch_exceptions=False)
+            assert result.exit_code == 0
+
+            for prefix in prefixes:
+                with open(prefix + ".filtered.fastq", "rb") as f:
+                    expected[(prefix, name)] = f.read()
+
+        bin_args = [
+            arg
+            for name, tax_ids in bins.items()
+            for arg in ("--bin", name + ":" + ",".join(tax_ids))
+        ]
+        result = runner.invoke(Cli, args + bin_args, catch_exceptions=False)
+        assert result.exit_code == 0
+
+        for (prefix, name), contents in expected.items():
+            with open("{}.{}.fastq".format(prefix, name), "rb") as f:
+                assert f.read() == contents
+        assert expected[(prefixes[0], "bacteroides")] != expected[(prefixes[0], "mixed")]
+
+        result = runner.invoke(Cli, args + ["-t", "816", "--bin", "bacteroides:816"])
+        assert result.exit_code != 0
+        assert "not both" in result.output
+
+
+def _fastq_records(path):
+    import gzip
+
+    with gzip.open(path, "rb") as f:
+        lines = f.readlines()
+    return [b"".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+
+
+def test_subset_reads_short_fastx(runner, api_data, mocked_creds_file):
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    data_dir = os.path.join(basedir, "data/files")
+    files = [
+        "test_single_filtering_001.fastq.gz",
+        "test_single_filtering_001.fastq.gz.results.tsv.gz",
+    ]
+    args = ["scripts", "subset_reads", "0f4ee4ecb3a3412f"]
+
+    with runner.isolated_filesystem():
+        for f in files:
+            shutil.copy(os.path.join(data_dir, f), os.getcwd())
+
+        runner.invoke(Cli, args + [files[0], "-t", "816"], catch_exceptions=False)
+        with open("test_single_filtering_001.filtered.fastq", "rb") as f:
+            kept = f.read()
+
+        # a FASTX file with fewer records than the results is subset up to its end
+        records = _fastq_records(files[0])[:5]
+        with open("short.fastq", "wb") as f:
+            f.write(b"".join(records))
+
+        for validate_args in ([], ["--do-not-validate"]):
+            result = runner.invoke(
+                Cli, args + ["short.fastq", "-t", "816"] + validate_args, catch_exceptions=False
+            )
+            assert result.exit_code == 0
+
+            with open("short.filtered.fastq", "rb") as f:
+                assert f.read() == b"".join(record for record in records if record in kept)
+
+
+def test_subset_reads_empty_fastx(runner, api_data, mocked_creds_file):
+    with runner.isolated_filesystem():
+        with open("test_single_filtering_001.fastq.gz.results.tsv.gz", "wb") as f:
+            f.write(_readlevel_tsv([]).getvalue())
+        open("empty.fastq", "wb").close()
+
+        result = runner.invoke(
+            Cli,
+            ["scripts", "subset_reads", "0f4ee4ecb3a3412f", "empty.fastq", "-t", "816"],
+            catch_exceptions=False,
+        )
+        assert result.exit_code == 0
+
+        with open("empty.filtered.fastq", "rb") as f:
+            assert f.read() == b""
@@ -32,3 +32,114 @@ def test_tree_pruning(samples):
 
     for tax_id in ["1", "131567", "2", "1783272", "1239", "91061", "1385", "90964", "1279"]:
         pruned_tree.find(tax_id)
+
+
+def test_taxonomy_table(samples):
+    import numpy as np
+    import pandas as pd
+
+    from onecodex.taxonomy import NO_LEVEL, NO_PARENT, TaxonomyTable
+
+    table = samples._taxonomy_table
+    assert len(table) == len(samples.taxonomy)
+    assert table.levels.dtype == np.int8
+    assert table.parents.dtype == np.int32
+
+    # the DataFrame is a view of the same data, and the table can be rebuilt from it
+    pd.testing.assert_frame_equal(
+        TaxonomyTable.from_frame(samples.taxonomy).to_frame(), samples.taxonomy
+    )
+
+    staph, root = table.positions(["1279", "1"])
+    assert table.names[staph] == "Staphylococcus"
+    assert table.index[table.parents[staph]] == "90964"
+    assert table.parents[root] == NO_PARENT
+    assert table.levels[root] == NO_LEVEL
+
+    assert table.levels_of(["1280", "1279", "does_not_exist"]).tolist() == [0, 1, NO_LEVEL]
+
+    subset = table.take(table.positions(["1279", "1280"]))
+    assert subset.index.tolist() == ["1279", "1280"]
+    assert subset.parents.tolist() == [NO_PARENT, 0]
+
+
+def test_taxonomy_table_ancestors(samples):
+    from onecodex.lib.enums import Rank
+    from onecodex.taxonomy import NO_PARENT
+
+    table = samples._taxonomy_table
+    tree = samples.tree_build()
+
+    # pruning to a set of taxa matches pruning the tree
+    pruned = samples.tree_prune_tax_ids(tree, ["1279", "1280", "816"])
+    keep = table.ancestors_mask(table.positions(["1279", "1280", "816"]))
+    assert set(table.index[keep]) == {node.name for node in pruned.traverse()}
+    assert not table.ancestors_mask(table.positions(["1279"]), include_self=False)[
+        table.positions(["1279"])[0]
+    ]
+
+    # ancestor at rank
+    genus = table.ancestor_at_level(Rank.Genus.level)
+    staph, staph_aureus, root = table.positions(["1279", "1280", "1"])
+    assert genus[staph] == genus[staph_aureus] == staph
+    assert genus[root] == NO_PARENT
+
+
+def test_taxonomy_table_highest_unclassified():
+    from onecodex.lib.enums import Rank
+    from onecodex.taxonomy import NO_PARENT, TaxonomyTable
+
+    # root -> Bacteria -> family -> genus -> species
+    #                            \-> (no rank) -> species without a genus
+    table = TaxonomyTable(
+        ["1", "2", "10", "11", "12", "13", "14"],
+        ["root", "Bacteria", "fam", "gen", "gen sp", "unclassified fam", "fam sp"],
+        ["no rank", "superkingdom", "family", "genus", "species", "no rank", "species"],
+        [None, "1", "2", "10", "11", "10", "13"],
+    )
+
+    highest = table.highest_unclassified_at_level(Rank.Genus.level)
+    gen, gen_sp, unclassified, fam_sp = table.positions(["11", "12", "13", "14"])
+    assert highest[gen] == highest[gen_sp] == NO_PARENT
+    assert highest[fam_sp] == fam_sp
+    assert highest[unclassified] == unclassified
+
+
+def test_taxonomy_table_search_name():
+    from onecodex.taxonomy import NO_PARENT, TaxonomyTable
+
+    table = TaxonomyTable(
+        ["1", "1280", "1279", "29380", "61015"],
+        ["root", "Staphylococcus aureus", "Staphylococcus", "Staphylococcus hominis", "Staph"],
+        ["no rank", "species", "genus", "species", "no rank"],
+        [None, "1279", "1", "1279", "1"],
+    )
+
+    # exact matches are case-insensitive and win over partial matches
+    assert table.index[table.search_name("STAPHYLOCOCCUS")] == "1279"
+    assert table.index[table.search_name("staph")] == "61015"
+
+    # otherwise, the partial match with the lowest tax ID
+    assert table.index[table.search_name("ococcus ")] == "1280"
+    assert table.index[table.search_name("hominis")] == "29380"
+    assert table.search_name("streptococcus") == NO_PARENT
+
+
+def test_taxonomy_table_lineage_matrix():
+    from onecodex.taxonomy import TaxonomyTable
+
+    table = TaxonomyTable(
+        ["1", "2", "10", "11", "12", "20"],
+        ["root", "Bacteria", "fam", "gen", "gen sp", "other fam"],
+        ["no rank", "superkingdom", "family", "genus", "species", "family"],
+        [None, "1", "2", "10", "11", "2"],
+    )
+
+    matrix, nodes = table.lineage_matrix(table.positions(["12", "20"]))
+    assert table.index[nodes].tolist() == ["1", "2", "10", "11", "12", "20"]
+    assert matrix.toarray().tolist() == [[1, 1, 1, 1, 1, 0], [1, 1, 0, 0, 0, 1]]
+
+    # pruned to the lineages of the given taxa, and cached
+    matrix, nodes = table.lineage_matrix(table.positions(["10"]))
+    assert table.index[nodes].tolist() == ["1", "2", "10"]
+    assert table.lineage_matrix(table.positions(["10"]))[0] is matrix
@@ -3,19 +3,27 @@ from collections import OrderedDict
 from io import BytesIO
 from mock import patch
 import pytest
+import threading
+import time
 from requests_toolbelt import MultipartEncoder
 from requests.exceptions import HTTPError
 
 from onecodex.exceptions import OneCodexException, UploadException
+from onecodex.lib.files import GzipCompressedPassthru
+from onecodex.lib.resume import UploadManifest
+from onecodex.lib.scheduler import TokenBucket, UploadScheduler
 from onecodex.lib.upload import (
     _choose_boto3_chunksize,
+    _s3_multipart_upload,
     FilePassthru,
+    MAX_PART_ATTEMPTS,
     upload_document,
     _upload_document_fileobj,
     upload_asset,
     upload_sequence,
     _upload_sequence_fileobj,
 )
+from onecodex.utils import FakeProgressBar
 
 
 class FakeAPISession:
@@ -83,6 +91,7 @@ class FakeSamplesResource:
             self.err_resp()
 
         return {
+            "sample_id": obj.get("sample_id") or "new_sample_id",
             "callback_url": "/s3_confirm",
             "s3_bucket": "some_bucket",
             "file_id": "hey",
@@ -324,3 +333,297 @@ def test_boto3_chunksize():
     assert (
         _choose_boto3_chunksize(open("tests/data/files/test_R1_L001.fq.gz", "r")) == 25 * 1024**2
     )
+
+
+class FakeS3Client:
+    def __init__(self, fail_parts=None):
+        self.fail_parts = dict(fail_parts or {})
+        self.calls = []
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.put = None
+
+    def _error(self, operation):
+        from botocore.exceptions import ClientError
+
+        return ClientError({"Error": {"Code": "RequestTimeout", "Message": "slow"}}, operation)
+
+    def put_object(self, **kwargs):
+        self.put = kwargs["Body"]
+        return {}
+
+    def create_multipart_upload(self, **kwargs):
+        assert kwargs["ServerSideEncryption"] == "AES256"
+        return {"UploadId": "upload-id"}
+
+    def upload_part(self, **kwargs):
+        part_number = kwargs["PartNumber"]
+        self.calls.append(part_number)
+
+        if self.fail_parts.get(part_number, 0) > 0:
+            self.fail_parts[part_number] -= 1
+            raise self._error("UploadPart")
+
+        self.parts[part_number] = kwargs["Body"]
+        return {"ETag": "etag-{}".format(part_number)}
+
+    def list_parts(self, **kwargs):
+        return {
+            "Parts": [
+                {"PartNumber": n, "ETag": "etag-{}".format(n), "Size": len(body)}
+                for n, body in sorted(self.parts.items())
+            ],
+            "IsTruncated": False,
+        }
+
+    def complete_multipart_upload(self, **kwargs):
+        self.completed = kwargs["MultipartUpload"]["Parts"]
+        return {}
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+        return {}
+
+
+def test_s3_multipart_upload_retries_failed_part_only():
+    client = FakeS3Client(fail_parts={2: 1})
+    progress = []
+    data = b"ACGTACGTAC" * 10
+
+    with patch("time.sleep"):
+        _s3_multipart_upload(
+            client,
+            BytesIO(data),
+            "test.fa",
+            "bucket",
+            "key",
+            7,
+            max_concurrency=3,
+            progress_callback=progress.append,
+        )
+
+    n_parts = len(range(0, len(data), 7))
+    assert sorted(client.calls) == sorted(list(range(1, n_parts + 1)) + [2])
+    assert [p["PartNumber"] for p in client.completed] == list(range(1, n_parts + 1))
+    assert client.completed[1]["ETag"] == "etag-2"
+    assert b"".join(client.parts[i] for i in range(1, n_parts + 1)) == data
+    assert sum(progress) == len(data)
+    assert client.aborted is False
+
+
+def test_s3_multipart_upload_exhausted_retries():
+    client = FakeS3Client(fail_parts={3: MAX_PART_ATTEMPTS})
+
+    with patch("time.sleep"), pytest.raises(UploadException) as e:
+        _s3_multipart_upload(client, BytesIO(b"A" * 100), "test.fa", "bucket", "key", 10)
+
+    assert "connectivity issues" in str(e.value)
+    assert client.calls.count(3) == MAX_PART_ATTEMPTS
+    assert client.completed is None
+    assert client.aborted is True
+
+
+def test_s3_multipart_upload_single_part():
+    client = FakeS3Client()
+    _s3_multipart_upload(client, BytesIO(b">test\nACGT\n"), "test.fa", "bucket", "key", 1024)
+    assert client.put == b">test\nACGT\n"
+    assert client.calls == []
+
+
+def test_s3_multipart_upload_resume(tmpdir):
+    path = tmpdir.join("test.fq")
+    data = b"ACGTACGTAC" * 10
+    path.write_binary(data)
+
+    # first attempt dies on part 4, leaving parts 1-3 on S3 and in the manifest
+    client = FakeS3Client(fail_parts={4: MAX_PART_ATTEMPTS})
+    manifest = UploadManifest.load(str(path), state_dir=str(tmpdir))
+    manifest.bind("sample_id", "bucket", "key")
+
+    with patch("time.sleep"), pytest.raises(UploadException):
+        _s3_multipart_upload(
+            client,
+            FilePassthru(str(path)),
+            "test.fq",
+            "bucket",
+            "key",
+            10,
+            max_concurrency=1,
+            manifest=manifest,
+        )
+
+    assert client.aborted is False
+    assert sorted(UploadManifest.load(str(path), state_dir=str(tmpdir)).parts) == [1, 2, 3]
+
+    # the second attempt only sends the missing parts
+    client.calls = []
+    progress = []
+    manifest = UploadManifest.load(str(path), state_dir=str(tmpdir))
+    manifest.bind("sample_id", "bucket", "key")
+    assert manifest.upload_id == "upload-id"
+
+    _s3_multipart_upload(
+        client,
+        FilePassthru(str(path)),
+        "test.fq",
+        "bucket",
+        "key",
+        10,
+        manifest=manifest,
+        progress_callback=progress.append,
+    )
+
+    assert sorted(client.calls) == list(range(4, 11))
+    assert [p["PartNumber"] for p in client.completed] == list(range(1, 11))
+    assert b"".join(client.parts[i] for i in range(1, 11)) == data
+    assert sum(progress) == len(data)
+    assert UploadManifest.load(str(path), state_dir=str(tmpdir)).completed is True
+
+
+def test_upload_manifest_invalidation(tmpdir):
+    path = tmpdir.join("test.fq")
+    path.write_binary(b"ACGT" * 100)
+
+    manifest = UploadManifest.load(str(path), state_dir=str(tmpdir))
+    manifest.bind("sample_id", "bucket", "key")
+    manifest.start("upload-id", 10)
+    manifest.add_part(1, "etag-1", 10)
+
+    # a different S3 object can't be resumed
+    manifest = UploadManifest.load(str(path), state_dir=str(tmpdir))
+    assert manifest.parts == {1: {"ETag": "etag-1", "Size": 10}}
+    manifest.bind("sample_id", "bucket", "other_key")
+    assert manifest.upload_id is None
+    assert manifest.parts == {}
+
+    # nor can a file that has changed
+    manifest.start("upload-id", 10)
+    path.write_binary(b"TGCA" * 100)
+    manifest = UploadManifest.load(str(path), state_dir=str(tmpdir))
+    assert manifest.upload_id is None
+    assert manifest.sample_id is None
+
+
+def test_upload_sequence_resume_reuses_sample_id(tmpdir, monkeypatch):
+    monkeypatch.setenv("ONE_CODEX_UPLOAD_STATE_DIR", str(tmpdir))
+    path = "tests/data/files/test_R1_L001.fq.gz"
+
+    manifest = UploadManifest.load(path)
+    manifest.bind("previous_sample_id", "some_bucket", "hey")
+
+    resource = FakeSamplesResource()
+    with patch.object(
+        resource, "init_multipart_upload", wraps=resource.init_multipart_upload
+    ) as init, patch("onecodex.lib.upload._upload_sequence_fileobj") as upload_fileobj:
+        upload_sequence(path, resource, resume=True)
+
+    assert init.call_args[0][0]["sample_id"] == "previous_sample_id"
+    assert upload_fileobj.call_args[1]["manifest"].file_path == manifest.file_path
+    assert not tmpdir.listdir(lambda p: p.ext == ".json")
+
+
+def test_gzip_compressed_passthru():
+    import gzip
+
+    path = "tests/data/files/test.fq"
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    bar = FakeProgressBar()
+    bar.update = lambda n: setattr(bar, "pos", getattr(bar, "pos", 0) + n)
+
+    wrapper = GzipCompressedPassthru(path, bar, threads=2, block_size=64)
+    assert wrapper.filename == "test.fq.gz"
+    assert wrapper.mime_type == "application/x-gzip"
+
+    compressed = b""
+    while True:
+        chunk = wrapper.read(100)
+        if not chunk:
+            break
+        compressed += chunk
+
+    assert gzip.decompress(compressed) == raw
+    assert bar.pos == len(raw)
+
+    # seeking re-compresses deterministically
+    wrapper.seek(0)
+    assert bar.pos == 0
+    wrapper.seek(150)
+    assert wrapper.read() == compressed[150:]
+    wrapper.close()
+
+
+def test_upload_sequence_compress():
+    resource = FakeSamplesResource()
+    with patch.object(
+        resource, "init_multipart_upload", wraps=resource.init_multipart_upload
+    ) as init, patch("onecodex.lib.upload._upload_sequence_fileobj") as upload_fileobj:
+        upload_sequence("tests/data/files/test.fq", resource, compress=True)
+        assert init.call_args[0][0]["filename"] == "test.fq.gz"
+        assert isinstance(upload_fileobj.call_args[0][0], GzipCompressedPassthru)
+
+        # already-compressed files are sent as-is
+        upload_sequence("tests/data/files/test_R1_L001.fq.gz", resource, compress=True)
+        assert init.call_args[0][0]["filename"] == "test_R1_L001.fq.gz"
+        assert isinstance(upload_fileobj.call_args[0][0], FilePassthru)
+
+
+class SlowS3Client(FakeS3Client):
+    """Record how many parts are being sent at once, across every upload using this client."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def upload_part(self, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        kwargs["Body"] = kwargs["Body"].read()
+        try:
+            return super().upload_part(**kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def test_upload_scheduler_shares_part_slots():
+    client = SlowS3Client()
+    scheduler = UploadScheduler(max_parts=3, max_bandwidth=10 * 1024**2)
+    data = [b"A" * 100, b"C" * 100]
+
+    threads = [
+        threading.Thread(
+            target=_s3_multipart_upload,
+            args=(client, BytesIO(d), "test.fa", "bucket", "key", 10),
+            kwargs={"scheduler": scheduler},
+        )
+        for d in data
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.shutdown()
+
+    # both files' parts compete for the same 3 slots
+    assert len(client.calls) == 20
+    assert 1 < client.max_active <= 3
+    assert scheduler.acquire(timeout=0) is True
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=10000)
+
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.consume(5000)
+    elapsed = time.monotonic() - start
+
+    # the bucket starts full, so only the last 5000 bytes have to wait for it to refill
+    assert 0.4 <= elapsed < 2
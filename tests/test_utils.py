@@ -10,6 +10,7 @@ from onecodex.utils import (
     snake_case,
     check_for_allowed_file,
     valid_api_key,
+    valid_bandwidth,
     has_missing_values,
     init_sentry,
 )
@@ -42,6 +43,20 @@ def test_is_valid_api_key():
     assert good_key == valid_api_key_partial(good_key)
 
 
+def test_valid_bandwidth():
+    valid_bandwidth_partial = partial(valid_bandwidth, None, None)
+
+    assert valid_bandwidth_partial(None) is None
+    assert valid_bandwidth_partial("1000") == 1000
+    assert valid_bandwidth_partial("500K") == 500 * 1024
+    assert valid_bandwidth_partial("1.5m") == int(1.5 * 1024**2)
+    assert valid_bandwidth_partial("2GB") == 2 * 1024**3
+
+    for rate in ["", "0", "-5M", "fast", "10T"]:
+        with pytest.raises(BadParameter):
+            valid_bandwidth_partial(rate)
+
+
 @pytest.mark.parametrize(
     "resource,uris",
     [
@@ -162,7 +162,7 @@ def test_plot_metadata_secondary_haxis_and_facet_by(samples, plot_type):
 
 
 def test_plot_metadata_alpha_diversity_with_nans(samples):
-    mock_alpha_div_values = samples.alpha_diversity(metric="shannon")
+    mock_alpha_div_values = samples.alpha_diversity(metric="shannon").copy()
     mock_alpha_div_values.iat[1, 0] = np.nan
     mock_alpha_div_values.iat[2, 0] = np.nan
 